@@ -0,0 +1,344 @@
+"""
+Terms stored as arrays, for terms of millions of nodes
+
+Every Term object has its own `__dict__`, a few hundred bytes a node. An
+`Arena` keeps the nodes in parallel `array`s instead, a node is an index
+in them: its kind, two ints whose meaning depends on the kind, and the
+number of enclosing binders it refers to, about 21 bytes a node. Names
+and values are interned in tables, bound variables are de Bruijn indices.
+
+Nodes are never modified. Substitution and evaluation, call by value
+like `eval_term`, work on the arrays and add the nodes they build, the
+nodes that don't contain the substituted variable are shared. `compact`
+copies the nodes that are still reachable to a new arena.
+
+>>> arena = Arena()
+>>> inc = arena.add(Lamb(Var("x"), BinOp("+", Var("x"), Val("1"))))
+>>> arena.term(evaluate(arena, arena.appl(inc, arena.val(41))))
+42
+>>> arena.nbytes() // len(arena)
+21
+"""
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from lampy.lampy import Term, Var, Val, Lamb, Appl, BinOp, AST
+from lampy.utils import EvalStats, fresh_name
+
+# node kinds, the meaning of a and b
+IX = 0  # bound variable, a is the de Bruijn index
+FREE = 1  # free variable, a is the symbol
+VAL = 2  # a is the constant
+LAMB = 3  # a is the symbol of the name it had, b the body
+APPL = 4  # a is the function, b the argument
+BINOP = 5  # BINOP + the index of the operator in OPS, a and b the operands
+
+OPS = list(BinOp.opmap)
+_OPFUNS = [BinOp.opmap[o] for o in OPS]
+
+
+class Arena:
+    def __init__(self):
+        self.kind = array("B")
+        self.a = array("q")
+        self.b = array("q")
+        # enclosing binders the node refers to, 0 for closed nodes
+        self.nfree = array("I")
+        self.symbols: List[str] = []
+        self.consts: List[int] = []
+        self._symbol_ids: Dict[str, int] = {}
+        self._const_ids: Dict[int, int] = {}
+        # variables and values are built once
+        self._leaves: Dict[Tuple[int, int], int] = {}
+
+    def __len__(self):
+        return len(self.kind)
+
+    def nbytes(self) -> int:
+        "Size of the node arrays, the symbol and constant tables aside"
+        return sum(arr.itemsize * len(arr) for arr in (self.kind, self.a, self.b, self.nfree))
+
+    def _node(self, kind: int, a: int, b: int, nfree: int) -> int:
+        self.kind.append(kind)
+        self.a.append(a)
+        self.b.append(b)
+        self.nfree.append(nfree)
+        return len(self.kind) - 1
+
+    def _leaf(self, kind: int, a: int, nfree: int) -> int:
+        n = self._leaves.get((kind, a))
+        if n is None:
+            n = self._leaves[(kind, a)] = self._node(kind, a, 0, nfree)
+        return n
+
+    def symbol(self, name: str) -> int:
+        i = self._symbol_ids.get(name)
+        if i is None:
+            i = self._symbol_ids[name] = len(self.symbols)
+            self.symbols.append(name)
+        return i
+
+    def ix(self, index: int) -> int:
+        return self._leaf(IX, index, index + 1)
+
+    def free(self, name: str) -> int:
+        return self._leaf(FREE, self.symbol(name), 0)
+
+    def val(self, value) -> int:
+        # truncated like Val does
+        value = int(value)
+        i = self._const_ids.get(value)
+        if i is None:
+            i = self._const_ids[value] = len(self.consts)
+            self.consts.append(value)
+        return self._leaf(VAL, i, 0)
+
+    def lamb(self, body: int, hint: int) -> int:
+        return self._node(LAMB, hint, body, max(self.nfree[body] - 1, 0))
+
+    def appl(self, e1: int, e2: int) -> int:
+        return self._node(APPL, e1, e2, max(self.nfree[e1], self.nfree[e2]))
+
+    def binop(self, opindex: int, a: int, b: int) -> int:
+        return self._node(BINOP + opindex, a, b, max(self.nfree[a], self.nfree[b]))
+
+    def add(self, term) -> int:
+        "Add a Term, iteratively, returns its node"
+        if isinstance(term, AST):
+            term = term.root
+        # the depths of the binders of each name, innermost last
+        scope: Dict[str, List[int]] = {}
+        results: List[int] = []
+        stack: list = [(term, 0)]
+        while stack:
+            t, depth = stack.pop()
+            if isinstance(t, str):
+                # leaving a lambda
+                scope[t].pop()
+                results.append(self.lamb(results.pop(), self.symbol(t)))
+            elif isinstance(t, int):
+                b = results.pop()
+                a = results.pop()
+                results.append(self.appl(a, b) if t < 0 else self.binop(t, a, b))
+            elif isinstance(t, Var):
+                if scope.get(t.name):
+                    results.append(self.ix(depth - scope[t.name][-1] - 1))
+                else:
+                    results.append(self.free(t.name))
+            elif isinstance(t, Val):
+                results.append(self.val(t.val))
+            elif isinstance(t, Lamb):
+                scope.setdefault(t.var.name, []).append(depth)
+                stack.append((t.var.name, depth))
+                stack.append((t.body, depth + 1))
+            elif isinstance(t, Appl):
+                stack.append((-1, depth))
+                stack.append((t.e2, depth))
+                stack.append((t.e1, depth))
+            elif isinstance(t, BinOp):
+                stack.append((OPS.index(t.op), depth))
+                stack.append((t.b, depth))
+                stack.append((t.a, depth))
+            else:
+                raise TypeError(f"Can't add {t!r}")
+        return results.pop()
+
+    def term(self, node: int) -> Term:
+        """
+        The Term of a node, binders keep their name unless it would
+        capture another variable
+
+        >>> arena = Arena()
+        >>> k = arena.add(Lamb(Var("x"), Lamb(Var("y"), Var("x"))))
+        >>> arena.term(evaluate(arena, arena.appl(k, arena.free("y"))))
+        (λu.y)
+        """
+        kind, a, b = self.kind, self.a, self.b
+        free = {self.symbols[a[n]] for n in self.reachable([node]) if kind[n] == FREE}
+        scope: List[str] = []
+        in_scope: Dict[str, int] = {}
+        results: List[Term] = []
+        stack: list = [node]
+        while stack:
+            n = stack.pop()
+            if isinstance(n, str):
+                # leaving a lambda
+                scope.pop()
+                in_scope[n] -= 1
+                results.append(Lamb(Var(n), results.pop()))
+                continue
+            elif isinstance(n, tuple):
+                e2 = results.pop()
+                e1 = results.pop()
+                results.append(Appl(e1, e2) if n[0] == APPL else BinOp(OPS[n[0] - BINOP], e1, e2))
+                continue
+            k = kind[n]
+            if k == IX:
+                results.append(Var(scope[-1 - a[n]]))
+            elif k == FREE:
+                results.append(Var(self.symbols[a[n]]))
+            elif k == VAL:
+                results.append(Val(self.consts[a[n]]))
+            elif k == LAMB:
+                name = fresh_name(self.symbols[a[n]], free | {s for s, c in in_scope.items() if c})
+                scope.append(name)
+                in_scope[name] = in_scope.get(name, 0) + 1
+                stack.append(name)
+                stack.append(b[n])
+            else:
+                stack.append((k,))
+                stack.append(b[n])
+                stack.append(a[n])
+        return results.pop()
+
+    def reachable(self, roots: Sequence[int]) -> List[int]:
+        "The nodes reachable from `roots`, children before their parents"
+        kind, a, b = self.kind, self.a, self.b
+        seen = set()
+        order = []
+        stack = [(n, False) for n in roots]
+        while stack:
+            n, expanded = stack.pop()
+            if expanded:
+                order.append(n)
+                continue
+            if n in seen:
+                continue
+            seen.add(n)
+            stack.append((n, True))
+            k = kind[n]
+            if k == LAMB:
+                stack.append((b[n], False))
+            elif k >= APPL:
+                stack.append((b[n], False))
+                stack.append((a[n], False))
+        return order
+
+    def compact(self, roots: Sequence[int]) -> Tuple["Arena", List[int]]:
+        """
+        A new arena with only the nodes reachable from `roots`, sharing is
+        kept. Returns it and the new roots.
+        """
+        res = Arena()
+        new: Dict[int, int] = {}
+        for n in self.reachable(roots):
+            k, a, b = self.kind[n], self.a[n], self.b[n]
+            if k == IX:
+                new[n] = res.ix(a)
+            elif k == FREE:
+                new[n] = res.free(self.symbols[a])
+            elif k == VAL:
+                new[n] = res.val(self.consts[a])
+            elif k == LAMB:
+                new[n] = res.lamb(new[b], res.symbol(self.symbols[a]))
+            elif k == APPL:
+                new[n] = res.appl(new[a], new[b])
+            else:
+                new[n] = res.binop(k - BINOP, new[a], new[b])
+        return res, [new[n] for n in roots]
+
+
+def instantiate(arena: Arena, lam: int, value: int) -> int:
+    """
+    The body of the lambda `lam` with its variable replaced by `value`,
+    iteratively. Only the nodes that refer to the variable are copied,
+    `value` has no unbound indices.
+    """
+    kind, a, b, nfree = arena.kind, arena.a, arena.b, arena.nfree
+    copies: Dict[Tuple[int, int], int] = {}
+    results: List[int] = []
+    stack = [(b[lam], 0, False)]
+    while stack:
+        n, depth, expanded = stack.pop()
+        if nfree[n] <= depth:
+            results.append(n)
+            continue
+        k = kind[n]
+        if k == IX:
+            index = a[n]
+            results.append(value if index == depth else arena.ix(index - 1))
+        elif (n, depth) in copies:
+            results.append(copies[(n, depth)])
+        elif not expanded:
+            stack.append((n, depth, True))
+            if k == LAMB:
+                stack.append((b[n], depth + 1, False))
+            else:
+                stack.append((b[n], depth, False))
+                stack.append((a[n], depth, False))
+        else:
+            if k == LAMB:
+                res = arena.lamb(results.pop(), a[n])
+            else:
+                e2 = results.pop()
+                e1 = results.pop()
+                res = arena.appl(e1, e2) if k == APPL else arena.binop(k - BINOP, e1, e2)
+            copies[(n, depth)] = res
+            results.append(res)
+    return results.pop()
+
+
+# evaluate frames
+_EVAL_E1 = 0  # evaluating the function of an application
+_EVAL_E2 = 1  # evaluating the argument, the function value is kept
+_EVAL_A = 2  # evaluating the left side of a BinOp
+_EVAL_B = 3  # evaluating the right side, the left value is kept
+
+
+def evaluate(arena: Arena, node: int, stats: Optional[EvalStats] = None) -> int:
+    """
+    Call by value evaluation of a closed node, the strategy of
+    `eval_term`, without recursion. Returns the node of the value, a
+    stuck application or BinOp is its own value.
+    """
+    kind, a, b = arena.kind, arena.a, arena.b
+    consts = arena.consts
+    stack: List[Tuple[int, int, int]] = []
+    n = node
+    while True:
+        # walk down to the leftmost subterm that can't be split
+        while True:
+            k = kind[n]
+            if k == APPL:
+                stack.append((_EVAL_E1, n, 0))
+            elif k >= BINOP:
+                stack.append((_EVAL_A, n, 0))
+            else:
+                break
+            n = a[n]
+        if stats is not None and len(stack) > stats.max_depth:
+            stats.max_depth = len(stack)
+        value = n
+
+        # return the value to the pending frames
+        while stack:
+            frame, n, v = stack.pop()
+            if frame == _EVAL_E1:
+                stack.append((_EVAL_E2, n, value))
+                n = b[n]
+                break
+            elif frame == _EVAL_E2:
+                if kind[v] == LAMB:
+                    if stats is not None:
+                        stats.beta += 1
+                    n = instantiate(arena, v, value)
+                    break
+                value = n
+            elif frame == _EVAL_A:
+                stack.append((_EVAL_B, n, value))
+                n = b[n]
+                break
+            elif kind[v] == VAL and kind[value] == VAL:
+                if stats is not None:
+                    stats.binops += 1
+                value = arena.val(_OPFUNS[kind[n] - BINOP](consts[a[v]], consts[a[value]]))
+            else:
+                value = n
+        else:
+            return value
+
+
+def normalize(term: Term) -> Term:
+    "Entry point used by `AST.eval(engine=\"arena\")`"
+    arena = Arena()
+    return arena.term(evaluate(arena, arena.add(term)))
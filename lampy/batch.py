@@ -0,0 +1,144 @@
+"""
+Evaluate a lampy.lampy term over NumPy arrays of inputs
+
+`batch_eval((x) => x * 2 + 1, xs)` binds the leading parameters of the
+term to the arrays and runs every `BinOp` once, as a ufunc over the whole
+array, instead of evaluating the term once per element. Subterms that
+are not arithmetic, applications that survive normalization or
+lambdas, are evaluated per element with the cek engine.
+
+Numbers are int64 in the arrays, an operation whose result doesn't fit
+is done per element too, with the Python ints `eval_term` uses.
+
+numpy is only imported when a batch is evaluated, so lampy doesn't
+depend on it.
+"""
+from typing import Dict, List, Tuple
+
+from lampy.lampy import Term, Var, Val, Lamb, Appl, BinOp, AST
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError as e:
+        raise ImportError("batch evaluation needs numpy, pip install numpy") from e
+    return numpy
+
+
+def params(term: Term, n: int) -> Tuple[List[Var], Term]:
+    """
+    Split the `n` leading lambda parameters from the body
+
+    >>> params(Lamb(Var("x"), Lamb(Var("y"), BinOp("+", Var("x"), Var("y")))), 1)
+    ([x], (λy.x + y))
+    """
+    res = []
+    for _ in range(n):
+        if not isinstance(term, Lamb):
+            raise TypeError(f"{term} takes only {len(res)} arguments, not {n}")
+        res.append(term.var)
+        term = term.body
+    return res, term
+
+
+def is_arithmetic(term: Term) -> bool:
+    """
+    True if the term is only made of variables, values and `BinOp`s
+
+    >>> is_arithmetic(BinOp("+", BinOp("*", Var("x"), Val("2")), Val("1")))
+    True
+    >>> is_arithmetic(BinOp("+", Appl(Var("f"), Var("x")), Val("1")))
+    False
+    """
+    stack = [term]
+    while stack:
+        t = stack.pop()
+        if isinstance(t, BinOp):
+            stack.append(t.a)
+            stack.append(t.b)
+        elif not isinstance(t, (Var, Val)):
+            return False
+    return True
+
+
+def _trunc(np, x):
+    # Val truncates every result to an int, do the same for whole arrays
+    x = np.asarray(x)
+    if x.dtype.kind != "i":
+        x = np.trunc(x).astype(np.int64)
+    return x
+
+
+def _per_element(np, term: Term, env: Dict[str, "np.ndarray"]):
+    names = [n for n in env if n in term.fv]
+    arrays = np.broadcast_arrays(*[env[n] for n in names])
+    shape = arrays[0].shape if arrays else ()
+    out = []
+    for idx in np.ndindex(shape):
+        t = term
+        for name, arr in zip(names, arrays):
+            t = t.replace(Var(name), Val(arr[idx]))
+        out.append(AST(t).eval(engine="cek"))
+    if all(isinstance(t, Val) for t in out):
+        out = [t.val for t in out]
+        if all(-(2**63) <= v < 2**63 for v in out):
+            return np.array(out, dtype=np.int64).reshape(shape)
+    res = np.empty(len(out), dtype=object)
+    res[:] = out
+    return res.reshape(shape)
+
+
+def _vectorize(np, term: Term, env: Dict[str, "np.ndarray"]):
+    if isinstance(term, Val):
+        return term.val
+    elif isinstance(term, Var):
+        if term.name not in env:
+            raise TypeError(f"{term} is free, batch terms must be closed")
+        return env[term.name]
+    elif isinstance(term, BinOp):
+        a = _vectorize(np, term.a, env)
+        b = _vectorize(np, term.b, env)
+        if isinstance(a, np.ndarray) and a.dtype == object:
+            return _per_element(np, term, env)
+        if isinstance(b, np.ndarray) and b.dtype == object:
+            return _per_element(np, term, env)
+        if term.op == "/" and np.any(np.asarray(b) == 0):
+            raise ZeroDivisionError("division by zero")
+        # int64 wraps around silently, the same operation on floats tells
+        # if it would have
+        wide = term.opfun(np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64))
+        if np.any(np.abs(wide) >= 2.0**63):
+            return _per_element(np, term, env)
+        return _trunc(np, term.opfun(a, b))
+    return _per_element(np, term, env)
+
+
+def batch_eval(term: Term, *arrays):
+    """
+    Apply a closed term to arrays, element wise, the result is an int64
+    array, or an object array if some elements don't fit in an int64 or
+    don't reduce to a value. The arrays are broadcast against each other, so
+    `batch_eval(parse("(x) => x * 2 + 1;")[0], numpy.arange(3))` gives
+    `array([1, 3, 5])`.
+    """
+    np = _numpy()
+    if isinstance(term, AST):
+        term = term.root
+    if term.fv:
+        raise TypeError(f"{term} is open, batch terms must be closed")
+    _, body = params(term, len(arrays))
+    if not is_arithmetic(body):
+        # reduce what can be reduced once, symbolically, before going
+        # element by element
+        from lampy.nbe import normalize
+
+        term = normalize(term)
+    vars_, body = params(term, len(arrays))
+    env = {v.name: _trunc(np, a) for v, a in zip(vars_, arrays)}
+    res = _vectorize(np, body, env)
+    shape = np.broadcast_shapes(*[a.shape for a in env.values()])
+    if np.shape(res) != shape:
+        # constant bodies and bodies that ignore some of the arrays
+        res = np.broadcast_to(res, shape).copy()
+    return res
@@ -0,0 +1,154 @@
+"""
+Benchmarks of the evaluators and of `lampy.serialize`
+
+    python -m lampy.bench
+
+prints the best of a few runs of every evaluator on every workload, the
+bytecode of `lampy.vm` compiled once and run next to `AST.eval`, and the
+time and size of the binary encoding next to pickle. The workloads
+are built with `lampy.parser`, the functions here return plain numbers
+so they can be used from tests or notebooks too.
+"""
+import pickle
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+from lampy.lampy import Term, Var, Val, Lamb, Appl, BinOp, AST
+from lampy.parser import parse
+from lampy.serialize import dumps, loads
+from lampy import vm
+
+
+def church(n: int) -> str:
+    return "((f, x) => " + "f (" * n + "x" + ")" * n + ")"
+
+
+def heavy(n=8) -> str:
+    "A closed term that takes 2^n beta steps"
+    return f"(((n) => n ((y) => y + 1) 0) ({church(n)} {church(2)}))"
+
+
+def shared_in_body(calls=8, n=8) -> Term:
+    """
+    A function called `calls` times whose body has a closed, expensive
+    subterm, substitution evaluates it at every call
+    """
+    body = "d (" * calls + "0" + ")" * calls
+    return parse(f"((d) => {body}) ((x) => x + {heavy(n)});")[0].root
+
+
+def shared_argument(uses=8, n=8) -> Term:
+    "An expensive argument used `uses` times"
+    body = " + ".join(["a"] * uses)
+    return parse(f"((a) => {body}) {heavy(n)};")[0].root
+
+
+def deep(n=5000) -> Term:
+    "`n` nested applications, deeper than the recursion limit"
+    term: Term = Val(0)
+    for _ in range(n):
+        term = Appl(Lamb(Var("x"), BinOp("+", Var("x"), Val(1))), term)
+    return term
+
+
+def wide(depth=14) -> Term:
+    "A balanced tree of BinOps of 2^`depth` leaves, shallow enough for pickle"
+    terms: List[Term] = [Appl(Lamb(Var("x"), Var("x")), Val(i)) for i in range(2 ** depth)]
+    while len(terms) > 1:
+        terms = [BinOp("+", a, b) for a, b in zip(terms[::2], terms[1::2])]
+    return terms[0]
+
+
+WORKLOADS: Dict[str, Callable[[], Term]] = {
+    "shared_in_body": shared_in_body,
+    "shared_argument": shared_argument,
+}
+
+ENGINES = ["subst", "need", "graph", "vm"]
+
+
+def best(fn: Callable[[], object], repeat=3) -> float:
+    "Best wall time of `repeat` runs, in seconds"
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run(workloads=WORKLOADS, engines=ENGINES, repeat=3) -> List[Tuple[str, str, float]]:
+    rows = []
+    for name, make in workloads.items():
+        term = make()
+        for engine in engines:
+            rows.append((name, engine, best(lambda: AST(term).eval(engine=engine), repeat)))
+    return rows
+
+
+def bytecode(workloads=WORKLOADS, repeat=3) -> List[Tuple[str, str, float]]:
+    """
+    `AST.eval` next to `lampy.vm`, compiling and running apart, a
+    program can be run many times
+    """
+    rows = []
+    for name, make in workloads.items():
+        term = make()
+        program = vm.compile_term(term)
+        rows.append((name, "AST.eval", best(lambda: AST(term).eval(), repeat)))
+        rows.append((name, "vm.compile", best(lambda: vm.compile_term(term), repeat)))
+        rows.append((name, "vm.run", best(lambda: vm.run(program), repeat)))
+    return rows
+
+
+SERIALIZE_WORKLOADS: Dict[str, Callable[[], Term]] = {
+    "wide": wide,
+    "deep": deep,
+}
+
+
+def serialize(workloads=SERIALIZE_WORKLOADS, repeat=3) -> List[Tuple[str, str, float]]:
+    """
+    Time of a round trip through `lampy.serialize` and through pickle,
+    pickle is left out of the terms it can't handle
+    """
+    rows = []
+    for name, make in workloads.items():
+        term = make()
+        data = dumps(term)
+        rows.append((name, "dumps", best(lambda: dumps(term), repeat)))
+        rows.append((name, "loads", best(lambda: loads(data), repeat)))
+        try:
+            pickled = pickle.dumps(term)
+        except RecursionError:
+            continue
+        rows.append((name, "pickle.dumps", best(lambda: pickle.dumps(term), repeat)))
+        rows.append((name, "pickle.loads", best(lambda: pickle.loads(pickled), repeat)))
+    return rows
+
+
+def sizes(workloads=SERIALIZE_WORKLOADS) -> List[Tuple[str, str, float]]:
+    "Bytes per node of the binary encoding and of pickle"
+    rows = []
+    for name, make in workloads.items():
+        term = make()
+        rows.append((name, "dumps", len(dumps(term)) / term.size))
+        try:
+            rows.append((name, "pickle", len(pickle.dumps(term)) / term.size))
+        except RecursionError:
+            pass
+    return rows
+
+
+def report(rows: List[Tuple[str, str, float]], out=sys.stdout):
+    for name, engine, secs in rows:
+        print(f"{name:20} {engine:12} {secs * 1000:10.2f} ms", file=out)
+
+
+if __name__ == "__main__":
+    report(run())
+    report(bytecode())
+    report(serialize())
+    for name, what, size in sizes():
+        print(f"{name:20} {what:12} {size:10.2f} bytes/node")
@@ -0,0 +1,159 @@
+"""
+CEK machine for lampy.lampy terms
+
+The machine works on the locally nameless terms from `lampy.debruijn`.
+Instead of rewriting the lambda body on every beta step, applying a
+closure just pushes the argument on its environment, so the cost of an
+application doesn't depend on the size of the body. The continuation is
+an explicit stack of frames, evaluation order is call by value, the same
+as `lampy.lampy.eval_term`. Like there, an application whose function
+isn't a lambda, or a BinOp on something else than numbers, is stuck and
+its value is the term itself, its subterms are left as they were.
+
+>>> AST(Appl(Lamb(Var("x"), BinOp("+", Var("x"), Val("1"))), Val("2"))).eval(engine="cek")
+3
+>>> AST(Appl(Lamb(Var("x"), Lamb(Var("y"), Var("x"))), Val("1"))).eval(engine="cek")
+(λy.1)
+"""
+from typing import Any, Optional, Tuple
+
+from lampy.lampy import Term, Var, Val, Lamb, Appl, BinOp, AST
+from lampy.debruijn import (
+    DTerm,
+    Ix,
+    Free,
+    DVal,
+    DLamb,
+    DAppl,
+    DBinOp,
+    to_debruijn,
+    from_debruijn,
+    _rebuild,
+)
+
+# Environments are linked lists, (value, rest) or None, indexed by de Bruijn index
+Env = Optional[Tuple[Any, Any]]
+
+
+class Closure:
+    def __init__(self, lamb: DLamb, env: Env):
+        self.lamb = lamb
+        self.env = env
+
+    def __repr__(self):
+        return f"<closure {self.lamb}>"
+
+
+class Neutral:
+    "A stuck computation, kept in read back form"
+
+    def __init__(self, term: DTerm):
+        self.term = term
+
+    def __repr__(self):
+        return f"<neutral {self.term}>"
+
+
+# continuation frames, with the node and its environment for stuck terms
+_ARG = 0  # evaluate the argument of an application
+_FUN = 1  # apply a function value to the argument value
+_BIN_B = 2  # evaluate the right side of a BinOp
+_BIN_OP = 3  # fold a BinOp
+
+
+def lookup(env: Env, index: int):
+    while index:
+        env = env[1]  # type: ignore
+        index -= 1
+    return env[0]  # type: ignore
+
+
+def run(term: DTerm, env: Env = None):
+    """
+    Evaluate `term` to a machine value
+
+    >>> run(to_debruijn(Appl(Lamb(Var("x"), Var("x")), Val("1"))))
+    1
+    >>> run(to_debruijn(Appl(Var("f"), Val("1"))))
+    <neutral f 1>
+    >>> run(to_debruijn(Appl(Var("f"), Appl(Lamb(Var("y"), Var("y")), Val("1")))))
+    <neutral f ((λ.#0) 1)>
+    """
+    stack: list = []
+    control = term
+    while True:
+        if isinstance(control, DAppl):
+            stack.append((_ARG, control, env))
+            control = control.e1
+            continue
+        elif isinstance(control, DBinOp):
+            stack.append((_BIN_B, control, env))
+            control = control.a
+            continue
+        elif isinstance(control, Ix):
+            value = lookup(env, control.index)
+        elif isinstance(control, DLamb):
+            value = Closure(control, env)
+        elif isinstance(control, Free):
+            value = Neutral(control)
+        else:
+            value = control
+
+        # apply the continuation until there is a term to evaluate again
+        while True:
+            if not stack:
+                return value
+            frame = stack.pop()
+            kind = frame[0]
+            if kind == _ARG:
+                stack.append((_FUN, frame[1], frame[2], value))
+                control, env = frame[1].e2, frame[2]
+                break
+            elif kind == _FUN:
+                fun = frame[3]
+                if isinstance(fun, Closure):
+                    control, env = fun.lamb.body, (value, fun.env)
+                    break
+                value = Neutral(_close(frame[1], frame[2], 0))
+            elif kind == _BIN_B:
+                stack.append((_BIN_OP, frame[1], frame[2], value))
+                control, env = frame[1].b, frame[2]
+                break
+            else:
+                a = frame[3]
+                if isinstance(a, DVal) and isinstance(value, DVal):
+                    value = DVal(BinOp.opmap[frame[1].op](a.val, value.val))
+                else:
+                    value = Neutral(_close(frame[1], frame[2], 0))
+
+
+def _close(term: DTerm, env: Env, depth: int, read=None) -> DTerm:
+    """
+    Substitute the environment values, read back by `read`, for the
+    indices >= depth, without recursion
+    """
+    if read is None:
+        read = readback
+    return _rebuild(term, depth, lambda t, d: read(lookup(env, t.index - d)))
+
+
+def readback(value) -> DTerm:
+    """
+    Turn a machine value back into a term, the body of a closure is not
+    reduced, same as the lambdas returned by `eval_term`
+    """
+    if isinstance(value, Closure):
+        return DLamb(_close(value.lamb.body, value.env, 1), value.lamb.hint)
+    elif isinstance(value, Neutral):
+        return value.term
+    return value
+
+
+def normalize(term: Term) -> Term:
+    """
+    Entry point used by `AST.eval(engine="cek")`
+
+    >>> normalize(Appl(Lamb(Var("x"), Lamb(Var("y"), Appl(Var("x"), Var("y")))), Var("y")))
+    (λu.y u)
+    """
+    return from_debruijn(readback(run(to_debruijn(term))))
@@ -0,0 +1,339 @@
+"""
+Native arithmetic for Church numerals and booleans
+
+With `eval_term(..., church=True)`, or `AST.eval(church=True)`, the
+standard combinators (succ, plus, mult, exp, pred, sub, iszero, and, or,
+not, if) applied to Church numerals and booleans are computed with
+Python ints and bools instead of beta steps. The combinators are
+recognized modulo alpha conversion. The results are lambdas that build
+their body only when something looks at it, so `plus 1000 1000` doesn't
+allocate anything until the numeral is applied or printed. The body
+built is the one the plain reduction gives, so looking at a result,
+applied or not, shows the same term as without `church`.
+
+>>> two = numeral(2)
+>>> plus = Appl(Appl(combinator_term("plus"), two), two)
+>>> res = AST(plus).eval(church=True)
+>>> church_numeral(res)
+4
+>>> repr(res) == repr(AST(plus).eval())
+True
+"""
+import operator as op
+import threading
+import weakref
+from abc import abstractmethod
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+from lampy.lampy import Term, Var, Val, Lamb, Appl, BinOp, AST, appl, eval_term
+from lampy.debruijn import to_debruijn, to_prefix
+
+
+class _Lazy(Lamb):
+    "Lamb whose var and body are built on first use by `_build`"
+
+    def __init__(self):
+        self._var = None
+        self._body = None
+        self.fv = frozenset()
+
+    @abstractmethod
+    def _build(self) -> Lamb:
+        pass
+
+    def __copy__(self):
+        # `_replace` copies a lambda to substitute in its body, the fields
+        # of the subclasses would still describe the old one
+        return Lamb(self.var, self.body)
+
+    def _force(self):
+        if self._body is None:
+            lamb = self._build()
+            self._var, self._body = lamb.var, lamb.body
+
+    @property
+    def var(self):
+        self._force()
+        return self._var
+
+    @var.setter
+    def var(self, var):
+        self._force()
+        self._var = var
+
+    @property
+    def body(self):
+        self._force()
+        return self._body
+
+    @body.setter
+    def body(self, body):
+        self._force()
+        self._body = body
+
+
+class ChurchNumeral(_Lazy):
+    """
+    λf.λx.f (f ... x) with `n` applications of f
+
+    >>> ChurchNumeral(3)
+    (λf.(λx.f (f (f x))))
+    """
+
+    def __init__(self, n: int):
+        super().__init__()
+        self.n = n
+
+    def _build(self):
+        f, x = Var("f"), Var("x")
+        body: Term = x
+        for _ in range(self.n):
+            body = Appl(f, body)
+        return Lamb(f, Lamb(x, body))
+
+
+class ChurchBool(_Lazy):
+    """
+    >>> ChurchBool(True), ChurchBool(False)
+    ((λx.(λy.x)), (λx.(λy.y)))
+    """
+
+    def __init__(self, b: bool):
+        super().__init__()
+        self.b = b
+
+    def _build(self):
+        x, y = Var("x"), Var("y")
+        return Lamb(x, Lamb(y, x if self.b else y))
+
+
+def numeral(n: int) -> ChurchNumeral:
+    return ChurchNumeral(n)
+
+
+def church_numeral(term: Term) -> Optional[int]:
+    """
+    The int encoded by `term`, None if it isn't a Church numeral
+
+    >>> church_numeral(Lamb(Var("s"), Lamb(Var("z"), Appl(Var("s"), Var("z")))))
+    1
+    >>> church_numeral(Lamb(Var("s"), Lamb(Var("s"), Appl(Var("s"), Var("s"))))) is None
+    True
+    """
+    if isinstance(term, ChurchNumeral):
+        return term.n
+    if isinstance(term, _Result) and term.comb.result == "n":
+        return term.value
+    if not isinstance(term, Lamb) or isinstance(term, _Lazy):
+        return None
+    if not isinstance(term.body, Lamb):
+        return None
+    f, x = term.var.name, term.body.var.name
+    t, n = term.body.body, 0
+    # when f and x have the same name, f is shadowed and only 0 is valid
+    while f != x and isinstance(t, Appl) and isinstance(t.e1, Var) and t.e1.name == f:
+        t, n = t.e2, n + 1
+    if isinstance(t, Var) and t.name == x:
+        return n
+    return None
+
+
+def church_bool(term: Term) -> Optional[bool]:
+    """
+    >>> church_bool(Lamb(Var("a"), Lamb(Var("b"), Var("a"))))
+    True
+    >>> church_bool(Lamb(Var("a"), Lamb(Var("a"), Var("a"))))
+    False
+    """
+    if isinstance(term, ChurchBool):
+        return term.b
+    if isinstance(term, _Result) and term.comb.result == "b":
+        return term.value
+    if not isinstance(term, Lamb) or isinstance(term, _Lazy):
+        return None
+    if not isinstance(term.body, Lamb) or not isinstance(term.body.body, Var):
+        return None
+    name = term.body.body.name
+    if name == term.body.var.name:
+        return False
+    elif name == term.var.name:
+        return True
+    return None
+
+
+class Combinator(NamedTuple):
+    name: str
+    source: str
+    # one char per argument: n numeral, b boolean, * any term
+    kinds: str
+    fn: Callable
+    # n, b or * like kinds, the kind of the result of fn
+    result: str
+
+
+_TRUE = "((a) => (b) => a)"
+_FALSE = "((a) => (b) => b)"
+_PRED = "((n) => (f) => (x) => n ((g) => (h) => h (g f)) ((u) => x) ((u) => u))"
+
+COMBINATORS = [
+    Combinator("succ", "(n) => (f) => (x) => f (n f x)", "n", lambda n: n + 1, "n"),
+    Combinator("plus", "(m) => (n) => (f) => (x) => m f (n f x)", "nn", op.add, "n"),
+    Combinator("mult", "(m) => (n) => (f) => m (n f)", "nn", op.mul, "n"),
+    Combinator("exp", "(b) => (e) => e b", "nn", pow, "n"),
+    Combinator("pred", _PRED, "n", lambda n: max(n - 1, 0), "n"),
+    Combinator("sub", f"(m) => (n) => n {_PRED} m", "nn", lambda m, n: max(m - n, 0), "n"),
+    Combinator(
+        "iszero", f"(n) => n ((x) => {_FALSE}) {_TRUE}", "n", lambda n: n == 0, "b"
+    ),
+    Combinator("and", "(p) => (q) => p q p", "bb", lambda p, q: p and q, "b"),
+    Combinator("or", "(p) => (q) => p p q", "bb", lambda p, q: p or q, "b"),
+    Combinator("not", f"(p) => p {_FALSE} {_TRUE}", "b", op.not_, "b"),
+    Combinator("if", "(p) => (a) => (b) => p a b", "b**", lambda p, a, b: a if p else b, "*"),
+]
+
+# combinators are small, bigger lambdas are not keyed at all
+_MAX_SIZE = 64
+
+_table: Dict[str, Combinator] = {}
+_terms: Dict[str, Term] = {}
+_seen: "weakref.WeakKeyDictionary[Term, Optional[Combinator]]" = weakref.WeakKeyDictionary()
+
+
+def combinator_term(name: str) -> Term:
+    "The canonical term of a combinator"
+    _load()
+    return _terms[name]
+
+
+_load_lock = threading.Lock()
+
+
+def _load():
+    # _table is filled in one update, once it isn't empty it's complete
+    if _table:
+        return
+    from lampy.parser import parse
+
+    with _load_lock:
+        if _table:
+            return
+        table = {}
+        for comb in COMBINATORS:
+            term = parse(comb.source + ";")[0].root
+            _terms[comb.name] = term
+            table[_key(term)] = comb
+        _table.update(table)
+
+
+def _small(term: Term) -> bool:
+    n = 0
+    stack = [term]
+    while stack:
+        t = stack.pop()
+        n += 1
+        if n > _MAX_SIZE:
+            return False
+        if isinstance(t, Lamb):
+            stack.append(t.body)
+        elif isinstance(t, Appl):
+            stack.extend((t.e1, t.e2))
+        elif isinstance(t, BinOp):
+            stack.extend((t.a, t.b))
+    return True
+
+
+def _key(term: Term) -> str:
+    return to_prefix(to_debruijn(term))
+
+
+def combinator(term: Term) -> Optional[Combinator]:
+    """
+    The combinator `term` is alpha equivalent to, if any
+
+    >>> combinator(Lamb(Var("p"), Lamb(Var("q"), Appl(Appl(Var("p"), Var("q")), Var("p"))))).name
+    'and'
+    """
+    if not isinstance(term, Lamb) or isinstance(term, _Lazy) or term.fv:
+        return None
+    try:
+        return _seen[term]
+    except KeyError:
+        pass
+    _load()
+    res = _table.get(_key(term)) if _small(term) else None
+    _seen[term] = res
+    return res
+
+
+class _Applied(_Lazy):
+    "A combinator applied to `args`, `values` are their decoded values"
+
+    def __init__(self, comb: Combinator, head: Lamb, args: tuple, values: tuple):
+        super().__init__()
+        self.comb = comb
+        self.head = head
+        self.args = args
+        self.values = values
+        # the combinator is closed, the arguments can be open
+        self.fv = frozenset().union(*(a.fv for a in args))
+
+    def _build(self):
+        # the same reduction the evaluator would have made
+        t = self.head
+        for arg in self.args:
+            t = appl(t, arg)
+        return t
+
+
+class _Partial(_Applied):
+    "A combinator applied to less arguments than it takes"
+
+
+class _Result(_Applied):
+    "A combinator applied to all its arguments, `value` is the native result"
+
+    def __init__(self, comb: Combinator, head: Lamb, args: tuple, values: tuple, value):
+        super().__init__(comb, head, args, values)
+        self.value = value
+
+    def _build(self):
+        # and the steps after the last beta, a numeral or a boolean
+        # reduces to a lambda
+        return eval_term(super()._build())
+
+
+_decoders: Dict[str, Callable[[Term], Any]] = {
+    "n": church_numeral,
+    "b": church_bool,
+    "*": lambda t: t,
+}
+
+def accelerate(lam: Term, arg: Term) -> Optional[Term]:
+    """
+    The result of applying `lam` to `arg` computed natively, None when
+    `lam` isn't a known combinator or `arg` doesn't have the right shape,
+    the caller then makes a regular beta step
+
+    >>> church_numeral(accelerate(combinator_term("succ"), numeral(41)))
+    42
+    >>> accelerate(combinator_term("succ"), Var("x")) is None
+    True
+    """
+    if isinstance(lam, _Partial):
+        comb, head, args, values = lam.comb, lam.head, lam.args, lam.values
+    else:
+        comb = combinator(lam)
+        if comb is None:
+            return None
+        head, args, values = lam, (), ()
+    value = _decoders[comb.kinds[len(args)]](arg)
+    if value is None:
+        return None
+    args += (arg,)
+    values += (value,)
+    if len(args) < len(comb.kinds):
+        return _Partial(comb, head, args, values)
+    if comb.result == "*":
+        # one of the arguments, as they are
+        return comb.fn(*values)
+    return _Result(comb, head, args, values, comb.fn(*values))
@@ -0,0 +1,129 @@
+"""
+Compile lampy.lampy terms to Python code
+
+Lambdas are lowered to Python lambdas, applications to calls and BinOps
+to calls of the `BinOp.opmap` operators, using the builders from
+`lampy.astlib`. The result runs at CPython speed instead of going
+through substitution. Terms that can't be run natively, open terms or
+results that are functions, fall back to the interpreter.
+
+>>> inc = CompiledTerm(Lamb(Var("x"), BinOp("+", Var("x"), Val("1"))))
+>>> inc(Val("41"))
+42
+>>> inc(2)
+3
+>>> CompiledTerm(Lamb(Var("x"), Appl(Var("f"), Var("x"))))(1)
+f 1
+"""
+import operator as op
+from ast import Constant
+from typing import Any, Callable, Dict, Optional
+
+from lampy.astlib import lamb, call, name, _compile
+from lampy.lampy import Term, Var, Val, Lamb, Appl, BinOp, AST
+
+_opnames = {
+    "+": "_op_add",
+    "*": "_op_mul",
+    "/": "_op_div",
+    "-": "_op_sub",
+}
+
+
+def _div(a, b):
+    # Val truncates the result of "/" to an int
+    return int(op.truediv(a, b))
+
+
+_globals: Dict[str, Any] = {
+    **{_opnames[k]: v for k, v in BinOp.opmap.items()},
+    "_op_div": _div,
+}
+
+
+def lower(term: Term):
+    """
+    Python expression for a term, variables are prefixed so they can't
+    shadow the operators or Python keywords
+
+    >>> lower(Lamb(Var("x"), BinOp("*", Var("x"), Val("2")))).unparse()
+    'lambda v_x, **kwargs: _op_mul(v_x, 2)'
+    """
+    if isinstance(term, Var):
+        return name(f"v_{term.name}")
+    elif isinstance(term, Val):
+        return Constant(term.val)
+    elif isinstance(term, Lamb):
+        return lamb(f"v_{term.var.name}")(lower(term.body))
+    elif isinstance(term, Appl):
+        if isinstance(term.e1, Val):
+            # always a TypeError, and CPython warns about it when compiling
+            raise TypeError(f"{term.e1} isn't a function")
+        return call(lower(term.e1), lower(term.e2))
+    elif isinstance(term, BinOp):
+        return call(_opnames[term.op], lower(term.a), lower(term.b))
+    raise TypeError(f"Can't compile {term!r}")
+
+
+def compile_term(term: Term) -> Optional[Callable]:
+    """
+    Compile a closed term to its Python value, None for open terms. The
+    term is run to get it, a TypeError means it can't run natively.
+
+    >>> compile_term(Appl(Lamb(Var("x"), Var("x")), Val("1")))
+    1
+    >>> compile_term(Var("x")) is None
+    True
+    """
+    if term.fv:
+        return None
+    return eval(_compile(lower(term)), dict(_globals))
+
+
+class CompiledTerm:
+    """
+    A term compiled once and called with many arguments, the arguments
+    are `Val`s, ints or closed terms
+    """
+
+    def __init__(self, term: Term):
+        self.term = term
+        try:
+            self.fn = compile_term(term)
+        except TypeError:
+            # stuck, like 1 2, left to the interpreter
+            self.fn = None
+
+    def _native(self, arg):
+        if isinstance(arg, Val):
+            return arg.val
+        elif isinstance(arg, Term):
+            fn = compile_term(arg)
+            if fn is None:
+                raise TypeError(f"{arg} is open")
+            return fn
+        return arg
+
+    def __call__(self, *args) -> Term:
+        if self.fn is not None:
+            try:
+                res = self.fn
+                for arg in args:
+                    res = res(self._native(arg))
+            except TypeError:
+                pass
+            else:
+                if isinstance(res, int):
+                    return Val(res)
+        return self.interpret(*args)
+
+    def interpret(self, *args) -> Term:
+        term = self.term
+        for arg in args:
+            term = Appl(term, arg if isinstance(arg, Term) else Val(arg))
+        return AST(term).eval(engine="cek")
+
+
+def normalize(term: Term) -> Term:
+    "Entry point used by `AST.eval(engine=\"compile\")`"
+    return CompiledTerm(term)()
@@ -0,0 +1,433 @@
+"""
+Locally nameless representation for lampy.lampy terms
+
+Bound variables are de Bruijn indices (the number of binders between the
+occurrence and its lambda), free variables keep their names. Substitution
+never has to rename anything, so there is no need for `_next_var` or
+a fresh name counter here. Names are only invented again when converting back
+with `from_debruijn`.
+
+>>> to_debruijn(Lamb(Var("x"), Lamb(Var("y"), Appl(Var("x"), Var("z")))))
+(λ.(λ.#1 z))
+
+>>> AST(Appl(Lamb(Var("x"), BinOp("+", Var("x"), Val("1"))), Val("2"))).eval(engine="debruijn")
+3
+"""
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Set, Tuple
+
+from lampy.lampy import Term, Var, Val, Lamb, Appl, BinOp, AST
+from lampy.utils import fresh_name
+
+
+class DTerm(ABC):
+    # one more than the largest index pointing outside of this term, so
+    # shift and instantiate can skip closed subterms
+    nfree = 0
+
+    @abstractmethod
+    def shift(self, d: int, cutoff=0) -> "DTerm":
+        "Add `d` to every index >= `cutoff`"
+
+    @abstractmethod
+    def instantiate(self, value: "DTerm", depth=0) -> "DTerm":
+        "Replace the index `depth` by `value`, lowering the indices above it"
+
+
+class Ix(DTerm):
+    "Bound variable"
+
+    def __init__(self, index: int):
+        self.index = index
+        self.nfree = index + 1
+
+    def shift(self, d, cutoff=0):
+        if self.index >= cutoff:
+            return Ix(self.index + d)
+        return self
+
+    def instantiate(self, value, depth=0):
+        if self.index == depth:
+            return value.shift(depth)
+        elif self.index > depth:
+            return Ix(self.index - 1)
+        return self
+
+    def __repr__(self):
+        return f"#{self.index}"
+
+
+class Free(DTerm):
+    "Free variable"
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def shift(self, d, cutoff=0):
+        return self
+
+    def instantiate(self, value, depth=0):
+        return self
+
+    def __repr__(self):
+        return self.name
+
+
+class DVal(DTerm):
+    def __init__(self, val):
+        self.val = int(val)
+
+    def shift(self, d, cutoff=0):
+        return self
+
+    def instantiate(self, value, depth=0):
+        return self
+
+    def __repr__(self):
+        return str(self.val)
+
+
+class DLamb(DTerm):
+    def __init__(self, body: DTerm, hint="x"):
+        # hint is the original variable name, used by from_debruijn
+        self.body = body
+        self.hint = hint
+        self.nfree = max(body.nfree - 1, 0)
+
+    def shift(self, d, cutoff=0):
+        return _rebuild(self, cutoff, lambda t, c: t.shift(d, c))
+
+    def instantiate(self, value, depth=0):
+        return _rebuild(self, depth, lambda t, c: t.instantiate(value, c))
+
+    def __repr__(self):
+        return f"(λ.{self.body})"
+
+
+class DAppl(DTerm):
+    def __init__(self, e1: DTerm, e2: DTerm):
+        self.e1 = e1
+        self.e2 = e2
+        self.nfree = max(e1.nfree, e2.nfree)
+
+    def shift(self, d, cutoff=0):
+        return _rebuild(self, cutoff, lambda t, c: t.shift(d, c))
+
+    def instantiate(self, value, depth=0):
+        return _rebuild(self, depth, lambda t, c: t.instantiate(value, c))
+
+    def __repr__(self):
+        if isinstance(self.e2, DAppl):
+            return f"{self.e1} ({self.e2})"
+        return f"{self.e1} {self.e2}"
+
+
+class DBinOp(DTerm):
+    def __init__(self, op: str, a: DTerm, b: DTerm):
+        self.op = op
+        self.a = a
+        self.b = b
+        self.nfree = max(a.nfree, b.nfree)
+        if op not in BinOp.opmap:
+            raise TypeError(f"Unknown operator {op}")
+
+    @property
+    def opfun(self):
+        return BinOp.opmap[self.op]
+
+    def shift(self, d, cutoff=0):
+        return _rebuild(self, cutoff, lambda t, c: t.shift(d, c))
+
+    def instantiate(self, value, depth=0):
+        return _rebuild(self, depth, lambda t, c: t.instantiate(value, c))
+
+    def __repr__(self):
+        return f"{self.a} {self.op} {self.b}"
+
+
+def _rebuild(term: DTerm, depth: int, leaf) -> DTerm:
+    """
+    Copy of `term` with every index >= the number of enclosing binders,
+    `depth` at the top, replaced by `leaf(index, binders)`, without
+    recursion. Closed subterms are shared.
+    """
+    results: List[DTerm] = []
+    # (subterm, its depth), or (node, None) to rebuild the node
+    stack: List[Tuple[DTerm, Optional[int]]] = [(term, depth)]
+    while stack:
+        t, d = stack.pop()
+        if d is None:
+            if isinstance(t, DLamb):
+                results.append(DLamb(results.pop(), t.hint))
+                continue
+            b = results.pop()
+            a = results.pop()
+            results.append(DAppl(a, b) if isinstance(t, DAppl) else DBinOp(t.op, a, b))  # type: ignore
+        elif t.nfree <= d:
+            results.append(t)
+        elif isinstance(t, Ix):
+            results.append(leaf(t, d))
+        elif isinstance(t, DLamb):
+            stack.append((t, None))
+            stack.append((t.body, d + 1))
+        elif isinstance(t, DAppl):
+            stack.append((t, None))
+            stack.append((t.e2, d))
+            stack.append((t.e1, d))
+        elif isinstance(t, DBinOp):
+            stack.append((t, None))
+            stack.append((t.b, d))
+            stack.append((t.a, d))
+        else:
+            results.append(t)
+    return results.pop()
+
+
+# to_debruijn and from_debruijn tasks, next to the subterms
+_LEAVE = 0  # leaving a lambda, build it from the last result
+_APPL = 1  # build an application from the last two results
+_BINOP = 2  # build a BinOp from the last two results
+
+
+def to_debruijn(term: Term, scope: Optional[List[str]] = None) -> DTerm:
+    """
+    Convert a named term, as returned by `lampy.parser.parse`, to the
+    locally nameless form, without recursion
+
+    >>> to_debruijn(Lamb(Var("x"), Lamb(Var("x"), Var("x"))))
+    (λ.(λ.#0))
+    """
+    # the levels of the binders of each name, innermost last
+    levels: Dict[str, List[int]] = {}
+    for level, name in enumerate(scope or []):
+        levels.setdefault(name, []).append(level)
+    results: List[DTerm] = []
+    # (term, depth) or (task, name or operator)
+    stack: list = [(term, len(scope or []))]
+    while stack:
+        t, arg = stack.pop()
+        if t is _LEAVE:
+            levels[arg].pop()
+            results.append(DLamb(results.pop(), arg))
+        elif t is _APPL or t is _BINOP:
+            b = results.pop()
+            a = results.pop()
+            results.append(DAppl(a, b) if t is _APPL else DBinOp(arg, a, b))
+        elif isinstance(t, Var):
+            bound = levels.get(t.name)
+            results.append(Ix(arg - bound[-1] - 1) if bound else Free(t.name))
+        elif isinstance(t, Val):
+            results.append(DVal(t.val))
+        elif isinstance(t, Lamb):
+            levels.setdefault(t.var.name, []).append(arg)
+            stack.append((_LEAVE, t.var.name))
+            stack.append((t.body, arg + 1))
+        elif isinstance(t, Appl):
+            stack.append((_APPL, None))
+            stack.append((t.e2, arg))
+            stack.append((t.e1, arg))
+        elif isinstance(t, BinOp):
+            stack.append((_BINOP, t.op))
+            stack.append((t.b, arg))
+            stack.append((t.a, arg))
+        else:
+            raise TypeError(f"Can't convert {t!r}")
+    return results.pop()
+
+
+def free_names(term: DTerm) -> Set[str]:
+    """
+    >>> sorted(free_names(to_debruijn(Appl(Var("f"), Lamb(Var("x"), Var("y"))))))
+    ['f', 'y']
+    """
+    names = set()
+    stack = [term]
+    while stack:
+        t = stack.pop()
+        if isinstance(t, Free):
+            names.add(t.name)
+        elif isinstance(t, DLamb):
+            stack.append(t.body)
+        elif isinstance(t, DAppl):
+            stack.append(t.e2)
+            stack.append(t.e1)
+        elif isinstance(t, DBinOp):
+            stack.append(t.b)
+            stack.append(t.a)
+    return names
+
+
+def from_debruijn(term: DTerm, scope: Optional[List[str]] = None, taken=None) -> Term:
+    """
+    Convert back to a named term, renaming binders only when the original
+    name would capture another variable, without recursion
+
+    >>> from_debruijn(to_debruijn(Lamb(Var("x"), Lamb(Var("y"), Var("x")))))
+    (λx.(λy.x))
+
+    >>> from_debruijn(DLamb(DLamb(DAppl(Ix(1), Ix(0)), "x"), "x"))
+    (λx.(λu.x u))
+
+    >>> from_debruijn(DLamb(DAppl(Ix(0), Free("x")), "x"))
+    (λu.u x)
+    """
+    scope = list(scope or [])
+    if taken is None:
+        taken = free_names(term)
+    # how many binders in scope have each name
+    in_scope: Dict[str, int] = {}
+    for name in scope:
+        in_scope[name] = in_scope.get(name, 0) + 1
+    results: List[Term] = []
+    stack: list = [(term, None)]
+    while stack:
+        t, arg = stack.pop()
+        if t is _LEAVE:
+            scope.pop()
+            in_scope[arg] -= 1
+            results.append(Lamb(Var(arg), results.pop()))
+        elif t is _APPL or t is _BINOP:
+            b = results.pop()
+            a = results.pop()
+            results.append(Appl(a, b) if t is _APPL else BinOp(arg, a, b))
+        elif isinstance(t, Ix):
+            results.append(Var(scope[-1 - t.index]))
+        elif isinstance(t, Free):
+            results.append(Var(t.name))
+        elif isinstance(t, DVal):
+            results.append(Val(t.val))
+        elif isinstance(t, DLamb):
+            name = fresh_name(t.hint, taken | {n for n, c in in_scope.items() if c})
+            scope.append(name)
+            in_scope[name] = in_scope.get(name, 0) + 1
+            stack.append((_LEAVE, name))
+            stack.append((t.body, None))
+        elif isinstance(t, DAppl):
+            stack.append((_APPL, None))
+            stack.append((t.e2, None))
+            stack.append((t.e1, None))
+        elif isinstance(t, DBinOp):
+            stack.append((_BINOP, t.op))
+            stack.append((t.b, None))
+            stack.append((t.a, None))
+        else:
+            raise TypeError(f"Can't convert {t!r}")
+    return results.pop()
+
+
+def to_prefix(term: DTerm, hints=False) -> str:
+    """
+    Unambiguous prefix encoding, without the binder names it is the same
+    for alpha equivalent terms
+
+    >>> to_prefix(to_debruijn(BinOp("+", Appl(Var("f"), Lamb(Var("x"), Var("x"))), Val("1"))))
+    '+ @ $f λ #0 1'
+    >>> to_prefix(to_debruijn(Lamb(Var("x"), Var("x"))), hints=True)
+    'λx #0'
+    """
+    out = []
+    stack = [term]
+    while stack:
+        t = stack.pop()
+        if isinstance(t, Ix):
+            out.append(f"#{t.index}")
+        elif isinstance(t, Free):
+            out.append(f"${t.name}")
+        elif isinstance(t, DVal):
+            out.append(str(t.val))
+        elif isinstance(t, DLamb):
+            out.append(f"λ{t.hint}" if hints else "λ")
+            stack.append(t.body)
+        elif isinstance(t, DAppl):
+            out.append("@")
+            stack.append(t.e2)
+            stack.append(t.e1)
+        elif isinstance(t, DBinOp):
+            out.append(t.op)
+            stack.append(t.b)
+            stack.append(t.a)
+        else:
+            raise TypeError(f"Can't encode {t!r}")
+    return " ".join(out)
+
+
+def from_prefix(s: str) -> DTerm:
+    """
+    >>> from_prefix("λx @ #0 $y")
+    (λ.#0 y)
+    """
+    # build from the right, the arguments of a node are on top of the stack
+    stack: List[DTerm] = []
+    for tok in reversed(s.split(" ")):
+        if tok[0] == "#":
+            stack.append(Ix(int(tok[1:])))
+        elif tok[0] == "$":
+            stack.append(Free(tok[1:]))
+        elif tok[0] == "λ":
+            stack.append(DLamb(stack.pop(), tok[1:] or "x"))
+        elif tok == "@":
+            e1 = stack.pop()
+            stack.append(DAppl(e1, stack.pop()))
+        elif tok in BinOp.opmap:
+            a = stack.pop()
+            stack.append(DBinOp(tok, a, stack.pop()))
+        else:
+            stack.append(DVal(tok))
+    return stack.pop()
+
+
+def alpha_eq(t1: Term, t2: Term) -> bool:
+    """
+    >>> alpha_eq(Lamb(Var("x"), Var("x")), Lamb(Var("y"), Var("y")))
+    True
+    >>> alpha_eq(Lamb(Var("x"), Var("y")), Lamb(Var("y"), Var("y")))
+    False
+    """
+    return to_prefix(to_debruijn(t1)) == to_prefix(to_debruijn(t2))
+
+
+def eval_debruijn(term: DTerm) -> DTerm:
+    """
+    Call by value evaluation, same strategy as `lampy.lampy.eval_term`,
+    stuck applications and BinOps are returned as they are
+
+    >>> eval_debruijn(to_debruijn(Appl(Lamb(Var("x"), Lamb(Var("y"), Appl(Var("x"), Var("y")))), Var("y"))))
+    (λ.y #0)
+    >>> eval_debruijn(to_debruijn(Appl(Var("f"), Appl(Lamb(Var("y"), Var("y")), Val("1")))))
+    f ((λ.#0) 1)
+    """
+    # (node, value of its first side), None while it is evaluated
+    stack: List[Tuple[DTerm, Optional[DTerm]]] = []
+    t = term
+    while True:
+        while isinstance(t, (DAppl, DBinOp)):
+            stack.append((t, None))
+            t = t.e1 if isinstance(t, DAppl) else t.a
+        value = t
+        while stack:
+            node, a = stack.pop()
+            if a is None:
+                stack.append((node, value))
+                t = node.e2 if isinstance(node, DAppl) else node.b  # type: ignore
+                break
+            elif isinstance(node, DAppl):
+                if isinstance(a, DLamb):
+                    t = a.body.instantiate(value)
+                    break
+                value = node
+            elif isinstance(a, DVal) and isinstance(value, DVal):
+                value = DVal(node.opfun(a.val, value.val))  # type: ignore
+            else:
+                value = node
+        else:
+            return value
+
+
+def normalize(term: Term) -> Term:
+    """
+    Entry point used by `AST.eval(engine="debruijn")`
+
+    >>> normalize(Appl(Lamb(Var("x"), Lamb(Var("y"), Var("x"))), Var("y")))
+    (λu.y)
+    """
+    return from_debruijn(eval_debruijn(to_debruijn(term)))
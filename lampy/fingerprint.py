@@ -0,0 +1,211 @@
+"""
+Alpha invariant fingerprints of lampy.lampy and lampy.tlampy terms, and
+cycle detection for the evaluators
+
+The fingerprint of a node is built from the fingerprints of its children,
+and kept as long as the node lives. A beta step only builds new nodes on the paths to
+the substituted variables, so fingerprinting the next term only hashes
+those, the rest of the term is shared and already done.
+
+Each node has a hash of its shape, with the variables left out, and a
+hash of the positions of each of its free variables. A lambda adds the
+positions of its variable to the shape, so the names of the bound
+variables don't matter, the names of the free ones do.
+
+>>> fingerprint(Lamb(Var("x"), Var("x"))) == fingerprint(Lamb(Var("y"), Var("y")))
+True
+>>> fingerprint(Lamb(Var("x"), Var("y"))) == fingerprint(Lamb(Var("y"), Var("y")))
+False
+
+`AST.eval(detect_cycles=True)` checks the states of the machine with a
+`CycleDetector`, and raises Diverges when the evaluation comes back to a
+state it was already in
+
+>>> omega = Lamb(Var("x"), Appl(Var("x"), Var("x")))
+>>> AST(Appl(omega, omega)).eval(detect_cycles=True)
+Traceback (most recent call last):
+...
+lampy.utils.Diverges: diverges, the same term comes back every 1 steps
+"""
+from typing import Dict, List, Optional, Tuple
+from weakref import WeakKeyDictionary
+
+from lampy import lampy, tlampy
+from lampy.lampy import Var, Lamb, Appl, AST
+
+# node kinds, in the hashes
+_VAR, _VAL, _LAMB, _APPL, _BINOP = range(5)
+_HERE = hash((_VAR,))
+
+# shape hash and the positions of the free variables
+Summary = Tuple[int, Dict[str, int]]
+
+_CLOSED: Dict[str, int] = {}
+
+# by node, terms are compared by identity. Not an attribute of the nodes,
+# _replace copies the nodes it changes
+_summaries: "WeakKeyDictionary[object, Summary]" = WeakKeyDictionary()
+
+
+def _kids(t, lang) -> tuple:
+    if isinstance(t, lang.Lamb):
+        return (t.body,)
+    elif isinstance(t, lang.Appl):
+        return (t.e1, t.e2)
+    elif isinstance(t, lang.BinOp):
+        return (t.a, t.b)
+    return ()
+
+
+def _kind(t, lang) -> int:
+    for kind, cls in enumerate((lang.Var, lang.Val, lang.Lamb, lang.Appl, lang.BinOp)):
+        if isinstance(t, cls):
+            return kind
+    raise TypeError(f"Can't fingerprint {t!r}")
+
+
+def _merge(kind, a: Dict[str, int], b: Dict[str, int]) -> Dict[str, int]:
+    if not a and not b:
+        return _CLOSED
+    return {n: hash((kind, a.get(n), b.get(n))) for n in a.keys() | b.keys()}
+
+
+def summary(term, lang=lampy) -> Summary:
+    "Compute the summaries of the nodes that don't have one yet, iteratively"
+    res = _summaries.get(term)
+    if res is not None:
+        return res
+    stack = [(term, False)]
+    while stack:
+        t, expanded = stack.pop()
+        if t in _summaries:
+            continue
+        kids = _kids(t, lang)
+        if kids and not expanded:
+            stack.append((t, True))
+            stack.extend((k, False) for k in kids)
+            continue
+        if isinstance(t, lang.Var):
+            res = (hash((_VAR,)), {t.name: _HERE})
+        elif isinstance(t, lang.Val):
+            res = (hash((_VAL, type(t.val), t.val)), _CLOSED)
+        elif isinstance(t, lang.Lamb):
+            shape, variables = _summaries[t.body]
+            bound = variables.get(t.var.name)
+            if bound is not None:
+                variables = {n: p for n, p in variables.items() if n != t.var.name} or _CLOSED
+            res = (hash((_LAMB, shape, bound)), variables)
+        elif isinstance(t, lang.Appl):
+            (s1, v1), (s2, v2) = _summaries[t.e1], _summaries[t.e2]
+            res = (hash((_APPL, s1, s2)), _merge(_APPL, v1, v2))
+        else:
+            (s1, v1), (s2, v2) = _summaries[t.a], _summaries[t.b]
+            res = (hash((_BINOP, t.op, s1, s2)), _merge((_BINOP, t.op), v1, v2))
+        _summaries[t] = res
+    return _summaries[term]
+
+
+def fingerprint(term, lang=lampy) -> int:
+    "Equal for terms that are the same up to alpha conversion"
+    shape, variables = summary(term, lang)
+    return hash((shape, frozenset(variables.items())))
+
+
+def alpha_eq(t1, t2, lang=lampy) -> bool:
+    """
+    Exact comparison up to alpha conversion, iterative
+
+    >>> alpha_eq(Lamb(Var("x"), Appl(Var("x"), Var("f"))), Lamb(Var("y"), Appl(Var("y"), Var("f"))))
+    True
+    """
+    # the levels of the binders of each name, innermost last
+    env1: Dict[str, List[int]] = {}
+    env2: Dict[str, List[int]] = {}
+    stack: list = [(t1, t2, 0)]
+    while stack:
+        a, b, depth = stack.pop()
+        if a is None:
+            # leaving a lambda
+            env1[b[0]].pop()
+            env2[b[1]].pop()
+            continue
+        if depth == 0 and a is b:
+            continue
+        if _kind(a, lang) != _kind(b, lang):
+            return False
+        if isinstance(a, lang.Var):
+            l1, l2 = env1.get(a.name), env2.get(b.name)
+            l1 = l1[-1] if l1 else None
+            l2 = l2[-1] if l2 else None
+            if l1 != l2 or (l1 is None and a.name != b.name):
+                return False
+        elif isinstance(a, lang.Val):
+            if type(a.val) is not type(b.val) or a.val != b.val:
+                return False
+        elif isinstance(a, lang.Lamb):
+            env1.setdefault(a.var.name, []).append(depth)
+            env2.setdefault(b.var.name, []).append(depth)
+            stack.append((None, (a.var.name, b.var.name), depth))
+            stack.append((a.body, b.body, depth + 1))
+        elif isinstance(a, lang.Appl):
+            stack.append((a.e2, b.e2, depth))
+            stack.append((a.e1, b.e1, depth))
+        else:
+            if a.op != b.op:
+                return False
+            stack.append((a.b, b.b, depth))
+            stack.append((a.a, b.a, depth))
+    return True
+
+
+class CycleDetector:
+    """
+    Brent's cycle detection over the states of an eval_term machine, the
+    term being evaluated and the stack of frames. The state of steps that
+    are powers of two is kept and every later state is compared to it,
+    so a cycle is found within twice its length, whatever its start, and
+    only one state is kept.
+
+    The fingerprints make most comparisons cheap, the equal ones are
+    checked exactly, a collision can't report a divergence.
+    """
+
+    def __init__(self, lang=lampy):
+        self.lang = lang
+        self.power = 1
+        self.period = 1
+        self.saved: Optional[Tuple[int, object, list]] = None
+
+    def _same(self, a, b) -> bool:
+        if a is b:
+            return True
+        if a is None or b is None:
+            return False
+        return fingerprint(a, self.lang) == fingerprint(b, self.lang) and alpha_eq(
+            a, b, self.lang
+        )
+
+    def _repeats(self, term, stack: list) -> bool:
+        fp, saved, frames = self.saved
+        if len(stack) != len(frames) or fingerprint(term, self.lang) != fp:
+            return False
+        if not alpha_eq(term, saved, self.lang):
+            return False
+        # frames are (kind, node, depth, value), the depth is for tracing
+        for f, g in zip(stack, frames):
+            if f is not g and (
+                f[0] != g[0] or not self._same(f[1], g[1]) or not self._same(f[3], g[3])
+            ):
+                return False
+        return True
+
+    def check(self, term, stack: list) -> Optional[int]:
+        "Called after every beta step, the period if the state was seen before"
+        if self.saved is not None and self._repeats(term, stack):
+            return self.period
+        if self.period == self.power:
+            self.saved = (fingerprint(term, self.lang), term, list(stack))
+            self.power *= 2
+            self.period = 0
+        self.period += 1
+        return None
@@ -0,0 +1,262 @@
+"""
+Graph reduction for lampy.lampy terms
+
+Terms are turned into a graph of mutable nodes. A beta step copies only
+the nodes of the lambda body that contain the bound variable, the
+argument and every part of the body that doesn't mention the variable
+are shared, not copied. A redex is then overwritten with an indirection
+to its result, so a shared subterm is reduced once for all the places
+it appears in, including the parts of a lambda body that are the same
+for every call.
+
+Evaluation is call by need, to weak head normal form, and arguments
+that were never demanded are read back unevaluated, like the "need"
+engine.
+
+>>> heavy = Appl(Lamb(Var("y"), BinOp("+", Var("y"), Var("y"))), Val("21"))
+>>> f = Lamb(Var("x"), BinOp("+", Var("x"), heavy))
+>>> twice = Lamb(Var("g"), Appl(Var("g"), Appl(Var("g"), Val("0"))))
+>>> stats = EvalStats()
+>>> readback(whnf(to_graph(Appl(twice, f)), stats)), stats.beta, stats.binops
+(84, 4, 3)
+"""
+from typing import Dict, List, Optional
+
+from lampy.lampy import Term, Var, Val, Lamb, Appl, BinOp, AST
+from lampy.debruijn import DTerm, Ix, Free, DVal, DLamb, DAppl, DBinOp, from_debruijn
+from lampy.utils import EvalStats
+
+# node tags
+VAR = 0  # free variable, a is the name
+VAL = 1  # a is the value
+PARAM = 2  # variable bound by a LAMB, a is the name it had
+LAMB = 3  # a is the PARAM, b the body
+APPL = 4  # a is the function, b the argument
+BINOP = 5  # a and b are the operands, c the operator
+IND = 6  # a reduced redex, a is the result
+
+_EMPTY: frozenset = frozenset()
+
+
+class Node:
+    # params: the PARAM nodes in the subgraph, a node without params
+    # can be reduced and is shared by every instantiation of a body
+    __slots__ = ("tag", "a", "b", "c", "params")
+
+    def __init__(self, tag, a=None, b=None, c=None, params=_EMPTY):
+        self.tag = tag
+        self.a = a
+        self.b = b
+        self.c = c
+        self.params = params
+
+    def __repr__(self):
+        return f"<node {readback(self)}>"
+
+
+def param(name: str) -> Node:
+    p = Node(PARAM, name)
+    p.params = frozenset((p,))
+    return p
+
+
+def lamb(p: Node, body: Node) -> Node:
+    return Node(LAMB, p, body, params=body.params - p.params)
+
+
+def appl(e1: Node, e2: Node) -> Node:
+    return Node(APPL, e1, e2, params=e1.params | e2.params)
+
+
+def binop(op: str, a: Node, b: Node) -> Node:
+    return Node(BINOP, a, b, op, a.params | b.params)
+
+
+def follow(node: Node) -> Node:
+    "Skip indirections, shortening the chain on the way"
+    target = node
+    while target.tag == IND:
+        target = target.a
+    while node.tag == IND and node.a is not target:
+        node.a, node = target, node.a
+    return target
+
+
+# to_graph and _readback tasks
+_VISIT = 0
+_LAMB = 1
+_APPL = 2
+_BINOP = 3
+
+
+def to_graph(term: Term) -> Node:
+    "Build the graph of a term, without recursion"
+    free: Dict[str, Node] = {}
+    scope: Dict[str, List[Node]] = {}
+    results: List[Node] = []
+    stack: list = [(_VISIT, term)]
+    while stack:
+        task, t = stack.pop()
+        if task == _VISIT:
+            if isinstance(t, Var):
+                if scope.get(t.name):
+                    results.append(scope[t.name][-1])
+                else:
+                    results.append(free.setdefault(t.name, Node(VAR, t.name)))
+            elif isinstance(t, Val):
+                results.append(Node(VAL, t.val))
+            elif isinstance(t, Lamb):
+                p = param(t.var.name)
+                scope.setdefault(t.var.name, []).append(p)
+                stack.append((_LAMB, p))
+                stack.append((_VISIT, t.body))
+            elif isinstance(t, Appl):
+                stack.append((_APPL, None))
+                stack.append((_VISIT, t.e2))
+                stack.append((_VISIT, t.e1))
+            elif isinstance(t, BinOp):
+                stack.append((_BINOP, t.op))
+                stack.append((_VISIT, t.b))
+                stack.append((_VISIT, t.a))
+            else:
+                raise TypeError(f"Can't convert {t!r}")
+        elif task == _LAMB:
+            scope[t.a].pop()
+            results.append(lamb(t, results.pop()))
+        else:
+            b = results.pop()
+            a = results.pop()
+            results.append(appl(a, b) if task == _APPL else binop(t, a, b))
+    return results.pop()
+
+
+def instantiate(lam: Node, arg: Node) -> Node:
+    """
+    The body of `lam` with its parameter replaced by `arg`. Only the
+    nodes that contain the parameter are copied, sharing inside the body
+    is kept.
+    """
+    p = lam.a
+    copies: Dict[int, Node] = {}
+    stack = [(lam.b, False)]
+    while stack:
+        n, expanded = stack.pop()
+        if id(n) in copies:
+            continue
+        if n is p:
+            copies[id(n)] = arg
+        elif p not in n.params:
+            copies[id(n)] = n
+        elif not expanded:
+            stack.append((n, True))
+            if n.tag == LAMB:
+                stack.append((n.b, False))
+            else:
+                stack.append((n.b, False))
+                stack.append((n.a, False))
+        elif n.tag == LAMB:
+            copies[id(n)] = lamb(n.a, copies[id(n.b)])
+        elif n.tag == APPL:
+            copies[id(n)] = appl(copies[id(n.a)], copies[id(n.b)])
+        else:
+            copies[id(n)] = binop(n.c, copies[id(n.a)], copies[id(n.b)])
+    return copies[id(lam.b)]
+
+
+# whnf frames
+_APPLY = 0  # reducing the function of an APPL node
+_BIN_A = 1  # reducing the left operand of a BINOP node
+_BIN_B = 2  # reducing the right operand
+
+
+def whnf(root: Node, stats: Optional[EvalStats] = None) -> Node:
+    """
+    Reduce to weak head normal form, without recursion. Redexes are
+    overwritten with their result, `root` included.
+    """
+    stack: list = []
+    n = root
+    while True:
+        n = follow(n)
+        if n.tag == APPL:
+            stack.append((_APPLY, n))
+            n = n.a
+            continue
+        elif n.tag == BINOP:
+            stack.append((_BIN_A, n))
+            n = n.a
+            continue
+        # n is a value or stuck, return it to the frames
+        while stack:
+            kind, node = stack.pop()
+            if kind == _APPLY:
+                if n.tag == LAMB:
+                    if stats is not None:
+                        stats.beta += 1
+                    res = instantiate(n, node.b)
+                    node.tag, node.a, node.b = IND, res, None
+                    n = res
+                    break
+                n = node
+            elif kind == _BIN_A:
+                stack.append((_BIN_B, node))
+                n = node.b
+                break
+            else:
+                a = follow(node.a)
+                if a.tag == VAL and n.tag == VAL:
+                    if stats is not None:
+                        stats.binops += 1
+                    # truncated like Val does
+                    val = int(BinOp.opmap[node.c](a.a, n.a))
+                    node.tag, node.a, node.b, node.c = VAL, val, None, None
+                n = node
+        else:
+            return n
+
+
+def _readback(root: Node, levels: Dict[Node, int], depth: int) -> DTerm:
+    "Locally nameless term of a node, without recursion, like `lampy.cek._close`"
+    results: List[DTerm] = []
+    # (task, node, depth), the depth slot of _LAMB is the level to restore
+    stack: list = [(_VISIT, root, depth)]
+    while stack:
+        task, node, d = stack.pop()
+        if task == _VISIT:
+            node = follow(node)
+            if node.tag == VAR:
+                results.append(Free(node.a))
+            elif node.tag == VAL:
+                results.append(DVal(node.a))
+            elif node.tag == PARAM:
+                results.append(Ix(d - levels[node] - 1))
+            elif node.tag == LAMB:
+                stack.append((_LAMB, node, levels.get(node.a)))
+                levels[node.a] = d
+                stack.append((_VISIT, node.b, d + 1))
+            else:
+                stack.append((_APPL if node.tag == APPL else _BINOP, node, d))
+                stack.append((_VISIT, node.b, d))
+                stack.append((_VISIT, node.a, d))
+        elif task == _LAMB:
+            p = node.a
+            if d is None:
+                del levels[p]
+            else:
+                levels[p] = d
+            results.append(DLamb(results.pop(), p.a))
+        else:
+            b = results.pop()
+            a = results.pop()
+            results.append(DAppl(a, b) if task == _APPL else DBinOp(node.c, a, b))
+    return results.pop()
+
+
+def readback(node: Node) -> Term:
+    "The term of a graph, shared nodes are read back once for every use"
+    return from_debruijn(_readback(node, {}, 0))
+
+
+def normalize(term: Term) -> Term:
+    "Entry point used by `AST.eval(engine=\"graph\")`"
+    return readback(whnf(to_graph(term)))
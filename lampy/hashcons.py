@@ -0,0 +1,277 @@
+"""
+Immutable, hash-consed terms for lampy.lampy and lampy.tlampy
+
+Nodes can't be modified after construction and structurally identical
+nodes are the same object, so equality is an identity check and a term
+with repeated subterms is stored once. The intern table only keeps weak
+references to the nodes, entries go away together with the last
+reference to the node.
+
+>>> HAppl(HVar("x"), HVal(1)) is HAppl(HVar("x"), HVal(1))
+True
+>>> from_term(Appl(Lamb(Var("x"), Var("x")), Lamb(Var("x"), Var("x"))))
+(λx.x) (λx.x)
+>>> t = from_term(Appl(Lamb(Var("x"), Var("x")), Lamb(Var("x"), Var("x"))))
+>>> t.e1 is t.e2
+True
+"""
+import weakref
+from typing import Dict, FrozenSet, Optional
+
+from lampy import lampy, tlampy
+from lampy.lampy import Var, Val, Lamb, Appl, BinOp
+from lampy.utils import fresh_name
+
+_table: "weakref.WeakValueDictionary[tuple, Node]" = weakref.WeakValueDictionary()
+
+
+def table_size() -> int:
+    "Number of live nodes in the intern table"
+    return len(_table)
+
+
+def _intern(cls, fields: tuple, fv: FrozenSet[str]):
+    key = (cls, *fields)
+    node = _table.get(key)
+    if node is None:
+        node = object.__new__(cls)
+        for name, value in zip(cls.__slots__, fields):
+            object.__setattr__(node, name, value)
+        object.__setattr__(node, "fv", fv)
+        _table[key] = node
+    return node
+
+
+class Node:
+    # fv is the set of free variable names, computed once at construction
+    __slots__ = ("fv", "__weakref__")
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __reduce__(self):
+        return (self.__class__, tuple(getattr(self, s) for s in self.__slots__))
+
+
+class HVar(Node):
+    __slots__ = ("name", "typ")
+
+    def __new__(cls, name: str, typ=None):
+        return _intern(cls, (name, typ), frozenset((name,)))
+
+    def __repr__(self):
+        return self.name
+
+
+class HVal(Node):
+    __slots__ = ("val", "typ")
+
+    def __new__(cls, val, typ=None):
+        return _intern(cls, (val, typ), frozenset())
+
+    def __repr__(self):
+        return str(self.val)
+
+
+class HLamb(Node):
+    __slots__ = ("var", "body")
+
+    def __new__(cls, var: HVar, body: Node):
+        return _intern(cls, (var, body), body.fv - var.fv)
+
+    def __repr__(self):
+        return f"(λ{self.var}.{self.body})"
+
+
+class HAppl(Node):
+    __slots__ = ("e1", "e2")
+
+    def __new__(cls, e1: Node, e2: Node):
+        return _intern(cls, (e1, e2), e1.fv | e2.fv)
+
+    def __repr__(self):
+        if isinstance(self.e2, HAppl):
+            return f"{self.e1} ({self.e2})"
+        return f"{self.e1} {self.e2}"
+
+
+class HBinOp(Node):
+    __slots__ = ("op", "a", "b")
+
+    def __new__(cls, op: str, a: Node, b: Node):
+        if op not in BinOp.opmap:
+            raise TypeError(f"Unknown operator {op}")
+        return _intern(cls, (op, a, b), a.fv | b.fv)
+
+    def __repr__(self):
+        return f"{self.a} {self.op} {self.b}"
+
+
+def _type_key(typ):
+    "tlampy types are mutable and unhashable, intern a tuple version of them"
+    if isinstance(typ, tlampy.TypeArrow):
+        return ("->", _type_key(typ.t1), _type_key(typ.t2))
+    elif isinstance(typ, tlampy.TypeVar):
+        return ("'", typ.typevar)
+    elif isinstance(typ, tlampy.TypeUnk):
+        return ("unk",)
+    return typ
+
+
+def _key_type(key):
+    if isinstance(key, tuple):
+        if key[0] == "->":
+            return tlampy.TypeArrow(_key_type(key[1]), _key_type(key[2]))
+        elif key[0] == "'":
+            return tlampy.TypeVar(key[1])
+        return tlampy.TypeUnk()
+    return key
+
+
+def _children(term) -> tuple:
+    if isinstance(term, (Lamb, tlampy.Lamb)):
+        return (term.var, term.body)
+    elif isinstance(term, (Appl, tlampy.Appl)):
+        return (term.e1, term.e2)
+    elif isinstance(term, (BinOp, tlampy.BinOp)):
+        return (term.a, term.b)
+    return ()
+
+
+def _intern_term(term, kids):
+    if isinstance(term, (Var, tlampy.Var)):
+        return HVar(term.name, _type_key(getattr(term, "typ", None)))
+    elif isinstance(term, (Val, tlampy.Val)):
+        return HVal(term.val, _type_key(getattr(term, "typ", None)))
+    elif isinstance(term, (Lamb, tlampy.Lamb)):
+        return HLamb(*kids)
+    elif isinstance(term, (Appl, tlampy.Appl)):
+        return HAppl(*kids)
+    elif isinstance(term, (BinOp, tlampy.BinOp)):
+        return HBinOp(term.op, *kids)
+    raise TypeError(f"Can't intern {term!r}")
+
+
+def from_term(term) -> Node:
+    """
+    Intern a lampy.lampy or lampy.tlampy term, without recursion
+
+    >>> from_term(tlampy.Lamb(tlampy.Var("x", int), tlampy.Var("x", int))).var.typ
+    <class 'int'>
+    """
+    done: Dict[int, Node] = {}
+    stack = [(term, False)]
+    while stack:
+        t, expanded = stack.pop()
+        if id(t) in done:
+            continue
+        kids = _children(t)
+        if kids and not expanded:
+            stack.append((t, True))
+            stack.extend((k, False) for k in kids)
+            continue
+        done[id(t)] = _intern_term(t, [done[id(k)] for k in kids])
+    return done[id(term)]
+
+
+def to_term(node: Node, lang=lampy):
+    """
+    Build a term, `lang` is `lampy.lampy` or `lampy.tlampy`, without
+    recursion. Shared nodes become shared subterms.
+
+    >>> to_term(from_term(tlampy.Lamb(tlampy.Var("x", int), tlampy.Var("x", int))), tlampy)
+    (λx:int.x:int)
+    """
+    typed = lang is tlampy
+    done: Dict[Node, object] = {}
+    stack = [(node, False)]
+    while stack:
+        n, expanded = stack.pop()
+        if n in done:
+            continue
+        if isinstance(n, HVar):
+            done[n] = lang.Var(n.name, _key_type(n.typ)) if typed else lang.Var(n.name)
+        elif isinstance(n, HVal):
+            done[n] = lang.Val(n.val, _key_type(n.typ)) if typed else lang.Val(n.val)
+        elif isinstance(n, HLamb):
+            if expanded:
+                done[n] = lang.Lamb(done[n.var], done[n.body])
+            else:
+                stack.extend([(n, True), (n.body, False), (n.var, False)])
+        elif isinstance(n, HAppl):
+            if expanded:
+                done[n] = lang.Appl(done[n.e1], done[n.e2])
+            else:
+                stack.extend([(n, True), (n.e2, False), (n.e1, False)])
+        elif isinstance(n, HBinOp):
+            if expanded:
+                done[n] = lang.BinOp(n.op, done[n.a], done[n.b])
+            else:
+                stack.extend([(n, True), (n.b, False), (n.a, False)])
+        else:
+            raise TypeError(f"Can't convert {n!r}")
+    return done[node]
+
+
+def substitute(node: Node, name: str, value: Node, _memo=None) -> Node:
+    """
+    Capture avoiding substitution of `value` for the free variable `name`,
+    without recursion. Subterms where `name` is not free are returned as
+    they are, and every shared subterm is substituted only once.
+
+    >>> substitute(from_term(Lamb(Var("y"), Appl(Var("x"), Var("y")))), "x", HVar("y"))
+    (λu.y u)
+    """
+    if _memo is None:
+        _memo = {}
+    get = lambda n: _memo[n] if name in n.fv else n
+    # (node, False) to visit, (node, True) or (lambda, (var, body)) to build
+    stack: list = [(node, False)]
+    while stack:
+        n, expanded = stack.pop()
+        if name not in n.fv or (not expanded and n in _memo):
+            continue
+        if isinstance(n, HVar):
+            _memo[n] = value
+        elif isinstance(n, HLamb):
+            if expanded:
+                var, body = expanded
+                _memo[n] = HLamb(var, get(body))
+                continue
+            var, body = n.var, n.body
+            if var.name in value.fv:
+                # alpha conversion
+                new = HVar(fresh_name(var.name, body.fv | value.fv), var.typ)
+                body = substitute(body, var.name, new)
+                var = new
+            stack.append((n, (var, body)))
+            stack.append((body, False))
+        elif isinstance(n, HAppl):
+            if expanded:
+                _memo[n] = HAppl(get(n.e1), get(n.e2))
+            else:
+                stack.extend([(n, True), (n.e2, False), (n.e1, False)])
+        elif isinstance(n, HBinOp):
+            if expanded:
+                _memo[n] = HBinOp(n.op, get(n.a), get(n.b))
+            else:
+                stack.extend([(n, True), (n.b, False), (n.a, False)])
+    return get(node)
+
+
+def appl(lam: HLamb, arg: Node) -> Node:
+    """
+    Beta-reduce without touching `lam`, unlike `lampy.lampy.appl`
+
+    >>> i = from_term(Lamb(Var("x"), Appl(Var("x"), Var("x"))))
+    >>> appl(i, HVal(1))
+    1 1
+    >>> i
+    (λx.x x)
+    """
+    if not isinstance(lam, HLamb):
+        raise TypeError(f"{lam} is not a lambda")
+    return substitute(lam.body, lam.var.name, arg)
@@ -1,5 +1,6 @@
 import os
 import sys
+import importlib
 from abc import ABC, abstractmethod
 from typing import (
     Dict,
@@ -14,51 +15,41 @@ from typing import (
     Sequence,
     Tuple,
     Union,
+    FrozenSet,
 )
 import operator as op
+from copy import copy
 from collections import namedtuple
 from functools import reduce
 from pprint import pprint
 
-from lampy.utils import trace
+from lampy.utils import trace, Tracer, StderrTracer, EvalStats, OutOfFuel, Diverges, phase, fresh_name
 
 
-_bound_vars = set()
-
-
-def _next_var(v: "Var") -> "Var":
+def _next_var(v: "Var", avoid: Iterable[str] = ()) -> "Var":
     """
-    Return the next letter
+    Return the next letter that is not in `avoid`, or the name with a
+    number appended when all the letters are taken
 
     >>> _next_var(Var("u"))
     v
 
     >>> _next_var(Var("z"))
     u
-    """
-    global _bound_vars
-    first = ord("u")
-    last = ord("z")
-    index = ord(v.name)
-    while True:
-        next_ = ord(v.name) + 1
-        if next_ > last:
-            next_ = first
-        found = Var(chr(next_))
-        if found not in _bound_vars:
-            return Var(chr(next_))
 
-
-def _reset_bound_vars():
-    global _bound_vars
-    _bound_vars = set()
-
-
-def _bind(var: "Var"):
-    _bound_vars.add(var.name)
+    >>> _next_var(Var("x"), set("uvwxyz"))
+    x1
+    """
+    letters = "uvwxyz"
+    start = letters.index(v.name) + 1 if v.name in letters else 0
+    # never v itself, the letters after it come first
+    return Var(fresh_name(v.name, set(avoid) | {v.name}, letters[start:] + letters[:start]))
 
 
 class Term(ABC):
+    # names of the free variables, computed once when the node is built
+    fv: FrozenSet[str] = frozenset()
+
     @abstractmethod
     def replace(self, old, new) -> "Term":
         pass
@@ -77,15 +68,42 @@ class Term(ABC):
         >>> Appl(Lamb(Var("x"), Var("x")), Val("1")).is_norm
         False
         """
-        if isinstance(self, Appl):
-            if isinstance(self.e1, Lamb):
+        stack = [self]
+        while stack:
+            t = stack.pop()
+            if isinstance(t, Appl):
+                if isinstance(t.e1, Lamb):
+                    return False
+                stack.append(t.e2)
+                stack.append(t.e1)
+            elif isinstance(t, BinOp):
                 return False
-            else:
-                return self.e1.is_norm and self.e2.is_norm
-        elif isinstance(self, BinOp):
-            return False
         return True
 
+    @property
+    def size(self) -> int:
+        """
+        Number of nodes, binders included
+
+        >>> Lamb(Var("x"), Appl(Var("x"), Var("x"))).size
+        5
+        """
+        n = 0
+        stack = [self]
+        while stack:
+            t = stack.pop()
+            n += 1
+            if isinstance(t, Lamb):
+                stack.append(t.var)
+                stack.append(t.body)
+            elif isinstance(t, Appl):
+                stack.append(t.e1)
+                stack.append(t.e2)
+            elif isinstance(t, BinOp):
+                stack.append(t.a)
+                stack.append(t.b)
+        return n
+
 
 class BinOp(Term):
     """
@@ -107,6 +125,7 @@ class BinOp(Term):
         self.a = a
         self.op = op
         self.b = b
+        self.fv = a.fv | b.fv
         if op not in self.__class__.opmap:
             raise TypeError(f"Unknown operator {op}")
 
@@ -115,17 +134,16 @@ class BinOp(Term):
         return self.__class__.opmap[self.op]
 
     def replace(self, old, new):
-        self.a = self.a.replace(old, new)
-        self.b = self.b.replace(old, new)
-        return self
+        return _replace(self, old, new)
 
     def __repr__(self):
-        return f"{self.a} {self.op} {self.b}"
+        return _show(self)
 
 
 class Var(Term):
     def __init__(self, name):
         self.name = name
+        self.fv = frozenset((name,))
 
     def __repr__(self):
         return self.name
@@ -153,38 +171,144 @@ class Lamb(Term):
     def __init__(self, var: Var, body: Term):
         self.var = var
         self.body = body
-        _bind(self.var)
+        self.fv = body.fv - var.fv
 
     def replace(self, old: Var, new: Term) -> "Term":
-        if isinstance(new, Var) and new.name == self.var.name:
-            # alpha conversion
-            old_var = self.var
-            self.var = _next_var(self.var)
-            self.body = self.body.replace(old_var, self.var)
-        self.body = self.body.replace(old, new)
-        return self
+        return _replace(self, old, new)
 
     def __repr__(self):
-        return f"(λ{self.var}.{self.body})"
+        return _show(self)
 
 
 class Appl(Term):
     def __init__(self, e1, e2):
         self.e1 = e1
         self.e2 = e2
+        self.fv = e1.fv | e2.fv
 
     def replace(self, old, new):
-        self.e1 = self.e1.replace(old, new)
-        self.e2 = self.e2.replace(old, new)
-        return self
+        return _replace(self, old, new)
 
     def __repr__(self):
-        if isinstance(self.e2, Appl):
-            return f"{self.e1} ({self.e2})"
-        return f"{self.e1} {self.e2}"
+        return _show(self)
+
+
+# _replace tasks
+_VISIT = 0  # replace in a subterm, pushing the result
+_RESTART = 1  # replace again in the last result (alpha conversion)
+_LAMB = 2  # rebuild a lambda from the last result
+_APPL = 3  # rebuild an application from the last two results
+_BINOP = 4  # rebuild a BinOp from the last two results
 
 
-def appl(lam: "Lamb", term: Term, i=0):
+def _replace(term: Term, old: Var, new: Term, stats: Optional[EvalStats] = None) -> Term:
+    """
+    Replace `old` by `new` in `term`, without recursion
+
+    This is the implementation behind `Lamb.replace`, `Appl.replace`
+    and `BinOp.replace`. Nodes are not modified, the nodes on the path to
+    a replaced variable are copied and everything else is shared, so a
+    term can safely appear in several places, the argument of `appl`
+    included. Subterms where `old` is not free are skipped without
+    walking them.
+
+    >>> Lamb(Var("y"), Appl(Var("x"), Var("y"))).replace(Var("x"), Appl(Var("f"), Var("y")))
+    (λz.f y z)
+    >>> Appl(Var("x"), Lamb(Var("x"), Var("x"))).replace(Var("x"), Val("1"))
+    1 (λx.x)
+    """
+    results: list = []
+    stack = [(_VISIT, term, old, new)]
+    while stack:
+        task, t, old, new = stack.pop()
+        if task == _VISIT:
+            if old.name not in t.fv:
+                results.append(t)
+            elif isinstance(t, Lamb):
+                if t.var.name in new.fv:
+                    # alpha conversion
+                    if stats is not None:
+                        stats.alpha += 1
+                    var = _next_var(t.var, t.body.fv | new.fv)
+                    stack.append((_LAMB, t, var, None))
+                    stack.append((_RESTART, None, old, new))
+                    stack.append((_VISIT, t.body, t.var, var))
+                else:
+                    stack.append((_LAMB, t, t.var, None))
+                    stack.append((_VISIT, t.body, old, new))
+            elif isinstance(t, Appl):
+                stack.append((_APPL, t, None, None))
+                stack.append((_VISIT, t.e2, old, new))
+                stack.append((_VISIT, t.e1, old, new))
+            elif isinstance(t, BinOp):
+                stack.append((_BINOP, t, None, None))
+                stack.append((_VISIT, t.b, old, new))
+                stack.append((_VISIT, t.a, old, new))
+            else:
+                if stats is not None and isinstance(t, Var) and t.name == old.name:
+                    stats.substitutions += 1
+                results.append(t.replace(old, new))
+        elif task == _RESTART:
+            stack.append((_VISIT, results.pop(), old, new))
+        elif task == _LAMB:
+            # old is the binder, renamed by an alpha conversion or not
+            body = results.pop()
+            if body is not t.body or old is not t.var:
+                t = copy(t)
+                t.var = old
+                t.body = body
+                t.fv = body.fv - old.fv
+            results.append(t)
+        elif task == _APPL:
+            e2 = results.pop()
+            e1 = results.pop()
+            if e1 is not t.e1 or e2 is not t.e2:
+                t = copy(t)
+                t.e1 = e1
+                t.e2 = e2
+                t.fv = e1.fv | e2.fv
+            results.append(t)
+        else:
+            b = results.pop()
+            a = results.pop()
+            if a is not t.a or b is not t.b:
+                t = copy(t)
+                t.a = a
+                t.b = b
+                t.fv = a.fv | b.fv
+            results.append(t)
+    return results.pop()
+
+
+def _show(term: Term) -> str:
+    "Non recursive __repr__ for Lamb, Appl and BinOp"
+    out = []
+    stack: list = [term]
+    while stack:
+        t = stack.pop()
+        if isinstance(t, str):
+            out.append(t)
+        elif isinstance(t, Lamb):
+            stack.extend((")", t.body, ".", t.var, "(λ"))
+        elif isinstance(t, Appl):
+            if isinstance(t.e2, Appl):
+                stack.extend((")", t.e2, " (", t.e1))
+            else:
+                stack.extend((t.e2, " ", t.e1))
+        elif isinstance(t, BinOp):
+            stack.extend((t.b, f" {t.op} ", t.a))
+        else:
+            out.append(repr(t))
+    return "".join(out)
+
+
+def appl(
+    lam: "Lamb",
+    term: Term,
+    i=0,
+    tracer: Optional[Tracer] = None,
+    stats: Optional[EvalStats] = None,
+):
     """
     >>> appl(Lamb(Var("x"), Var("x")), Val("1"))
     1
@@ -197,15 +321,46 @@ def appl(lam: "Lamb", term: Term, i=0):
     >>> appl(Lamb(Var("x"), Var("x")), Lamb(Var("y"), Var("y")))
     (λy.y)
     """
-    res = lam.replace(lam.var, term)
-    if isinstance(res, Lamb):
-        trace(f"appl({lam}, {term}) => {res.body}", i)
-        return res.body
-
-    raise TypeError(f"{res} is not a lambda")
+    if not isinstance(lam, Lamb):
+        raise TypeError(f"{lam} is not a lambda")
+    res = _replace(lam.body, lam.var, term, stats)
+    if tracer is not None:
+        tracer.event("appl", i, res, lambda: f"appl({lam}, {term}) => {res}")
+    return res
+
+
+def _plug(stack: list, term: Term) -> Term:
+    "Put `term` back in the context described by the eval_term frames"
+    for kind, node, i, a in reversed(stack):
+        if kind == _EVAL_E1:
+            term = Appl(term, node.e2)
+        elif kind == _EVAL_E2:
+            term = Appl(a, term)
+        elif kind == _EVAL_A:
+            term = BinOp(node.op, term, node.b)
+        else:
+            term = BinOp(node.op, a, term)
+    return term
 
 
-def eval_term(term: Term, i=0, *, _trace=False) -> Term:
+# eval_term frames
+_EVAL_E1 = 0  # evaluating the function of an application
+_EVAL_E2 = 1  # evaluating the argument, the function value is kept
+_EVAL_A = 2  # evaluating the left side of a BinOp
+_EVAL_B = 3  # evaluating the right side, the left value is kept
+
+
+def eval_term(
+    term: Term,
+    i=0,
+    *,
+    _trace=False,
+    cache=None,
+    tracer: Optional[Tracer] = None,
+    stats: Optional[EvalStats] = None,
+    church=False,
+    cycles=None,
+) -> Term:
     """
     Abstration evaluate to it self
     >>> eval_term(Lamb(Var("x"), Var("x")))
@@ -218,34 +373,294 @@ def eval_term(term: Term, i=0, *, _trace=False) -> Term:
     Application evalute by CBV
     >>> eval_term(Appl(Lamb(Var("x"), Var("x")), Lamb(Var("y"), Var("y"))))
     (λy.y)
-    """
-    trace(f"eval({term})", i, _trace=_trace)
-    if isinstance(term, Appl):
-        e1 = eval_term(term.e1, i + 1, _trace=_trace)
-        e2 = eval_term(term.e2, i + 1, _trace=_trace)
-        if isinstance(e1, Lamb):
-            return eval_term(appl(e1, e2, i + 1), i + 1, _trace=_trace)
-    elif isinstance(term, BinOp):
-        a = eval_term(term.a, i + 1, _trace=_trace)
-        b = eval_term(term.b, i + 1, _trace=_trace)
-
-        if isinstance(a, Val) and isinstance(b, Val):
-            return Val(term.opfun(a.val, b.val))
 
-    return term
+    Pending work is kept in an explicit stack of frames instead of Python
+    frames, so the depth of the term is only bounded by memory
+
+    With `stats`, steps are counted and OutOfFuel is raised with the
+    partially reduced term once `stats.fuel` steps were made
+    >>> eval_term(Appl(Lamb(Var("x"), Var("x")), BinOp("+", Val("1"), Val("1"))), stats=EvalStats(fuel=1))
+    Traceback (most recent call last):
+    ...
+    lampy.utils.OutOfFuel: out of fuel after 1 steps
+
+    With `church`, combinators applied to Church numerals and booleans
+    are computed natively by `lampy.church`
+
+    `cycles`, a `lampy.fingerprint.CycleDetector`, is given the state
+    after every beta step, Diverges is raised when a state repeats
+    """
+    if cache is not None:
+        # a lampy.nfcache.NFCache
+        key = cache.key(term, "eval_term+church" if church else "eval_term")
+        res = cache.get(key)
+        if res is None:
+            res = eval_term(
+                term, i, _trace=_trace, tracer=tracer, stats=stats, church=church, cycles=cycles
+            )
+            cache.put(key, res)
+        return res
+
+    if _trace and tracer is None:
+        tracer = StderrTracer()
+    accelerate = None
+    if church:
+        from lampy.church import accelerate
+    value, _, _, _ = _eval_loop(term, [], i, tracer, stats, accelerate, cycles=cycles)
+    return value
+
+
+def _eval_loop(
+    term: Term,
+    stack: list,
+    i: int,
+    tracer: Optional[Tracer],
+    stats: Optional[EvalStats],
+    accelerate: Optional[Callable],
+    budget: Optional[int] = None,
+    cycles=None,
+) -> Tuple[Term, int, bool, int]:
+    """
+    The eval_term machine, evaluates `term` in the context of the frames
+    in `stack`. With a `budget` it stops once that many steps were made,
+    at the next point it can be resumed from, and returns the term to
+    evaluate next with the stack as it's left. Returns the term, its
+    depth, whether the evaluation is complete and the number of steps.
+    """
+    steps = 0
+    while True:
+        if budget is not None and steps >= budget:
+            return term, i, False, steps
+        # walk down to the leftmost subterm that can't be split
+        while True:
+            if tracer is not None:
+                tracer.event("eval", i, term, lambda t=term: f"eval({t})")
+            if isinstance(term, Appl):
+                stack.append((_EVAL_E1, term, i, None))
+                term = term.e1
+            elif isinstance(term, BinOp):
+                stack.append((_EVAL_A, term, i, None))
+                term = term.a
+            else:
+                break
+            i += 1
+        if stats is not None and len(stack) > stats.max_depth:
+            stats.max_depth = len(stack)
+        value = term
+
+        # return the value to the pending frames
+        while stack:
+            kind, node, i, a = stack.pop()
+            if kind == _EVAL_E1:
+                stack.append((_EVAL_E2, node, i, value))
+                term = node.e2
+                i += 1
+                break
+            elif kind == _EVAL_E2:
+                if isinstance(a, Lamb):
+                    if stats is not None:
+                        if stats.out_of_fuel():
+                            raise OutOfFuel(_plug(stack, Appl(a, value)), stats)
+                        stats.beta += 1
+                    steps += 1
+                    if accelerate is not None:
+                        res = accelerate(a, value)
+                        if res is not None:
+                            if tracer is not None:
+                                tracer.event(
+                                    "church", i + 1, res, lambda a=a, v=value: f"church({a}, {v})"
+                                )
+                            value = res
+                            continue
+                    term = appl(a, value, i + 1, tracer, stats)
+                    if cycles is not None:
+                        period = cycles.check(term, stack)
+                        if period is not None:
+                            raise Diverges(_plug(stack, term), period, stats)
+                    i += 1
+                    break
+                value = node
+            elif kind == _EVAL_A:
+                stack.append((_EVAL_B, node, i, value))
+                term = node.b
+                i += 1
+                break
+            else:
+                if isinstance(a, Val) and isinstance(value, Val):
+                    if stats is not None:
+                        if stats.out_of_fuel():
+                            raise OutOfFuel(_plug(stack, BinOp(node.op, a, value)), stats)
+                        stats.binops += 1
+                    steps += 1
+                    value = Val(node.opfun(a.val, value.val))
+                else:
+                    value = node
+        else:
+            return value, i, True, steps
+
+
+# Alternative evaluators, each module exposes `normalize(term) -> Term`
+_engines = {
+    "debruijn": "lampy.debruijn",
+    "cek": "lampy.cek",
+    "need": "lampy.lazy",
+    "nbe": "lampy.nbe",
+    "compile": "lampy.compiler",
+    "graph": "lampy.graph",
+    "arena": "lampy.arena",
+    "vm": "lampy.vm",
+}
+
+
+def _engine(name: str) -> Callable[[Term], Term]:
+    if name not in _engines:
+        raise ValueError(f"Unknown engine {name}")
+    return importlib.import_module(_engines[name]).normalize
 
 
 class AST:
     def __init__(self, root: Term):
         self.root = root
 
-    def eval(self, _trace=False):
-        _reset_bound_vars()
-        t = eval_term(self.root, _trace=_trace)
-        prev = None
-        while not t.is_norm:
-            prev = t
-            t = eval_term(t, _trace=_trace)
-            if prev == t:
-                break
+    def eval(
+        self,
+        _trace=False,
+        engine="subst",
+        cache=None,
+        tracer=None,
+        fuel=None,
+        stats=False,
+        church=False,
+        strategy="applicative",
+        detect_cycles=False,
+    ):
+        """
+        `fuel` limits the number of reduction steps, OutOfFuel is raised
+        with the partially reduced term when it runs out. With `stats=True`
+        an EvalStats is returned along with the result. `church` turns on
+        the native Church numerals of `lampy.church`, for the subst engine.
+        `strategy` is one of `lampy.strategy.STRATEGIES`, the default is
+        applicative order, what `eval_term` does. With `detect_cycles`
+        Diverges is raised when the evaluation loops, see
+        `lampy.fingerprint`.
+
+        >>> AST(Appl(Lamb(Var("x"), BinOp("+", Var("x"), Val("1"))), Val("2"))).eval(stats=True)
+        (3, EvalStats(beta=1, substitutions=1, alpha=0, binops=1, max_size=7, max_depth=1))
+        """
+        st = EvalStats(fuel) if stats or fuel is not None else None
+        t = self._eval(_trace, engine, cache, tracer, st, church, strategy, detect_cycles)
+        return (t, st) if stats else t
+
+    def _eval(
+        self,
+        _trace,
+        engine,
+        cache,
+        tracer,
+        stats,
+        church=False,
+        strategy="applicative",
+        detect_cycles=False,
+    ):
+        if cache is not None:
+            # a lampy.nfcache.NFCache, shared between ASTs
+            tag = engine if strategy == "applicative" else strategy
+            key = cache.key(self.root, f"{tag}+church" if church else tag)
+            res = cache.get(key)
+            if res is None:
+                res = self._eval(
+                    _trace, engine, None, tracer, stats, church, strategy, detect_cycles
+                )
+                cache.put(key, res)
+            return res
+        if strategy != "applicative":
+            if engine != "subst" or church:
+                raise ValueError(f"The {strategy} strategy only runs on plain subst")
+            if detect_cycles:
+                raise ValueError(f"The {strategy} strategy has no cycle detection")
+            from lampy.strategy import reduce
+
+            with phase(stats, strategy):
+                return reduce(self.root, strategy, stats=stats)
+        if engine != "subst":
+            if stats is not None and stats.fuel is not None:
+                raise ValueError(f"The {engine} engine has no fuel limit")
+            if church:
+                raise ValueError(f"The {engine} engine has no Church acceleration")
+            if detect_cycles:
+                raise ValueError(f"The {engine} engine has no cycle detection")
+            with phase(stats, engine):
+                return _engine(engine)(self.root)
+        cycles = None
+        if detect_cycles:
+            from lampy.fingerprint import CycleDetector
+
+            cycles = CycleDetector()
+        t = self.root
+        while True:
+            if stats is not None:
+                stats.max_size = max(stats.max_size, t.size)
+            with phase(stats, "eval"):
+                t, prev = (
+                    eval_term(
+                        t, _trace=_trace, tracer=tracer, stats=stats, church=church, cycles=cycles
+                    ),
+                    t,
+                )
+            with phase(stats, "is_norm"):
+                # a pass that returns its own term was stuck, loops
+                # inside of a pass are caught by `cycles`
+                if t.is_norm or t is prev:
+                    break
+        if stats is not None:
+            stats.max_size = max(stats.max_size, t.size)
         return t
+
+    def normalize(self) -> Term:
+        """
+        Full beta-normal form, reducing under lambdas too, computed in a
+        single pass by `lampy.nbe`
+
+        >>> AST(Lamb(Var("x"), Appl(Lamb(Var("y"), Var("y")), Var("x")))).normalize()
+        (λx.x)
+        """
+        return _engine("nbe")(self.root)
+
+    def optimize(self, passes=None):
+        """
+        Rewrite the term with the passes of `lampy.optimize`, returns the
+        new AST and what each pass changed
+
+        >>> ast, reports = AST(BinOp("+", Val("1"), Val("2"))).optimize()
+        >>> ast.root, [str(r) for r in reports]
+        (3, ['fold: 1 + 2 => 3'])
+        """
+        from lampy.optimize import optimize
+
+        root, reports = optimize(self.root, passes=passes)
+        return AST(root), reports
+
+    def specialize(self, static, fuel=1000, cache=None):
+        """
+        The term applied to its `static` arguments and partially
+        evaluated by `lampy.specialize`, the residual takes the others
+
+        >>> inc = AST(Lamb(Var("x"), Lamb(Var("y"), BinOp("+", Var("x"), Var("y")))))
+        >>> inc.specialize([1]).root
+        (λy.1 + y)
+        """
+        from lampy.specialize import specialize
+
+        return AST(specialize(self.root, static, fuel, cache))
+
+    def compile(self):
+        """
+        Compile the term to Python code once, the result is called with
+        the arguments
+
+        >>> AST(Lamb(Var("x"), BinOp("*", Var("x"), Val("2")))).compile()(21)
+        42
+        """
+        from lampy.compiler import CompiledTerm
+
+        return CompiledTerm(self.root)
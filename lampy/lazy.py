@@ -0,0 +1,143 @@
+"""
+Call by need evaluation for lampy.lampy terms
+
+Like `lampy.cek`, but arguments are not evaluated before the call. Each
+argument becomes a thunk in the environment of the callee, it is
+evaluated the first time a variable bound to it is demanded and then
+updated with its value, so every argument is evaluated at most once and
+arguments that are never used are never evaluated.
+
+>>> omega = Appl(Lamb(Var("x"), Appl(Var("x"), Var("x"))), Lamb(Var("x"), Appl(Var("x"), Var("x"))))
+>>> AST(Appl(Lamb(Var("x"), Val("1")), omega)).eval(engine="need")
+1
+"""
+from lampy.lampy import Term, Var, Val, Lamb, Appl, BinOp, AST
+from lampy.debruijn import (
+    DTerm,
+    Ix,
+    Free,
+    DVal,
+    DLamb,
+    DAppl,
+    DBinOp,
+    to_debruijn,
+    from_debruijn,
+)
+from lampy.cek import Env, Closure, Neutral, lookup, _close
+
+
+class Thunk:
+    "A suspended argument, updated in place once it is evaluated"
+
+    def __init__(self, term: DTerm, env: Env, value=None):
+        self.term = term
+        self.env = env
+        self.value = value
+
+    def __repr__(self):
+        if self.value is None:
+            return f"<thunk {self.term}>"
+        return f"<thunk ={self.value}>"
+
+
+# continuation frames
+_APPLY = 0  # apply the function value to the thunk in the frame
+_UPDATE = 1  # store the value in the thunk in the frame
+_BIN_B = 2  # evaluate the right side of a BinOp
+_BIN_OP = 3  # fold a BinOp
+
+
+def _delay(term: DTerm, env: Env) -> Thunk:
+    if isinstance(term, Ix):
+        # share the thunk instead of making a thunk of a thunk
+        return lookup(env, term.index)
+    elif isinstance(term, DVal):
+        return Thunk(None, None, term)
+    elif isinstance(term, DLamb):
+        return Thunk(None, None, Closure(term, env))
+    return Thunk(term, env)
+
+
+def run(term: DTerm, env: Env = None):
+    """
+    Evaluate `term` to weak head normal form, the values in closures
+    environments are thunks
+
+    >>> run(to_debruijn(Appl(Lamb(Var("x"), BinOp("*", Var("x"), Var("x"))), BinOp("+", Val("1"), Val("2")))))
+    9
+    """
+    stack: list = []
+    control = term
+    while True:
+        if isinstance(control, DAppl):
+            stack.append((_APPLY, _delay(control.e2, env)))
+            control = control.e1
+            continue
+        elif isinstance(control, DBinOp):
+            stack.append((_BIN_B, control, env))
+            control = control.a
+            continue
+        elif isinstance(control, Ix):
+            thunk = lookup(env, control.index)
+            if thunk.value is None:
+                stack.append((_UPDATE, thunk))
+                control, env = thunk.term, thunk.env
+                continue
+            value = thunk.value
+        elif isinstance(control, DLamb):
+            value = Closure(control, env)
+        elif isinstance(control, Free):
+            value = Neutral(control)
+        else:
+            value = control
+
+        while True:
+            if not stack:
+                return value
+            frame = stack.pop()
+            kind = frame[0]
+            if kind == _APPLY:
+                if isinstance(value, Closure):
+                    control, env = value.lamb.body, (frame[1], value.env)
+                    break
+                value = Neutral(DAppl(readback(value), readback(frame[1])))
+            elif kind == _UPDATE:
+                thunk = frame[1]
+                thunk.value = value
+                thunk.term = thunk.env = None
+            elif kind == _BIN_B:
+                stack.append((_BIN_OP, frame[1].op, value))
+                control, env = frame[1].b, frame[2]
+                break
+            else:
+                op, a = frame[1], frame[2]
+                if isinstance(a, DVal) and isinstance(value, DVal):
+                    value = DVal(BinOp.opmap[op](a.val, value.val))
+                else:
+                    value = Neutral(DBinOp(op, readback(a), readback(value)))
+
+
+def readback(value) -> DTerm:
+    """
+    Turn a value or a thunk back into a term. Thunks that were never
+    demanded are read back unevaluated, so reading back never diverges.
+    """
+    if isinstance(value, Thunk):
+        if value.value is None:
+            return _close(value.term, value.env, 0, readback)
+        value = value.value
+    if isinstance(value, Closure):
+        return DLamb(_close(value.lamb.body, value.env, 1, readback), value.lamb.hint)
+    elif isinstance(value, Neutral):
+        return value.term
+    return value
+
+
+def normalize(term: Term) -> Term:
+    """
+    Entry point used by `AST.eval(engine="need")`
+
+    >>> normalize(Appl(Lamb(Var("x"), Lamb(Var("y"), Var("x"))), BinOp("+", Val("1"), Val("2"))))
+    (λy.1 + 2)
+    """
+    return from_debruijn(readback(run(to_debruijn(term))))
@@ -0,0 +1,186 @@
+"""
+Normalization by evaluation for lampy.lampy terms
+
+Terms are evaluated into values: lambdas become closures, variables
+that can't be reduced become neutral terms. Reading the value back
+applies each closure to a fresh neutral variable, which gives the full
+beta-normal form, bodies of lambdas included, in a single pass. Both
+keep their pending work on a list, so deep terms don't hit the
+recursion limit.
+
+Arguments are evaluated before the call, as in `eval_term`, so a term
+that only has a normal form under a lazy strategy, like (λx.1) Ω, won't
+normalize here. Stuck terms differ too: `eval_term` leaves a stuck
+application or BinOp as it is, here its subterms are normalized like
+the rest of the term.
+
+>>> AST(Appl(Var("f"), Appl(Lamb(Var("y"), Var("y")), Val("1")))).eval(engine="nbe")
+f 1
+
+>>> normalize(Lamb(Var("x"), Appl(Lamb(Var("y"), Var("y")), Var("x"))))
+(λx.x)
+
+>>> AST(Appl(Lamb(Var("x"), Lamb(Var("y"), BinOp("+", Var("x"), Val("1")))), Val("1"))).eval(engine="nbe")
+(λy.2)
+"""
+from typing import List, Optional, Tuple
+
+from lampy.lampy import Term, Var, Val, Lamb, Appl, BinOp, AST
+from lampy.debruijn import (
+    DTerm,
+    Ix,
+    Free,
+    DVal,
+    DLamb,
+    DAppl,
+    DBinOp,
+    to_debruijn,
+    from_debruijn,
+)
+from lampy.cek import Env, lookup
+
+
+class Fun:
+    "A lambda with the environment it was evaluated in"
+
+    def __init__(self, body: DTerm, env: Env, hint: str):
+        self.body = body
+        self.env = env
+        self.hint = hint
+
+    def __repr__(self):
+        return f"<fun {self.hint}>"
+
+
+class NVar:
+    "Variable introduced by readback, identified by de Bruijn level"
+
+    def __init__(self, level: int):
+        self.level = level
+
+
+class NFree:
+    def __init__(self, name: str):
+        self.name = name
+
+
+class NAppl:
+    def __init__(self, e1, e2):
+        self.e1 = e1
+        self.e2 = e2
+
+
+class NBinOp:
+    def __init__(self, op: str, a, b):
+        self.op = op
+        self.a = a
+        self.b = b
+
+
+# evaluate frames
+_ARG = 0  # evaluate the argument of an application
+_FUN = 1  # apply a function value to the argument value
+_BIN_B = 2  # evaluate the right side of a BinOp
+_BIN_OP = 3  # fold a BinOp
+
+
+def evaluate(term: DTerm, env: Env = None):
+    "The value of a term, with an explicit stack of frames like `lampy.cek.run`"
+    stack: list = []
+    control = term
+    while True:
+        if isinstance(control, DAppl):
+            stack.append((_ARG, control.e2, env))
+            control = control.e1
+            continue
+        elif isinstance(control, DBinOp):
+            stack.append((_BIN_B, control, env))
+            control = control.a
+            continue
+        elif isinstance(control, Ix):
+            value = lookup(env, control.index)
+        elif isinstance(control, Free):
+            value = NFree(control.name)
+        elif isinstance(control, DLamb):
+            value = Fun(control.body, env, control.hint)
+        else:
+            value = control
+
+        while True:
+            if not stack:
+                return value
+            frame = stack.pop()
+            kind = frame[0]
+            if kind == _ARG:
+                stack.append((_FUN, value))
+                control, env = frame[1], frame[2]
+                break
+            elif kind == _FUN:
+                fun = frame[1]
+                if isinstance(fun, Fun):
+                    control, env = fun.body, (value, fun.env)
+                    break
+                value = NAppl(fun, value)
+            elif kind == _BIN_B:
+                stack.append((_BIN_OP, frame[1].op, value))
+                control, env = frame[1].b, frame[2]
+                break
+            else:
+                op, a = frame[1], frame[2]
+                if isinstance(a, DVal) and isinstance(value, DVal):
+                    value = DVal(BinOp.opmap[op](a.val, value.val))
+                else:
+                    value = NBinOp(op, a, value)
+
+
+def readback(value, level=0) -> DTerm:
+    """
+    Read a value back as a normal form, `level` is the number of
+    enclosing binders. The body of a function is evaluated with a fresh
+    variable for its parameter, and read back in turn.
+    """
+    results: List[DTerm] = []
+    # (value, level), or (value, None) to build the node of the value
+    stack: List[Tuple[object, Optional[int]]] = [(value, level)]
+    while stack:
+        v, lv = stack.pop()
+        if lv is None:
+            if isinstance(v, Fun):
+                results.append(DLamb(results.pop(), v.hint))
+                continue
+            b = results.pop()
+            a = results.pop()
+            results.append(DAppl(a, b) if isinstance(v, NAppl) else DBinOp(v.op, a, b))  # type: ignore
+        elif isinstance(v, Fun):
+            stack.append((v, None))
+            stack.append((evaluate(v.body, (NVar(lv), v.env)), lv + 1))
+        elif isinstance(v, NVar):
+            results.append(Ix(lv - v.level - 1))
+        elif isinstance(v, NFree):
+            results.append(Free(v.name))
+        elif isinstance(v, NAppl):
+            stack.append((v, None))
+            stack.append((v.e2, lv))
+            stack.append((v.e1, lv))
+        elif isinstance(v, NBinOp):
+            stack.append((v, None))
+            stack.append((v.b, lv))
+            stack.append((v.a, lv))
+        else:
+            results.append(v)  # type: ignore
+    return results.pop()
+
+
+def nf(term: DTerm) -> DTerm:
+    """
+    Beta-normal form of a locally nameless term
+
+    >>> nf(to_debruijn(Lamb(Var("f"), Lamb(Var("x"), Appl(Lamb(Var("y"), Appl(Var("f"), Var("y"))), Var("x"))))))
+    (λ.(λ.#1 #0))
+    """
+    return readback(evaluate(term))
+
+
+def normalize(term: Term) -> Term:
+    "Entry point used by `AST.eval(engine=\"nbe\")` and `AST.normalize`"
+    return from_debruijn(nf(to_debruijn(term)))
@@ -0,0 +1,106 @@
+"""
+Cache of normal forms keyed modulo alpha conversion
+
+The key of a term is a digest of its locally nameless prefix encoding,
+so (λx.x) 1 and (λy.y) 1 share an entry. Entries are kept in memory with
+LRU eviction, optionally backed by a `shelve` file so a restarted
+process starts warm.
+
+>>> cache = NFCache(maxsize=2)
+>>> AST(Appl(Lamb(Var("x"), Var("x")), Val("1"))).eval(cache=cache)
+1
+>>> AST(Appl(Lamb(Var("y"), Var("y")), Val("1"))).eval(cache=cache)
+1
+>>> cache.info()
+CacheInfo(hits=1, misses=1, disk_hits=0, evictions=0, size=1, maxsize=2)
+"""
+import hashlib
+import shelve
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from lampy.lampy import Term, Var, Val, Lamb, Appl, BinOp, AST
+from lampy.debruijn import DTerm, to_debruijn, from_debruijn, to_prefix, from_prefix
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    disk_hits: int
+    evictions: int
+    size: int
+    maxsize: int
+
+
+class NFCache:
+    def __init__(self, maxsize=1024, path: Optional[str] = None):
+        self.maxsize = maxsize
+        self.path = path
+        self._entries: "OrderedDict[str, DTerm]" = OrderedDict()
+        self._disk = shelve.open(path) if path is not None else None
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(term: Term, tag="") -> str:
+        """
+        Alpha invariant key, `tag` tells apart the results of different
+        evaluators for the same term
+
+        >>> NFCache.key(Lamb(Var("x"), Var("x"))) == NFCache.key(Lamb(Var("y"), Var("y")))
+        True
+        """
+        data = f"{tag}:{to_prefix(to_debruijn(term))}".encode()
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    def get(self, key: str) -> Optional[Term]:
+        "The cached normal form, entries are stored locally nameless and named again here"
+        res = self._entries.get(key)
+        if res is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return from_debruijn(res)
+        if self._disk is not None and key in self._disk:
+            res = from_prefix(self._disk[key])
+            self._insert(key, res)
+            self.disk_hits += 1
+            return from_debruijn(res)
+        self.misses += 1
+        return None
+
+    def put(self, key: str, term: Term):
+        res = to_debruijn(term)
+        self._insert(key, res)
+        if self._disk is not None:
+            self._disk[key] = to_prefix(res, hints=True)
+
+    def _insert(self, key: str, res: DTerm):
+        self._entries[key] = res
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(
+            self.hits,
+            self.misses,
+            self.disk_hits,
+            self.evictions,
+            len(self._entries),
+            self.maxsize,
+        )
+
+    def clear(self):
+        "Drop the memory entries, the disk ones are kept"
+        self._entries.clear()
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+
+    def __len__(self):
+        return len(self._entries)
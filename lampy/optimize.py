@@ -0,0 +1,303 @@
+"""
+Static rewrites of lampy.lampy and lampy.tlampy terms before evaluation
+
+Every pass keeps the call by value result of the term, and reports the
+subterms it rewrote:
+
+- fold: `BinOp`s over two `Val`s are computed
+- dead: arguments that are values, passed to a parameter that isn't
+  used, are dropped along with the parameter, across curried lambdas
+- eta: λx.M x becomes M when x isn't free in M and M is a value
+- cse: closed applications and BinOps that are evaluated more than
+  once outside of lambdas are evaluated once and bound to a variable
+
+>>> from lampy.parser import parse
+>>> t, reports = optimize(parse("((a, b) => a + (2 * 3)) 1 2;")[0].root)
+>>> t
+(λa.a + 6) 1
+>>> [str(r) for r in reports]
+['fold: 2 * 3 => 6', 'dead: (λa.(λb.a + 6)) 1 2 => (λa.a + 6) 1']
+"""
+from typing import Callable, Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+from lampy import lampy, tlampy
+from lampy.utils import fresh_name
+
+
+class Report(NamedTuple):
+    name: str
+    changes: List[Tuple[object, object]]
+
+    def __str__(self):
+        return f"{self.name}: " + ", ".join(f"{a} => {b}" for a, b in self.changes)
+
+
+class _Pass:
+    "The language specific parts, shared by the passes"
+
+    def __init__(self, lang):
+        self.lang = lang
+        self.typed = lang is tlampy
+        self._fv: Dict[int, tuple] = {}
+        self.changes: List[Tuple[object, object]] = []
+
+    def kids(self, t) -> tuple:
+        if isinstance(t, self.lang.Lamb):
+            return (t.body,)
+        elif isinstance(t, self.lang.Appl):
+            return (t.e1, t.e2)
+        elif isinstance(t, self.lang.BinOp):
+            return (t.a, t.b)
+        return ()
+
+    def rebuild(self, t, kids):
+        if isinstance(t, self.lang.Lamb):
+            return self.lang.Lamb(t.var, *kids)
+        elif isinstance(t, self.lang.Appl):
+            return self.lang.Appl(*kids)
+        return self.lang.BinOp(t.op, *kids)
+
+    def val(self, res):
+        if self.typed:
+            return self.lang.Val(res, type(res))
+        return self.lang.Val(res)
+
+    def var(self, name, like):
+        if self.typed:
+            return self.lang.Var(name, like.typ)
+        return self.lang.Var(name)
+
+    def is_value(self, t) -> bool:
+        return isinstance(t, (self.lang.Var, self.lang.Val, self.lang.Lamb))
+
+    def fv(self, term) -> FrozenSet[str]:
+        "lampy terms carry their free variables, tlampy ones are computed"
+        if not self.typed:
+            return term.fv
+        stack = [(term, False)]
+        while stack:
+            t, expanded = stack.pop()
+            if id(t) in self._fv:
+                continue
+            kids = self.kids(t)
+            if kids and not expanded:
+                stack.append((t, True))
+                stack.extend((k, False) for k in kids)
+                continue
+            if isinstance(t, self.lang.Var):
+                res = frozenset((t.name,))
+            elif isinstance(t, self.lang.Lamb):
+                res = self._fv[id(t.body)][1] - {t.var.name}
+            else:
+                res = frozenset().union(*(self._fv[id(k)][1] for k in kids))
+            # the term is kept so its id isn't reused
+            self._fv[id(t)] = (t, res)
+        return self._fv[id(term)][1]
+
+    def bottom_up(self, term, rule: Callable, stop: Optional[Callable] = None):
+        """
+        Rewrite the children first, then `rule(node)`, None for no change.
+        `stop(node)` is tried before the children, a term replaces the
+        node without looking at them.
+        """
+        results: list = []
+        stack = [(term, False)]
+        while stack:
+            t, expanded = stack.pop()
+            if not expanded and stop is not None:
+                res = stop(t)
+                if res is not None:
+                    results.append(res)
+                    continue
+            kids = self.kids(t)
+            if kids and not expanded:
+                stack.append((t, True))
+                stack.extend((k, False) for k in reversed(kids))
+                continue
+            if kids:
+                new = results[len(results) - len(kids) :]
+                del results[len(results) - len(kids) :]
+                if any(a is not b for a, b in zip(new, kids)):
+                    t = self.rebuild(t, new)
+            res = rule(t)
+            if res is not None:
+                self.changes.append((t, res))
+                t = res
+            results.append(t)
+        return results.pop()
+
+
+def fold(term, p: _Pass):
+    def rule(t):
+        if (
+            isinstance(t, p.lang.BinOp)
+            and isinstance(t.a, p.lang.Val)
+            and isinstance(t.b, p.lang.Val)
+        ):
+            try:
+                return p.val(t.opfun(t.a.val, t.b.val))
+            except ZeroDivisionError:
+                # left for the evaluator to report, if it's ever reached
+                return None
+        return None
+
+    return p.bottom_up(term, rule)
+
+
+def eta(term, p: _Pass):
+    def rule(t):
+        if (
+            isinstance(t, p.lang.Lamb)
+            and isinstance(t.body, p.lang.Appl)
+            and isinstance(t.body.e2, p.lang.Var)
+            and t.body.e2.name == t.var.name
+            and isinstance(t.body.e1, (p.lang.Var, p.lang.Lamb))
+            and t.var.name not in p.fv(t.body.e1)
+        ):
+            return t.body.e1
+        return None
+
+    return p.bottom_up(term, rule)
+
+
+def dead(term, p: _Pass):
+    def rule(t):
+        if not isinstance(t, p.lang.Appl):
+            return None
+        args = []
+        head = t
+        while isinstance(head, p.lang.Appl):
+            args.append(head.e2)
+            head = head.e1
+        args.reverse()
+        params = []
+        body = head
+        while isinstance(body, p.lang.Lamb) and len(params) < len(args):
+            params.append(body.var)
+            body = body.body
+        # a parameter is dead if the lambdas after it don't use it
+        keep = [True] * len(params)
+        used = p.fv(body)
+        for i in reversed(range(len(params))):
+            if params[i].name not in used and p.is_value(args[i]):
+                keep[i] = False
+            else:
+                used = used - {params[i].name}
+        if all(keep):
+            return None
+        for var, k in reversed(list(zip(params, keep))):
+            if k:
+                body = p.lang.Lamb(var, body)
+        for arg, k in zip(args, keep + [True] * (len(args) - len(params))):
+            if k:
+                body = p.lang.Appl(body, arg)
+        return body
+
+    return p.bottom_up(term, rule)
+
+
+def _keys(term, p: _Pass) -> Dict[int, int]:
+    "Structural keys, equal subterms have the same key"
+    table: Dict[tuple, int] = {}
+    keys: Dict[int, int] = {}
+    stack = [(term, False)]
+    while stack:
+        t, expanded = stack.pop()
+        kids = p.kids(t)
+        if kids and not expanded:
+            stack.append((t, True))
+            stack.extend((k, False) for k in kids)
+            continue
+        if isinstance(t, p.lang.Var):
+            data: tuple = ("var", t.name)
+        elif isinstance(t, p.lang.Val):
+            data = ("val", type(t.val), t.val)
+        elif isinstance(t, p.lang.Lamb):
+            data = ("lamb", t.var.name)
+        elif isinstance(t, p.lang.Appl):
+            data = ("appl",)
+        else:
+            data = ("binop", t.op)
+        keys[id(t)] = table.setdefault(data + tuple(keys[id(k)] for k in kids), len(table))
+    return keys
+
+
+def _names(term, p: _Pass) -> set:
+    names = set()
+    stack = [term]
+    while stack:
+        t = stack.pop()
+        if isinstance(t, p.lang.Var):
+            names.add(t.name)
+        elif isinstance(t, p.lang.Lamb):
+            names.add(t.var.name)
+        stack.extend(p.kids(t))
+    return names
+
+
+def cse(term, p: _Pass):
+    keys = _keys(term, p)
+    work = (p.lang.Appl, p.lang.BinOp)
+
+    # occurrences outside of lambdas, those are all evaluated anyway
+    counts: Dict[int, int] = {}
+    stack = [term]
+    while stack:
+        t = stack.pop()
+        if isinstance(t, work):
+            counts[keys[id(t)]] = counts.get(keys[id(t)], 0) + 1
+            stack.extend(p.kids(t))
+
+    # the outermost repeated closed subterms
+    shared: Dict[int, object] = {}
+    stack = [term]
+    while stack:
+        t = stack.pop()
+        if not isinstance(t, work):
+            continue
+        k = keys[id(t)]
+        if k in shared or (counts[k] > 1 and not p.fv(t)):
+            shared.setdefault(k, t)
+        else:
+            stack.extend(reversed(p.kids(t)))
+    if not shared:
+        return term
+
+    taken = _names(term, p)
+    variables = {}
+    for k, t in shared.items():
+        name = fresh_name("u", taken)
+        taken.add(name)
+        variables[k] = p.var(name, t)
+        p.changes.append((t, variables[k]))
+
+    def stop(t):
+        # closed, so replacing the occurrences under lambdas is safe too
+        return variables.get(keys.get(id(t)))
+
+    term = p.bottom_up(term, lambda t: None, stop)
+    for k, t in reversed(list(shared.items())):
+        term = p.lang.Appl(p.lang.Lamb(variables[k], term), t)
+    return term
+
+
+PASSES: Dict[str, Callable] = {
+    "fold": fold,
+    "dead": dead,
+    "eta": eta,
+    "cse": cse,
+}
+
+
+def optimize(term, lang=lampy, passes: Optional[List[str]] = None):
+    """
+    Run the `passes`, all of them by default, in order. Returns the new
+    term and a Report for each pass that changed something.
+    """
+    reports = []
+    for name in passes or PASSES:
+        p = _Pass(lang)
+        term = PASSES[name](term, p)
+        if p.changes:
+            reports.append(Report(name, p.changes))
+    return term, reports
@@ -0,0 +1,163 @@
+"""
+Reduce independent subterms of a lampy.lampy term in parallel processes,
+and evaluate many terms in a thread pool
+
+Outside of lambdas, eval_term evaluates the two sides of an `Appl` or a
+`BinOp` independently of each other, the result of a subterm doesn't
+depend on where it is. `normalize` walks those positions, sends the
+biggest subterms with work in them to a `ProcessPoolExecutor` and
+finishes the evaluation locally, taking the values of those subterms
+when eval_term would use them. An application that gets stuck keeps its
+subterms as they were, as in eval_term, so the result is the same as
+`AST.eval()`.
+
+Terms cross the process boundary in the binary format of
+`lampy.serialize`, written and read without recursion.
+
+`eval_all` runs `AST.eval` on many terms, lampy or tlampy, from a
+`ThreadPoolExecutor`. The evaluators keep their state in their own
+frames, not in the modules, and terms are never modified, so the terms
+can share subterms.
+
+>>> eval_all([Appl(Lamb(Var("x"), BinOp("+", Var("x"), Val("1"))), Val(str(i))) for i in range(3)])
+[1, 2, 3]
+"""
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+from lampy.lampy import Term, Var, Val, Lamb, Appl, BinOp, AST, appl, eval_term
+from lampy.serialize import dumps, loads
+
+
+def _eval_job(job: bytes) -> bytes:
+    return dumps(eval_term(loads(job)))
+
+
+def _sizes(term: Term) -> Dict[int, int]:
+    "Sizes of the subterms in evaluation position, by id"
+    sizes: Dict[int, int] = {}
+    stack = [(term, False)]
+    while stack:
+        t, expanded = stack.pop()
+        if isinstance(t, Appl):
+            kids = (t.e1, t.e2)
+        elif isinstance(t, BinOp):
+            kids = (t.a, t.b)
+        else:
+            sizes[id(t)] = t.size
+            continue
+        if expanded:
+            sizes[id(t)] = 1 + sizes[id(kids[0])] + sizes[id(kids[1])]
+        else:
+            stack.append((t, True))
+            stack.extend((k, False) for k in kids)
+    return sizes
+
+
+def split(term: Term, threshold: int) -> List[Term]:
+    """
+    The subterms to evaluate in parallel: nodes are split while both
+    sides have at least `threshold` nodes, then the sides that are big
+    enough are jobs. Lambdas, values and variables have nothing to do.
+
+    >>> i = Lamb(Var("x"), Var("x"))
+    >>> split(BinOp("+", Appl(i, Val("1")), Appl(i, Val("2"))), 3)
+    [(λx.x) 1, (λx.x) 2]
+    """
+    sizes = _sizes(term)
+    jobs = []
+    stack = [term]
+    while stack:
+        t = stack.pop()
+        if isinstance(t, Appl):
+            kids = [t.e1, t.e2]
+        elif isinstance(t, BinOp):
+            kids = [t.a, t.b]
+        else:
+            continue
+        if all(sizes[id(k)] >= threshold for k in kids):
+            stack.extend(reversed(kids))
+        elif sizes[id(t)] >= threshold:
+            jobs.append(t)
+    return jobs
+
+
+def _reduce(term: Term, values: Dict[int, Term]) -> Term:
+    """
+    `eval_term(term)` with the values of the subterms in `values`, by id,
+    already known
+    """
+    results: List[Term] = []
+    stack = [(term, False)]
+    while stack:
+        t, expanded = stack.pop()
+        if id(t) in values:
+            results.append(values[id(t)])
+        elif not isinstance(t, (Appl, BinOp)):
+            results.append(eval_term(t))
+        elif not expanded:
+            stack.append((t, True))
+            kids = (t.e1, t.e2) if isinstance(t, Appl) else (t.a, t.b)
+            stack.extend((k, False) for k in reversed(kids))
+        else:
+            b = results.pop()
+            a = results.pop()
+            if isinstance(t, Appl) and isinstance(a, Lamb):
+                results.append(eval_term(appl(a, b)))
+            elif isinstance(t, BinOp) and isinstance(a, Val) and isinstance(b, Val):
+                results.append(Val(t.opfun(a.val, b.val)))
+            else:
+                # stuck, the values are dropped
+                results.append(t)
+    return results.pop()
+
+
+def normalize(
+    term: Term,
+    threshold=1000,
+    max_workers: Optional[int] = None,
+    executor: Optional[Executor] = None,
+) -> Term:
+    """
+    `AST(term).eval()` with the subterms of at least `threshold` nodes
+    reduced in worker processes. A running `executor` can be passed to
+    reuse its processes, otherwise a pool of `max_workers` is started.
+    """
+    if isinstance(term, AST):
+        term = term.root
+    jobs = split(term, threshold)
+    if len(jobs) > 1:
+        if executor is None:
+            with ProcessPoolExecutor(max_workers) as pool:
+                done = list(pool.map(_eval_job, map(dumps, jobs)))
+        else:
+            done = list(executor.map(_eval_job, map(dumps, jobs)))
+        term = _reduce(term, {id(j): loads(d) for j, d in zip(jobs, done)})
+    return AST(term).eval()
+
+
+def _eval_one(term, kwargs: dict):
+    if not hasattr(term, "eval"):
+        term = AST(term)
+    return term.eval(**kwargs)
+
+
+def eval_all(
+    terms: Iterable,
+    max_workers: Optional[int] = None,
+    executor: Optional[Executor] = None,
+    **kwargs,
+) -> list:
+    """
+    `AST(term).eval(**kwargs)` of every term, in order, from a pool of
+    `max_workers` threads or from `executor`. ASTs of any language are
+    evaluated as they are, plain terms are lampy.lampy ones. The GIL
+    still runs one evaluation at a time, use `normalize` to spread the
+    work of a big term over processes. An `NFCache` has no lock, don't
+    pass the same one as `cache`.
+    """
+    terms = list(terms)
+    if executor is None:
+        with ThreadPoolExecutor(max_workers) as pool:
+            return list(pool.map(lambda t: _eval_one(t, kwargs), terms))
+    return list(executor.map(lambda t: _eval_one(t, kwargs), terms))
@@ -1,11 +1,28 @@
-from lark import Lark, Tree
+"""
+Parser of the lampy.lampy syntax
+
+A statement is a term ending in `;`, `name = term;` defines `name` for
+the statements after it. `parse` returns a `Module`, the list of the
+ASTs of the statements, that keeps the definitions, more source can be
+added to it with `Module.parse`.
+
+>>> module = parse("twice = (f, x) => f (f x); inc = (x) => x + 1;")
+>>> module.parse("twice inc 1;")[0].eval()
+3
+>>> module.parse("twice twice inc 0;")[0].eval()
+4
+"""
+from typing import Dict, List, Optional
+
+from lark import Lark
 from lark.visitors import Transformer as LarkTransformer
 
-from lampy.lampy import Var, Val, Appl, Lamb, BinOp, AST
+from lampy.lampy import Term, Var, Val, Appl, Lamb, BinOp, AST
 
 grammar = r"""
-    module: stmt+
+    module: (stmt | define)+
     stmt : term+ ";"
+    define : ID "=" term ";"
 
     ?term : lamb
     ?lamb : "(" args ") =>" term | bin_expr
@@ -22,7 +39,7 @@ grammar = r"""
         | ID -> var
         | SIGNED_NUMBER -> val
 
-    ID : /[a-z]/
+    ID : /[a-z][a-z0-9_]*/
     SIGNED_NUMBER: /(\+|-)?\d+(\.\d+)?/
     !?mulop : "*" | "/"
     !?plusop: "+" | "-"
@@ -40,20 +57,28 @@ lamb_parser = Lark(grammar, start="module", parser="lalr")
 class Transformer(LarkTransformer):
     def lamb(self, tree):
         args, body = tree
-        if not isinstance(args, Tree):
+        if not isinstance(args, list):
             # args is a single argument
             return Lamb(Var(args), body)
-        *args, lastarg = [t.value for t in args.children]
+        *args, lastarg = args
         lamb = Lamb(Var(lastarg), body)
         # fold lambdas
         for arg in reversed(args):
             lamb = Lamb(Var(arg), lamb)
         return lamb
 
+    def args(self, tree):
+        # the nested args are already a list
+        args, arg = tree
+        return [*(args if isinstance(args, list) else [args]), arg]
+
     def bin_expr(self, tree):
         a, op, b = tree
         return BinOp(op, a, b)
 
+    def numfactor(self, tree):
+        return self.bin_expr(tree)
+
     def appl(self, tree):
         e1, e2 = tree
         return Appl(e1, e2)
@@ -67,6 +92,62 @@ class Transformer(LarkTransformer):
     def stmt(self, tree):
         return AST(tree[0])
 
-
-def parse(input_):
-    return Transformer().transform(lamb_parser.parse(input_)).children
+    def define(self, tree):
+        name, term = tree
+        return (str(name), term)
+
+
+class Module(list):
+    """
+    The ASTs of the statements parsed so far, in order, and `env`, the
+    values of the definitions. A definition is evaluated once, with
+    `engine`, when it is parsed. The statements after it get its value
+    in place of the name, the same nodes and not a copy, terms are never
+    modified so they can share it.
+    """
+
+    def __init__(self, engine="subst"):
+        super().__init__()
+        self.engine = engine
+        self.env: Dict[str, Term] = {}
+
+    def resolve(self, term: Term) -> Term:
+        """
+        Put the values of the definitions for the free names of `term`,
+        all at once: a value that has a free name defined later keeps it
+
+        The names are first renamed to placeholders the parser can't
+        produce, then the placeholders are replaced by the values, so no
+        replacement sees a value put in by another one.
+        """
+        names = sorted(term.fv & self.env.keys())
+        for name in names:
+            term = term.replace(Var(name), Var(f"{name}'"))
+        for name in names:
+            term = term.replace(Var(f"{name}'"), self.env[name])
+        return term
+
+    def parse(self, input_) -> List[AST]:
+        "Parse more statements and definitions, returns the new statements"
+        stmts = []
+        for item in Transformer().transform(lamb_parser.parse(input_)).children:
+            if isinstance(item, tuple):
+                name, term = item
+                self.env[name] = AST(self.resolve(term)).eval(engine=self.engine)
+            else:
+                stmts.append(AST(self.resolve(item.root)))
+        self.extend(stmts)
+        return stmts
+
+
+def parse(input_, module: Optional[Module] = None) -> Module:
+    """
+    Parse `input_` in a new module, or add it to `module`
+
+    >>> parse("k = (a, b) => a; k 1 2;")[0].eval()
+    1
+    """
+    if module is None:
+        module = Module()
+    module.parse(input_)
+    return module
@@ -0,0 +1,152 @@
+"""
+Time-sliced evaluation of lampy.lampy terms
+
+An `Evaluation` is `AST.eval` (subst engine, applicative order) that can
+be stopped after some number of reduction steps and resumed later. The
+suspended state is the eval_term frame stack, and terms aren't modified
+during evaluation, so `snapshot()` is a cheap copy that can be resumed
+on its own or pickled.
+
+>>> from lampy.parser import parse
+>>> ev = Evaluation(parse("((f, x) => f (f x)) ((y) => y + 1) 0;")[0])
+>>> ev.run(2)
+False
+>>> snap = ev.snapshot()
+>>> ev.run(100), ev.result
+(True, 2)
+>>> snap.run(100), snap.result
+(True, 2)
+
+`Scheduler` runs many evaluations round robin, one slice each per tick,
+and `eval_async` is the asyncio version, it yields to the loop after
+every slice.
+"""
+import asyncio
+from collections import deque
+from copy import copy
+from typing import Deque, Iterator, List, Optional
+
+from lampy.lampy import Term, AST, _eval_loop
+from lampy.utils import EvalStats
+
+
+class Evaluation:
+    def __init__(self, term, stats: Optional[EvalStats] = None, church=False):
+        if isinstance(term, AST):
+            term = term.root
+        # start of the current eval_term pass, to detect a fixed point
+        self.prev: Term = term
+        self.term: Term = term
+        self.stack: list = []
+        self.i = 0
+        self.stats = stats
+        self.church = church
+        self.steps = 0
+        self.result: Optional[Term] = None
+
+    @property
+    def done(self) -> bool:
+        return self.result is not None
+
+    def run(self, steps: int) -> bool:
+        """
+        Make at most about `steps` more steps, a few more BinOps can be
+        computed before the machine reaches a point it can stop at.
+        Returns True once the evaluation is complete.
+        """
+        if steps < 1:
+            raise ValueError("steps must be positive")
+        accelerate = None
+        if self.church:
+            from lampy.church import accelerate
+        budget = steps
+        while self.result is None:
+            term, i, complete, n = _eval_loop(
+                self.term, self.stack, self.i, None, self.stats, accelerate, budget
+            )
+            self.steps += n
+            budget -= n
+            if not complete:
+                self.term, self.i = term, i
+                return False
+            # an eval_term pass is complete, same test as AST.eval
+            if term.is_norm or term is self.prev:
+                self.result = term
+            else:
+                self.prev = self.term = term
+                self.i = 0
+                if budget <= 0:
+                    return False
+        return True
+
+    def slices(self, steps: int) -> Iterator["Evaluation"]:
+        "Generator form, yields after every slice of `steps` steps"
+        while not self.run(steps):
+            yield self
+
+    def snapshot(self) -> "Evaluation":
+        "An independent copy of the suspended state"
+        res = copy(self)
+        res.stack = list(self.stack)
+        if self.stats is not None:
+            res.stats = copy(self.stats)
+            res.stats.time = dict(self.stats.time)
+        return res
+
+    def __repr__(self):
+        state = f"result={self.result}" if self.done else f"depth={len(self.stack)}"
+        return f"<Evaluation steps={self.steps} {state}>"
+
+
+class Scheduler:
+    """
+    Round robin over evaluations, every tick gives each pending
+    evaluation one slice of `steps` steps
+
+    >>> from lampy.parser import parse
+    >>> s = Scheduler(steps=10)
+    >>> a = s.submit(parse("((x) => x + 1) 1;")[0])
+    >>> b = s.submit(parse("((x) => x x) ((y) => y);")[0])
+    >>> s.run()
+    [2, (λy.y)]
+    """
+
+    def __init__(self, steps=100):
+        self.steps = steps
+        self.evaluations: List[Evaluation] = []
+        self.pending: Deque[Evaluation] = deque()
+
+    def submit(self, term, stats: Optional[EvalStats] = None, church=False) -> Evaluation:
+        ev = Evaluation(term, stats, church)
+        self.evaluations.append(ev)
+        self.pending.append(ev)
+        return ev
+
+    def tick(self) -> int:
+        "One slice for every pending evaluation, returns how many are left"
+        for _ in range(len(self.pending)):
+            ev = self.pending.popleft()
+            if not ev.run(self.steps):
+                self.pending.append(ev)
+        return len(self.pending)
+
+    def run(self) -> List[Term]:
+        "Run until every evaluation is complete, the results in submit order"
+        while self.tick():
+            pass
+        return [ev.result for ev in self.evaluations]
+
+
+async def eval_async(term, steps=100, stats: Optional[EvalStats] = None, church=False) -> Term:
+    """
+    Evaluate in slices of `steps` steps, giving control back to the event
+    loop in between
+
+    >>> from lampy.parser import parse
+    >>> asyncio.run(eval_async(parse("((x) => x + 1) 1;")[0]))
+    2
+    """
+    ev = Evaluation(term, stats, church)
+    while not ev.run(steps):
+        await asyncio.sleep(0)
+    return ev.result
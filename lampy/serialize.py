@@ -0,0 +1,456 @@
+"""
+Binary format for lampy.lampy, lampy.tlampy and lampy.hmlamb terms
+
+pickle follows the Python objects recursively, it's slow on big terms
+and fails with a RecursionError on deep ones. `dumps` writes a compact,
+versioned encoding instead, without recursion:
+
+    header    b"LMPY", the format version, the language
+    symbols   names and operators, each written once
+    consts    the values of the Val nodes, each written once
+    types     the type annotations, each written once, children first
+    nodes     the node tags in prefix order, each followed by its fields
+
+Counts, lengths and indices in the tables are unsigned LEB128 varints,
+integer constants are zigzag encoded, so small terms take a few bytes a
+node.
+
+>>> from lampy.lampy import Var, Val, Lamb, BinOp
+>>> data = dumps(Lamb(Var("x"), BinOp("+", Var("x"), Val("1"))))
+>>> len(data)
+24
+>>> loads(data)
+(λx.x + 1)
+
+`loads` reads any buffer, a `memoryview` or an `mmap` are read in place,
+that's what `load` does with a file.
+"""
+import builtins
+import gc
+import importlib
+import mmap
+import struct
+from typing import Dict, List, Tuple
+
+from lampy import lampy, tlampy
+
+MAGIC = b"LMPY"
+VERSION = 1
+
+# languages
+LAMPY = 0
+TLAMPY = 1
+HMLAMB = 2
+_MODULES = {LAMPY: "lampy.lampy", TLAMPY: "lampy.tlampy", HMLAMB: "lampy.hmlamb"}
+
+# node tags
+VAR = 0  # symbol
+VAL = 1  # const
+LAMB = 2  # symbol of the variable, then the body
+APPL = 3  # the function then the argument
+BINOP = 4  # symbol of the operator, then the operands
+LET = 5  # symbol of the variable, then the bound term and the body
+_ARITY = (0, 0, 1, 2, 2, 2)
+
+# type annotations after the other fields, by language and node tag, an
+# index in the types table plus one, 0 for no annotation
+_TYPE_SLOTS = {
+    LAMPY: (0, 0, 0, 0, 0, 0),
+    # the types of variables and values, the rest is computed
+    TLAMPY: (1, 1, 1, 0, 0, 0),
+    # the type of the node, a lambda has its variable's first
+    HMLAMB: (1, 0, 2, 1, 0, 1),
+}
+
+# type tags
+T_BUILTIN = 0  # symbol of a builtin, like int
+T_UNK = 1
+T_VAR = 2  # symbol
+T_ARROW = 3  # two type indices
+T_MONO = 4  # symbol
+T_POLY = 5  # symbol
+T_HMARROW = 6  # two type indices
+
+# const tags
+C_INT = 0
+C_STR = 1
+C_FLOAT = 2
+
+_DOUBLE = struct.Struct("<d")
+
+
+def _varint(out: bytearray, n: int):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _read_varint(buf, pos: int) -> Tuple[int, int]:
+    b = buf[pos]
+    if b < 0x80:
+        return b, pos + 1
+    n = b & 0x7F
+    shift = 7
+    pos += 1
+    while True:
+        b = buf[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def _language(term) -> int:
+    # by isinstance like `_Writer.node`, subclasses such as the Church
+    # numerals of lampy.church are terms of their base language
+    if isinstance(term, tlampy.Term):
+        return TLAMPY
+    elif isinstance(term, lampy.Term):
+        return LAMPY
+    elif type(term).__module__ == _MODULES[HMLAMB]:
+        return HMLAMB
+    raise TypeError(f"Can't serialize {term!r}")
+
+
+class _Writer:
+    def __init__(self, lang: int):
+        self.lang = lang
+        self.symbols: Dict[str, int] = {}
+        self.consts: Dict[tuple, int] = {}
+        self.types: Dict[tuple, int] = {}
+        self.type_data = bytearray()
+        self.nodes = bytearray()
+        self.count = 0
+
+    def symbol(self, name: str):
+        _varint(self.nodes, self._symbol_id(name))
+
+    def const(self, val):
+        # by type too, 1 and 1.0 are different consts
+        key = (type(val), val)
+        i = self.consts.get(key)
+        if i is None:
+            i = self.consts[key] = len(self.consts)
+        _varint(self.nodes, i)
+
+    def _type(self, typ) -> int:
+        "Index of a type in the table plus one, types are small and nested shallowly"
+        if typ is None:
+            return 0
+        if self.lang == TLAMPY:
+            if isinstance(typ, tlampy.TypeArrow):
+                data: tuple = (T_ARROW, self._type(typ.t1), self._type(typ.t2))
+            elif isinstance(typ, tlampy.TypeUnk):
+                data = (T_UNK,)
+            elif isinstance(typ, tlampy.TypeVar):
+                data = (T_VAR, self._symbol_id(typ.typevar))
+            else:
+                data = (T_BUILTIN, self._symbol_id(typ.__name__))
+        else:
+            name = type(typ).__name__
+            if name == "TArrow":
+                data = (T_HMARROW, self._type(typ.t1), self._type(typ.t2))
+            elif name == "TMono":
+                data = (T_MONO, self._symbol_id(typ.val))
+            else:
+                data = (T_POLY, self._symbol_id(typ.name))
+        i = self.types.get(data)
+        if i is None:
+            i = self.types[data] = len(self.types)
+            self.type_data.append(data[0])
+            for field in data[1:]:
+                _varint(self.type_data, field)
+        return i + 1
+
+    def _symbol_id(self, name: str) -> int:
+        i = self.symbols.get(name)
+        if i is None:
+            i = self.symbols[name] = len(self.symbols)
+        return i
+
+    def type(self, typ):
+        _varint(self.nodes, self._type(typ))
+
+    def node(self, t) -> tuple:
+        "Write the tag and the fields of a node, returns its children"
+        nodes = self.nodes
+        self.count += 1
+        if self.lang == HMLAMB:
+            name = type(t).__name__
+            if name == "LVar":
+                nodes.append(VAR)
+                self.symbol(t.name)
+                self.type(t.typ)
+                return ()
+            elif name == "LLamb":
+                nodes.append(LAMB)
+                self.symbol(t.var.name)
+                self.type(t.var.typ)
+                self.type(t.typ)
+                return (t.body,)
+            elif name == "LAppl":
+                nodes.append(APPL)
+                self.type(t.typ)
+                return (t.e1, t.e2)
+            elif name == "LLet":
+                nodes.append(LET)
+                self.symbol(t.var)
+                self.type(t.typ)
+                return (t.e1, t.e2)
+            raise TypeError(f"Can't serialize {t!r}")
+
+        lang = tlampy if self.lang == TLAMPY else lampy
+        typed = self.lang == TLAMPY
+        if isinstance(t, lang.Var):
+            nodes.append(VAR)
+            self.symbol(t.name)
+            if typed:
+                self.type(t.typ)
+            return ()
+        elif isinstance(t, lang.Val):
+            nodes.append(VAL)
+            self.const(t.val)
+            if typed:
+                self.type(t.typ)
+            return ()
+        elif isinstance(t, lang.Lamb):
+            nodes.append(LAMB)
+            self.symbol(t.var.name)
+            if typed:
+                self.type(t.var.typ)
+            return (t.body,)
+        elif isinstance(t, lang.Appl):
+            nodes.append(APPL)
+            return (t.e1, t.e2)
+        elif isinstance(t, lang.BinOp):
+            nodes.append(BINOP)
+            self.symbol(t.op)
+            return (t.a, t.b)
+        raise TypeError(f"Can't serialize {t!r}")
+
+    def getvalue(self) -> bytes:
+        out = bytearray(MAGIC)
+        out.append(VERSION)
+        out.append(self.lang)
+        _varint(out, len(self.symbols))
+        for name in self.symbols:
+            data = name.encode()
+            _varint(out, len(data))
+            out += data
+        _varint(out, len(self.consts))
+        for typ, val in self.consts:
+            if typ is int:
+                out.append(C_INT)
+                _varint(out, val * 2 if val >= 0 else -val * 2 - 1)
+            elif typ is str:
+                data = val.encode()
+                out.append(C_STR)
+                _varint(out, len(data))
+                out += data
+            elif typ is float:
+                out.append(C_FLOAT)
+                out += _DOUBLE.pack(val)
+            else:
+                raise TypeError(f"Can't serialize the value {val!r}")
+        _varint(out, len(self.types))
+        out += self.type_data
+        _varint(out, self.count)
+        out += self.nodes
+        return bytes(out)
+
+
+def dumps(term) -> bytes:
+    "Encode a term, or the root of an AST, iteratively"
+    if isinstance(term, (lampy.AST, tlampy.AST)):
+        term = term.root
+    w = _Writer(_language(term))
+    stack = [term]
+    while stack:
+        kids = w.node(stack.pop())
+        stack.extend(reversed(kids))
+    return w.getvalue()
+
+
+def _read_types(buf, pos: int, lang: int, symbols: List[str]):
+    n, pos = _read_varint(buf, pos)
+    types: list = [None]
+    if lang == HMLAMB:
+        hm = importlib.import_module("lampy.hmlamb")
+    for _ in range(n):
+        tag = buf[pos]
+        pos += 1
+        if tag in (T_ARROW, T_HMARROW):
+            t1, pos = _read_varint(buf, pos)
+            t2, pos = _read_varint(buf, pos)
+            if tag == T_ARROW:
+                types.append(tlampy.TypeArrow(types[t1], types[t2]))
+            else:
+                types.append(hm.TArrow(types[t1], types[t2]))
+        elif tag == T_UNK:
+            types.append(tlampy.TypeUnk())
+        else:
+            i, pos = _read_varint(buf, pos)
+            if tag == T_BUILTIN:
+                types.append(getattr(builtins, symbols[i]))
+            elif tag == T_VAR:
+                types.append(tlampy.TypeVar(symbols[i]))
+            elif tag == T_MONO:
+                types.append(hm.TMono(symbols[i]))
+            elif tag == T_POLY:
+                types.append(hm.TPoly(symbols[i]))
+            else:
+                raise ValueError(f"Bad type tag {tag}")
+    return types, pos
+
+
+def _builder(lang: int, symbols: List[str], consts: list, types: list):
+    "The function that builds a node from its tag, fields and children"
+    if lang == HMLAMB:
+        hm = importlib.import_module("lampy.hmlamb")
+
+        def build(tag, fields, kids):
+            if tag == VAR:
+                return hm.LVar(symbols[fields[0]], types[fields[1]])
+            elif tag == LAMB:
+                var = hm.LVar(symbols[fields[0]], types[fields[1]])
+                return hm.LLamb(var, kids[0], types[fields[2]])
+            elif tag == APPL:
+                res = hm.LAppl(*kids)
+                res.typ = types[fields[0]]
+                return res
+            return hm.LLet(symbols[fields[0]], kids[0], kids[1], types[fields[1]])
+
+    elif lang == TLAMPY:
+
+        def build(tag, fields, kids):
+            if tag == VAR:
+                return tlampy.Var(symbols[fields[0]], types[fields[1]])
+            elif tag == VAL:
+                return tlampy.Val(consts[fields[0]], types[fields[1]])
+            elif tag == LAMB:
+                return tlampy.Lamb(tlampy.Var(symbols[fields[0]], types[fields[1]]), kids[0])
+            elif tag == APPL:
+                return tlampy.Appl(*kids)
+            return tlampy.BinOp(symbols[fields[0]], *kids)
+
+    else:
+
+        def build(tag, fields, kids):
+            if tag == VAR:
+                return lampy.Var(symbols[fields[0]])
+            elif tag == VAL:
+                return lampy.Val(consts[fields[0]])
+            elif tag == LAMB:
+                return lampy.Lamb(lampy.Var(symbols[fields[0]]), kids[0])
+            elif tag == APPL:
+                return lampy.Appl(*kids)
+            return lampy.BinOp(symbols[fields[0]], *kids)
+
+    return build
+
+
+def loads(data):
+    """
+    Decode a term from bytes or any buffer, iteratively. Nodes are built
+    as their last child is read, so a node is built after its children.
+    """
+    # the collector would walk the growing term over and over, the nodes
+    # are all reachable anyway
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        if isinstance(data, bytes):
+            return _loads(data)
+        with memoryview(data) as buf:
+            return _loads(buf.cast("B"))
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _loads(buf):
+    if bytes(buf[:4]) != MAGIC:
+        raise ValueError("Not a lampy term")
+    if buf[4] != VERSION:
+        raise ValueError(f"Unsupported format version {buf[4]}")
+    lang = buf[5]
+    if lang not in _MODULES:
+        raise ValueError(f"Unknown language {lang}")
+    pos = 6
+
+    n, pos = _read_varint(buf, pos)
+    symbols = []
+    for _ in range(n):
+        size, pos = _read_varint(buf, pos)
+        symbols.append(str(buf[pos : pos + size], "utf-8"))
+        pos += size
+
+    n, pos = _read_varint(buf, pos)
+    consts: list = []
+    for _ in range(n):
+        tag = buf[pos]
+        pos += 1
+        if tag == C_INT:
+            z, pos = _read_varint(buf, pos)
+            consts.append(z >> 1 if not z & 1 else -((z + 1) >> 1))
+        elif tag == C_STR:
+            size, pos = _read_varint(buf, pos)
+            consts.append(str(buf[pos : pos + size], "utf-8"))
+            pos += size
+        elif tag == C_FLOAT:
+            consts.append(_DOUBLE.unpack_from(buf, pos)[0])
+            pos += _DOUBLE.size
+        else:
+            raise ValueError(f"Bad const tag {tag}")
+
+    types, pos = _read_types(buf, pos, lang, symbols)
+    build = _builder(lang, symbols, consts, types)
+    slots = _TYPE_SLOTS[lang]
+
+    count, pos = _read_varint(buf, pos)
+    # the nodes waiting for children: tag, fields, children
+    stack: List[Tuple[int, list, list]] = []
+    res = None
+    for _ in range(count):
+        tag = buf[pos]
+        pos += 1
+        nfields = slots[tag] + (tag != APPL)
+        fields = []
+        for _ in range(nfields):
+            b = buf[pos]
+            if b < 0x80:
+                fields.append(b)
+                pos += 1
+            else:
+                i, pos = _read_varint(buf, pos)
+                fields.append(i)
+        if _ARITY[tag]:
+            stack.append((tag, fields, []))
+            continue
+        node = build(tag, fields, ())
+        while stack:
+            tag, fields, kids = stack[-1]
+            kids.append(node)
+            if len(kids) < _ARITY[tag]:
+                break
+            stack.pop()
+            node = build(tag, fields, kids)
+        else:
+            res = node
+    if res is None or stack:
+        raise ValueError("Truncated term")
+    return res
+
+
+def dump(term, path: str):
+    with open(path, "wb") as f:
+        f.write(dumps(term))
+
+
+def load(path: str):
+    "Decode a file written by `dump`, mapped in memory instead of read"
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return loads(data)
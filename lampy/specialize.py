@@ -0,0 +1,177 @@
+"""
+Specialize lampy.lampy terms on their static arguments
+
+A generic function is often applied to the same few known arguments, a
+setting or an operator to use, and then to data that changes. `specialize`
+applies the function to the static arguments and partially evaluates
+the result: the beta redexes whose argument is a value are reduced, under
+lambdas too, and BinOps over two values are computed. What's left, the
+residual, takes the remaining arguments and does only the dynamic work.
+
+>>> from lampy.parser import parse
+>>> arith = parse("(s, x, y) => s ((a, b) => a + b) ((a, b) => a * b) x y;")[0].root
+>>> true = parse("(t, f) => t;")[0].root
+>>> specialize(arith, [true])
+(λx.(λy.x + y))
+>>> specialize(arith, {"s": true, "y": 2})
+(λx.x + 2)
+
+Only call by value steps are made, so the residual gives the same result
+as the original term. Arguments that aren't values are kept as they are,
+and `fuel` bounds the number of steps for terms that unfold forever, the
+rest is left in the residual.
+
+With a `lampy.nfcache.NFCache`, residuals are kept and reused when the
+same term is specialized on the same arguments, up to alpha conversion.
+"""
+from typing import Iterable, List, Mapping, Optional, Union
+
+from lampy.lampy import Term, Var, Val, Lamb, Appl, BinOp, AST, appl, _next_var
+from lampy.utils import EvalStats
+
+Static = Union[Iterable, Mapping[str, object]]
+
+# tasks
+_EVAL = 0  # reduce a term, push the result
+_LAMB = 1  # rebuild a lambda from the last result
+_APPL = 2  # apply the last two results
+_BINOP = 3  # combine the last two results
+
+
+def _is_value(t: Term) -> bool:
+    return isinstance(t, (Var, Val, Lamb))
+
+
+def peval(term: Term, fuel=1000, stats: Optional[EvalStats] = None) -> Term:
+    """
+    Reduce the value redexes and the BinOps over values everywhere in the
+    term, at most `fuel` of them, iteratively
+
+    >>> peval(Lamb(Var("x"), Appl(Lamb(Var("y"), BinOp("+", Var("y"), Val("1"))), Val("2"))))
+    (λx.3)
+    >>> peval(Appl(Lamb(Var("y"), Var("y")), Appl(Var("f"), Val("1"))))
+    (λy.y) (f 1)
+    """
+    steps = 0
+    results: List[Term] = []
+    tasks: list = [(_EVAL, term)]
+    while tasks:
+        task, t = tasks.pop()
+        if task == _EVAL:
+            if isinstance(t, Lamb):
+                tasks.append((_LAMB, t))
+                tasks.append((_EVAL, t.body))
+            elif isinstance(t, Appl):
+                tasks.append((_APPL, t))
+                tasks.append((_EVAL, t.e2))
+                tasks.append((_EVAL, t.e1))
+            elif isinstance(t, BinOp):
+                tasks.append((_BINOP, t))
+                tasks.append((_EVAL, t.b))
+                tasks.append((_EVAL, t.a))
+            else:
+                results.append(t)
+        elif task == _LAMB:
+            body = results.pop()
+            results.append(t if body is t.body else Lamb(t.var, body))
+        elif task == _APPL:
+            b = results.pop()
+            a = results.pop()
+            if isinstance(a, Lamb) and _is_value(b) and steps < fuel:
+                steps += 1
+                if stats is not None:
+                    stats.beta += 1
+                # the body was reduced already, this only finds the
+                # redexes the argument made
+                tasks.append((_EVAL, appl(a, b, stats=stats)))
+            else:
+                results.append(t if a is t.e1 and b is t.e2 else Appl(a, b))
+        else:
+            b = results.pop()
+            a = results.pop()
+            if isinstance(a, Val) and isinstance(b, Val) and steps < fuel:
+                try:
+                    res: Term = Val(t.opfun(a.val, b.val))
+                except ZeroDivisionError:
+                    # left for the evaluator to report, if it's ever reached
+                    res = BinOp(t.op, a, b)
+                else:
+                    steps += 1
+                    if stats is not None:
+                        stats.binops += 1
+                results.append(res)
+            else:
+                results.append(t if a is t.a and b is t.b else BinOp(t.op, a, b))
+    return results.pop()
+
+
+def _term(arg) -> Term:
+    if isinstance(arg, AST):
+        return arg.root
+    elif isinstance(arg, Term):
+        return arg
+    return Val(arg)
+
+
+def apply_static(term: Term, static: Static) -> Term:
+    """
+    `term` applied to the static arguments, in order for a sequence, by
+    name of the leading parameters for a mapping. The other parameters
+    stay parameters of the result.
+
+    >>> apply_static(Lamb(Var("x"), Lamb(Var("y"), BinOp("-", Var("x"), Var("y")))), {"y": 1})
+    (λx.(λx.(λy.x - y)) x 1)
+    """
+    if not isinstance(static, Mapping):
+        for arg in static:
+            term = Appl(term, _term(arg))
+        return term
+
+    params = []
+    t = term
+    names = set(static)
+    while names.difference(p.name for p in params) and isinstance(t, Lamb):
+        params.append(t.var)
+        t = t.body
+    missing = names.difference(p.name for p in params)
+    if missing:
+        raise ValueError(f"{', '.join(sorted(missing))} aren't leading parameters of {term}")
+
+    # the kept parameters are renamed if a static argument would capture them
+    args = {name: _term(arg) for name, arg in static.items()}
+    taken = set().union(*(a.fv for a in args.values()))
+    kept = []
+    res = term
+    for p in params:
+        if p.name in args:
+            res = Appl(res, args.pop(p.name))
+        else:
+            var = _next_var(p, taken) if p.name in taken else Var(p.name)
+            taken.add(var.name)
+            kept.append(var)
+            res = Appl(res, var)
+    for var in reversed(kept):
+        res = Lamb(var, res)
+    return res
+
+
+def specialize(
+    term, static: Static, fuel=1000, cache=None, stats: Optional[EvalStats] = None
+) -> Term:
+    """
+    The residual of `term` applied to the `static` arguments, see
+    `apply_static`. Residuals are looked up and stored in `cache`, a
+    `lampy.nfcache.NFCache`.
+    """
+    if isinstance(term, AST):
+        term = term.root
+    term = apply_static(term, static)
+    if cache is None:
+        return peval(term, fuel, stats)
+    # the fuel changes the residual
+    key = cache.key(term, f"specialize:{fuel}")
+    res = cache.get(key)
+    if res is None:
+        res = peval(term, fuel, stats)
+        cache.put(key, res)
+    return res
@@ -0,0 +1,140 @@
+"""
+Reduction strategies for lampy.lampy and lampy.tlampy terms
+
+`eval_term` is applicative order: arguments are evaluated before the
+call, so (λx.1) Ω never terminates and (λx.1) <expensive> does the work
+for nothing. The strategies here reduce the leftmost outermost redex
+first, arguments are substituted unevaluated:
+
+- normal: full normal form, under lambdas and in the arguments of
+  variables too
+- head: head normal form, λx1..xn.v e1..em with the ei left as they are
+- whnf: weak head normal form, stops at the first lambda
+
+"applicative" is `eval_term`, it's handled by `AST.eval` itself.
+
+>>> omega = Appl(Lamb(Var("x"), Appl(Var("x"), Var("x"))), Lamb(Var("x"), Appl(Var("x"), Var("x"))))
+>>> AST(Appl(Lamb(Var("y"), Val("1")), omega)).eval(strategy="normal")
+1
+>>> t = Lamb(Var("x"), Appl(Lamb(Var("y"), Var("y")), Var("x")))
+>>> AST(t).eval(strategy="normal"), AST(t).eval(strategy="whnf")
+((λx.x), (λx.(λy.y) x))
+
+The number of steps made by each strategy is in the EvalStats
+
+>>> _, stats = AST(Appl(Lamb(Var("y"), Val("1")), omega)).eval(strategy="normal", stats=True)
+>>> stats.steps
+1
+"""
+from typing import Optional
+
+from lampy import lampy, tlampy
+from lampy.lampy import Var, Val, Lamb, Appl, AST
+from lampy.utils import EvalStats, OutOfFuel
+
+STRATEGIES = ("applicative", "normal", "head", "whnf")
+
+# tasks
+_EVAL = 0  # reduce a term applied to a spine of arguments, push the result
+_LAMB = 1  # rebuild a lambda from the last result
+_SPINE = 2  # apply a head to the last n results
+_BINOP = 3  # combine the last two results, then apply the spine
+
+
+def _apply(lang, head, args):
+    "`args` is a spine, the first argument last"
+    for arg in reversed(args):
+        head = lang.Appl(head, arg)
+    return head
+
+
+def _val(lang, res):
+    if lang is tlampy:
+        return lang.Val(res, type(res))
+    return lang.Val(res)
+
+
+def _run(lang, strategy: str, tasks: list, results: list, stats, frozen=False):
+    """
+    Run the tasks, with `frozen` nothing is reduced, the tasks only put
+    the term back together. That's how the partially reduced term is
+    built when the fuel runs out.
+    """
+    under_lambdas = strategy in ("normal", "head")
+    in_args = strategy == "normal"
+    while tasks:
+        task, t, args = tasks.pop()
+        if task == _EVAL:
+            while True:
+                if frozen:
+                    results.append(_apply(lang, t, args))
+                elif isinstance(t, lang.Appl):
+                    args.append(t.e2)
+                    t = t.e1
+                    continue
+                elif isinstance(t, lang.Lamb) and args:
+                    if stats is not None:
+                        if stats.out_of_fuel():
+                            tasks.append((_EVAL, t, args))
+                            _run(lang, strategy, tasks, results, None, frozen=True)
+                            raise OutOfFuel(results.pop(), stats)
+                        stats.beta += 1
+                    t = lang.appl(t, args.pop(), stats=stats)
+                    continue
+                elif isinstance(t, lang.Lamb) and under_lambdas:
+                    tasks.append((_LAMB, t, None))
+                    tasks.append((_EVAL, t.body, []))
+                elif isinstance(t, lang.BinOp):
+                    tasks.append((_BINOP, t, args))
+                    tasks.append((_EVAL, t.b, []))
+                    tasks.append((_EVAL, t.a, []))
+                elif args and in_args:
+                    tasks.append((_SPINE, t, len(args)))
+                    tasks.extend((_EVAL, arg, []) for arg in args)
+                else:
+                    results.append(_apply(lang, t, args))
+                break
+        elif task == _LAMB:
+            body = results.pop()
+            results.append(t if body is t.body else lang.Lamb(t.var, body))
+        elif task == _SPINE:
+            # the results are in order, the first argument first
+            done = results[len(results) - args :]
+            del results[len(results) - args :]
+            results.append(_apply(lang, t, done[::-1]))
+        else:
+            b = results.pop()
+            a = results.pop()
+            if not frozen and isinstance(a, lang.Val) and isinstance(b, lang.Val):
+                if stats is not None:
+                    if stats.out_of_fuel():
+                        results.append(_apply(lang, lang.BinOp(t.op, a, b), args))
+                        _run(lang, strategy, tasks, results, None, frozen=True)
+                        raise OutOfFuel(results.pop(), stats)
+                    stats.binops += 1
+                head = _val(lang, t.opfun(a.val, b.val))
+            elif a is t.a and b is t.b:
+                head = t
+            else:
+                head = lang.BinOp(t.op, a, b)
+            # a value or a stuck BinOp can't be applied, the spine is
+            # handled like the arguments of a variable
+            if args and in_args and not frozen:
+                tasks.append((_SPINE, head, len(args)))
+                tasks.extend((_EVAL, arg, []) for arg in args)
+            else:
+                results.append(_apply(lang, head, args))
+    return results
+
+
+def reduce(term, strategy: str, lang=lampy, stats: Optional[EvalStats] = None):
+    """
+    Reduce `term`, a lampy.lampy or lampy.tlampy term, with one of the
+    leftmost outermost strategies, iteratively
+
+    >>> reduce(Appl(Lamb(Var("x"), Lamb(Var("y"), Appl(Var("x"), Var("y")))), Var("f")), "head")
+    (λy.f y)
+    """
+    if strategy not in STRATEGIES[1:]:
+        raise ValueError(f"Unknown strategy {strategy}")
+    return _run(lang, strategy, [(_EVAL, term, [])], [], stats).pop()
@@ -4,6 +4,7 @@ from abc import ABC, abstractmethod
 from typing import (
     Dict,
     Any,
+    FrozenSet,
     NamedTuple,
     Optional,
     Callable,
@@ -16,45 +17,56 @@ from typing import (
     Union,
 )
 import operator as op
+from copy import copy
 from collections import namedtuple
 from functools import reduce
 
-from lampy.utils import trace
+from lampy.utils import trace, Tracer, StderrTracer, EvalStats, OutOfFuel, Diverges, phase, fresh_name
 
 
-_bound_vars = set()
-
-
-def _next_var(v: "Var") -> "Var":
+def _next_var(v: "Var", avoid: Iterable[str] = ()) -> "Var":
     """
-    Return the next letter
+    Return the next letter that is not in `avoid`, or the name with a
+    number appended when all the letters are taken
 
     >>> _next_var(Var("u", int))
     v:int
 
     >>> _next_var(Var("z", int))
     u:int
-    """
-    global _bound_vars
-    first = ord("u")
-    last = ord("z")
-    index = ord(v.name)
-    while True:
-        next_ = ord(v.name) + 1
-        if next_ > last:
-            next_ = first
-        found = Var(chr(next_), v.typ)
-        if found not in _bound_vars:
-            return Var(chr(next_), v.typ)
 
+    >>> _next_var(Var("x", int), set("uvwxyz"))
+    x1:int
+    """
+    letters = "uvwxyz"
+    start = letters.index(v.name) + 1 if v.name in letters else 0
+    # never v itself, the letters after it come first
+    return Var(fresh_name(v.name, set(avoid) | {v.name}, letters[start:] + letters[:start]), v.typ)
 
-def _reset_bound_vars():
-    global _bound_vars
-    _bound_vars = set()
 
+def _free_names(term: "Term") -> FrozenSet[str]:
+    """
+    Names of the free variables of `term`, without recursion
 
-def _bind(var: "Var"):
-    _bound_vars.add(var.name)
+    >>> sorted(_free_names(Lamb(Var("x", int), BinOp("+", Var("x", int), Var("y", int)))))
+    ['y']
+    """
+    names = set()
+    stack: list = [(term, frozenset())]
+    while stack:
+        t, bound = stack.pop()
+        if isinstance(t, Var):
+            if t.name not in bound:
+                names.add(t.name)
+        elif isinstance(t, Lamb):
+            stack.append((t.body, bound | {t.var.name}))
+        elif isinstance(t, Appl):
+            stack.append((t.e2, bound))
+            stack.append((t.e1, bound))
+        elif isinstance(t, BinOp):
+            stack.append((t.b, bound))
+            stack.append((t.a, bound))
+    return frozenset(names)
 
 
 class Type(ABC):
@@ -143,15 +155,42 @@ class Term(ABC):
         >>> Appl(Lamb(Var("x", int), Var("x", int)), Val("1", int)).is_norm
         False
         """
-        if isinstance(self, Appl):
-            if isinstance(self.e1, Lamb):
+        stack = [self]
+        while stack:
+            t = stack.pop()
+            if isinstance(t, Appl):
+                if isinstance(t.e1, Lamb):
+                    return False
+                stack.append(t.e2)
+                stack.append(t.e1)
+            elif isinstance(t, BinOp):
                 return False
-            else:
-                return self.e1.is_norm and self.e2.is_norm
-        elif isinstance(self, BinOp):
-            return False
         return True
 
+    @property
+    def size(self) -> int:
+        """
+        Number of nodes, binders included
+
+        >>> Lamb(Var("x", int), Appl(Var("x", int), Var("x", int))).size
+        5
+        """
+        n = 0
+        stack = [self]
+        while stack:
+            t = stack.pop()
+            n += 1
+            if isinstance(t, Lamb):
+                stack.append(t.var)
+                stack.append(t.body)
+            elif isinstance(t, Appl):
+                stack.append(t.e1)
+                stack.append(t.e2)
+            elif isinstance(t, BinOp):
+                stack.append(t.a)
+                stack.append(t.b)
+        return n
+
     @abstractmethod
     def bind(self, var, to) -> "Term":
         "Bind a variable var to `to` if in self. Return self, unmodified if no bind should occurr"
@@ -190,12 +229,10 @@ class BinOp(Term):
         return self.__class__.opmap[self.op]
 
     def replace(self, old, new):
-        self.a = self.a.replace(old, new)
-        self.b = self.b.replace(old, new)
-        return self
+        return _replace(self, old, new)
 
     def __repr__(self):
-        return f"{self.a} {self.op} {self.b}"
+        return _show(self)
 
     def bind(self, var, to):
         self.a = self.a.bind(var, to)
@@ -254,19 +291,12 @@ class Lamb(Term):
         self.body = body
         self.body = self.body.bind(var, self)
         self.typ = TypeArrow(var.typ, body.typ)
-        _bind(self.var)
 
     def replace(self, old: Var, new: Term) -> "Term":
-        if isinstance(new, Var) and new.name == self.var.name:
-            # alpha conversion
-            old_var = self.var
-            self.var = _next_var(self.var)
-            self.body = self.body.replace(old_var, self.var)
-        self.body = self.body.replace(old, new)
-        return self
+        return _replace(self, old, new)
 
     def __repr__(self):
-        return f"(λ{self.var}.{self.body})"
+        return _show(self)
 
     def typecheck(self) -> None:
         self.body.typecheck()
@@ -290,14 +320,10 @@ class Appl(Term):
             self.typ = e2.typ
 
     def replace(self, old, new):
-        self.e1 = self.e1.replace(old, new)
-        self.e2 = self.e2.replace(old, new)
-        return self
+        return _replace(self, old, new)
 
     def __repr__(self):
-        if isinstance(self.e2, Appl):
-            return f"{self.e1} ({self.e2})"
-        return f"{self.e1} {self.e2}"
+        return _show(self)
 
     def typecheck(self) -> None:
         self.e1.typecheck()
@@ -315,31 +341,223 @@ class Appl(Term):
         return self
 
 
-def appl(lam: "Lamb", term: Term, i=0):
-    res = lam.replace(lam.var, term)
-    if isinstance(res, Lamb):
-        trace(f"appl({lam}, {term}) => {res.body}", i)
-        return res.body
+# _replace tasks
+_VISIT = 0  # replace in a subterm, pushing the result
+_RESTART = 1  # replace again in the last result (alpha conversion)
+_LAMB = 2  # rebuild a lambda from the last result
+_APPL = 3  # rebuild an application from the last two results
+_BINOP = 4  # rebuild a BinOp from the last two results
 
-    raise TypeError(f"{res} is not a lambda")
 
+def _replace(term: Term, old: Var, new: Term, stats: Optional[EvalStats] = None) -> Term:
+    """
+    Replace `old` by `new` in `term`, without recursion
+
+    This is the implementation behind `Lamb.replace`, `Appl.replace`
+    and `BinOp.replace`. Nodes are not modified, the nodes on the path to
+    a replaced variable are copied and everything else is shared, so a
+    term can safely appear in several places, the argument of `appl`
+    included. A lambda that binds `old` again is left as it is, one that
+    binds a free variable of `new` is renamed first.
+
+    >>> Lamb(Var("x", int), Var("x", int)).replace(Var("x", int), Val("1", int))
+    (λx:int.x:int)
+    >>> Lamb(Var("y", int), BinOp("+", Var("x", int), Var("y", int))).replace(Var("x", int), Var("y", int))
+    (λz:int.y:int + z:int)
+    """
+    # free names of the replacements, by id, they live until the end
+    free: Dict[int, FrozenSet[str]] = {}
+    results: list = []
+    stack = [(_VISIT, term, old, new)]
+    while stack:
+        task, t, old, new = stack.pop()
+        if task == _VISIT:
+            if isinstance(t, Lamb):
+                if t.var.name == old.name:
+                    results.append(t)
+                    continue
+                names = free.get(id(new))
+                if names is None:
+                    names = free[id(new)] = _free_names(new)
+                if t.var.name in names and old.name in _free_names(t.body):
+                    # alpha conversion
+                    if stats is not None:
+                        stats.alpha += 1
+                    var = _next_var(t.var, _free_names(t.body) | names)
+                    stack.append((_LAMB, t, var, None))
+                    stack.append((_RESTART, None, old, new))
+                    stack.append((_VISIT, t.body, t.var, var))
+                else:
+                    stack.append((_LAMB, t, t.var, None))
+                    stack.append((_VISIT, t.body, old, new))
+            elif isinstance(t, Appl):
+                stack.append((_APPL, t, None, None))
+                stack.append((_VISIT, t.e2, old, new))
+                stack.append((_VISIT, t.e1, old, new))
+            elif isinstance(t, BinOp):
+                stack.append((_BINOP, t, None, None))
+                stack.append((_VISIT, t.b, old, new))
+                stack.append((_VISIT, t.a, old, new))
+            else:
+                if stats is not None and isinstance(t, Var) and t.name == old.name:
+                    stats.substitutions += 1
+                results.append(t.replace(old, new))
+        elif task == _RESTART:
+            stack.append((_VISIT, results.pop(), old, new))
+        elif task == _LAMB:
+            # old is the binder, renamed by an alpha conversion or not
+            body = results.pop()
+            if body is not t.body or old is not t.var:
+                t = copy(t)
+                t.var = old
+                t.body = body
+            results.append(t)
+        elif task == _APPL:
+            e2 = results.pop()
+            e1 = results.pop()
+            if e1 is not t.e1 or e2 is not t.e2:
+                t = copy(t)
+                t.e1 = e1
+                t.e2 = e2
+            results.append(t)
+        else:
+            b = results.pop()
+            a = results.pop()
+            if a is not t.a or b is not t.b:
+                t = copy(t)
+                t.a = a
+                t.b = b
+            results.append(t)
+    return results.pop()
+
+
+def _show(term: Term) -> str:
+    "Non recursive __repr__ for Lamb, Appl and BinOp"
+    out = []
+    stack: list = [term]
+    while stack:
+        t = stack.pop()
+        if isinstance(t, str):
+            out.append(t)
+        elif isinstance(t, Lamb):
+            stack.extend((")", t.body, ".", t.var, "(λ"))
+        elif isinstance(t, Appl):
+            if isinstance(t.e2, Appl):
+                stack.extend((")", t.e2, " (", t.e1))
+            else:
+                stack.extend((t.e2, " ", t.e1))
+        elif isinstance(t, BinOp):
+            stack.extend((t.b, f" {t.op} ", t.a))
+        else:
+            out.append(repr(t))
+    return "".join(out)
+
+
+def appl(
+    lam: "Lamb",
+    term: Term,
+    i=0,
+    tracer: Optional[Tracer] = None,
+    stats: Optional[EvalStats] = None,
+):
+    if not isinstance(lam, Lamb):
+        raise TypeError(f"{lam} is not a lambda")
+    res = _replace(lam.body, lam.var, term, stats)
+    if tracer is not None:
+        tracer.event("appl", i, res, lambda: f"appl({lam}, {term}) => {res}")
+    return res
+
+
+def _plug(stack: list, term: Term) -> Term:
+    "Put `term` back in the context described by the eval_term frames"
+    for kind, node, i, a in reversed(stack):
+        if kind == _EVAL_E1:
+            term = Appl(term, node.e2)
+        elif kind == _EVAL_E2:
+            term = Appl(a, term)
+        elif kind == _EVAL_A:
+            term = BinOp(node.op, term, node.b)
+        else:
+            term = BinOp(node.op, a, term)
+    return term
 
-def eval_term(term: Term, i=0, *, _trace=False) -> Term:
-    trace(f"eval({term})", i, _trace=_trace)
-    if isinstance(term, Appl):
-        e1 = eval_term(term.e1, i + 1, _trace=_trace)
-        e2 = eval_term(term.e2, i + 1, _trace=_trace)
-        if isinstance(e1, Lamb):
-            return eval_term(appl(e1, e2, i + 1), i + 1, _trace=_trace)
-    elif isinstance(term, BinOp):
-        a = eval_term(term.a, i + 1, _trace=_trace)
-        b = eval_term(term.b, i + 1, _trace=_trace)
-
-        if isinstance(a, Val) and isinstance(b, Val):
-            res = term.opfun(a.val, b.val)
-            return Val(res, type(res))
 
-    return term
+# eval_term frames
+_EVAL_E1 = 0  # evaluating the function of an application
+_EVAL_E2 = 1  # evaluating the argument, the function value is kept
+_EVAL_A = 2  # evaluating the left side of a BinOp
+_EVAL_B = 3  # evaluating the right side, the left value is kept
+
+
+def eval_term(
+    term: Term,
+    i=0,
+    *,
+    _trace=False,
+    tracer: Optional[Tracer] = None,
+    stats: Optional[EvalStats] = None,
+    cycles=None,
+) -> Term:
+    if _trace and tracer is None:
+        tracer = StderrTracer()
+    stack: list = []
+    while True:
+        # walk down to the leftmost subterm that can't be split
+        while True:
+            if tracer is not None:
+                tracer.event("eval", i, term, lambda t=term: f"eval({t})")
+            if isinstance(term, Appl):
+                stack.append((_EVAL_E1, term, i, None))
+                term = term.e1
+            elif isinstance(term, BinOp):
+                stack.append((_EVAL_A, term, i, None))
+                term = term.a
+            else:
+                break
+            i += 1
+        if stats is not None and len(stack) > stats.max_depth:
+            stats.max_depth = len(stack)
+        value = term
+
+        # return the value to the pending frames
+        while stack:
+            kind, node, i, a = stack.pop()
+            if kind == _EVAL_E1:
+                stack.append((_EVAL_E2, node, i, value))
+                term = node.e2
+                i += 1
+                break
+            elif kind == _EVAL_E2:
+                if isinstance(a, Lamb):
+                    if stats is not None:
+                        if stats.out_of_fuel():
+                            raise OutOfFuel(_plug(stack, Appl(a, value)), stats)
+                        stats.beta += 1
+                    term = appl(a, value, i + 1, tracer, stats)
+                    if cycles is not None:
+                        period = cycles.check(term, stack)
+                        if period is not None:
+                            raise Diverges(_plug(stack, term), period, stats)
+                    i += 1
+                    break
+                value = node
+            elif kind == _EVAL_A:
+                stack.append((_EVAL_B, node, i, value))
+                term = node.b
+                i += 1
+                break
+            else:
+                if isinstance(a, Val) and isinstance(value, Val):
+                    if stats is not None:
+                        if stats.out_of_fuel():
+                            raise OutOfFuel(_plug(stack, BinOp(node.op, a, value)), stats)
+                        stats.binops += 1
+                    res = node.opfun(a.val, value.val)
+                    value = Val(res, type(res))
+                else:
+                    value = node
+        else:
+            return value
 
 
 class AST:
@@ -349,13 +567,57 @@ class AST:
     def typecheck(self) -> None:
         self.root.typecheck()
 
-    def eval(self, _trace=False):
-        _reset_bound_vars()
-        t = eval_term(self.root, _trace=_trace)
-        prev = None
-        while not t.is_norm:
-            prev = t
-            t = eval_term(t, _trace=_trace)
-            if prev == t:
-                break
-        return t
+    def eval(
+        self,
+        _trace=False,
+        tracer=None,
+        fuel=None,
+        stats=False,
+        strategy="applicative",
+        detect_cycles=False,
+    ):
+        """
+        `fuel` limits the number of reduction steps, OutOfFuel is raised
+        with the partially reduced term when it runs out. With `stats=True`
+        an EvalStats is returned along with the result. `strategy` is one
+        of `lampy.strategy.STRATEGIES`. With `detect_cycles` Diverges is
+        raised when the evaluation loops, see `lampy.fingerprint`.
+
+        >>> AST(Appl(Lamb(Var("x", int), Val("1", int)), BinOp("+", Val("1", int), Val("1", int)))).eval(strategy="whnf", stats=True)[1].steps
+        1
+        """
+        st = EvalStats(fuel) if stats or fuel is not None else None
+        if strategy != "applicative":
+            if detect_cycles:
+                raise ValueError(f"The {strategy} strategy has no cycle detection")
+            import lampy.strategy
+
+            with phase(st, strategy):
+                t = lampy.strategy.reduce(self.root, strategy, sys.modules[__name__], st)
+            return (t, st) if stats else t
+        cycles = None
+        if detect_cycles:
+            import lampy.fingerprint
+
+            cycles = lampy.fingerprint.CycleDetector(sys.modules[__name__])
+        t = self.root
+        while True:
+            if st is not None:
+                st.max_size = max(st.max_size, t.size)
+            with phase(st, "eval"):
+                t, prev = eval_term(t, _trace=_trace, tracer=tracer, stats=st, cycles=cycles), t
+            with phase(st, "is_norm"):
+                # a pass that returns its own term was stuck, loops
+                # inside of a pass are caught by `cycles`
+                if t.is_norm or t is prev:
+                    break
+        if st is not None:
+            st.max_size = max(st.max_size, t.size)
+        return (t, st) if stats else t
+
+    def optimize(self, passes=None):
+        "Like `lampy.lampy.AST.optimize`"
+        import lampy.optimize
+
+        root, reports = lampy.optimize.optimize(self.root, sys.modules[__name__], passes)
+        return AST(root), reports
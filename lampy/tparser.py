@@ -65,6 +65,9 @@ class Transformer(LarkTransformer):
         a, op, b = tree
         return BinOp(op, a, b)
 
+    def numfactor(self, tree):
+        return self.bin_expr(tree)
+
     def appl(self, tree):
         e1, e2 = tree
         return Appl(e1, e2)
@@ -1,6 +1,11 @@
 import sys
 import os
+from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import contextmanager, nullcontext
 from functools import wraps
+from time import perf_counter
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Union
 
 def cache(f):
     """
@@ -30,6 +35,167 @@ def cache(f):
     return _
 
 
-def trace(msg: str, i=0, *, _trace=False):
+def fresh_name(hint: str, taken, letters="uvwxyz") -> str:
+    """
+    A name that isn't in `taken`: `hint` itself, else the first of
+    `letters` that is free, else `hint` with a number appended. Every
+    module that renames binders picks its names here.
+
+    >>> fresh_name("x", {"y"})
+    'x'
+    >>> fresh_name("x", {"x", "u"})
+    'v'
+    >>> fresh_name("x", set("uvwxyz"))
+    'x1'
+    """
+    if hint not in taken:
+        return hint
+    for c in letters:
+        if c not in taken:
+            return c
+    i = 1
+    while f"{hint}{i}" in taken:
+        i += 1
+    return f"{hint}{i}"
+
+
+def trace(msg: Union[str, Callable[[], str]], i=0, *, _trace=False):
     if _trace:
+        if callable(msg):
+            msg = msg()
         print(f"{'  ' * i}{msg}", file=sys.stderr)
+
+
+class TraceEvent(NamedTuple):
+    kind: str  # "eval", "appl", ...
+    depth: int
+    node: int  # id() of the term
+    fmt: Callable[[], str]
+
+    @property
+    def message(self) -> str:
+        return self.fmt()
+
+
+class Tracer(ABC):
+    """
+    Receives the evaluation events. Messages are passed as callables and
+    only formatted if the tracer asks for them, evaluators only check
+    `tracer is not None` when tracing is off.
+    """
+
+    @abstractmethod
+    def event(self, kind: str, depth: int, node: Any, fmt: Callable[[], str]):
+        pass
+
+
+class StderrTracer(Tracer):
+    "Prints the messages right away, what `_trace=True` does"
+
+    def event(self, kind, depth, node, fmt):
+        trace(fmt, depth, _trace=True)
+
+
+class RingTracer(Tracer):
+    """
+    Keeps the last `maxlen` events, messages are formatted when read, so
+    they show the terms as they are at that time
+
+    >>> t = RingTracer(2)
+    >>> for i in range(3):
+    ...     t.event("eval", i, None, lambda i=i: f"step {i}")
+    >>> [e.message for e in t.events()]
+    ['step 1', 'step 2']
+    """
+
+    def __init__(self, maxlen=1024):
+        self.buffer: "deque[TraceEvent]" = deque(maxlen=maxlen)
+
+    def event(self, kind, depth, node, fmt):
+        self.buffer.append(TraceEvent(kind, depth, id(node), fmt))
+
+    def events(self) -> List[TraceEvent]:
+        return list(self.buffer)
+
+    def clear(self):
+        self.buffer.clear()
+
+
+class CallbackTracer(Tracer):
+    "Calls `callback` with a TraceEvent for each event"
+
+    def __init__(self, callback: Callable[[TraceEvent], Any]):
+        self.callback = callback
+
+    def event(self, kind, depth, node, fmt):
+        self.callback(TraceEvent(kind, depth, id(node), fmt))
+
+
+class EvalStats:
+    """
+    What an evaluation did. `fuel` limits the number of steps (beta
+    reductions plus BinOp folds), evaluators raise OutOfFuel when it runs
+    out.
+    """
+
+    def __init__(self, fuel: Optional[int] = None):
+        self.fuel = fuel
+        self.beta = 0
+        self.substitutions = 0
+        self.alpha = 0
+        self.binops = 0
+        self.max_size = 0
+        self.max_depth = 0
+        self.time: Dict[str, float] = {}
+
+    @property
+    def steps(self) -> int:
+        return self.beta + self.binops
+
+    def out_of_fuel(self) -> bool:
+        return self.fuel is not None and self.steps >= self.fuel
+
+    @contextmanager
+    def phase(self, name: str):
+        "Add the wall time of the block to `time[name]`"
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.time[name] = self.time.get(name, 0.0) + perf_counter() - start
+
+    def __repr__(self):
+        return (
+            f"EvalStats(beta={self.beta}, substitutions={self.substitutions}, "
+            f"alpha={self.alpha}, binops={self.binops}, max_size={self.max_size}, "
+            f"max_depth={self.max_depth})"
+        )
+
+
+def phase(stats: Optional[EvalStats], name: str):
+    "stats.phase(name), or nothing when there are no stats"
+    if stats is None:
+        return nullcontext()
+    return stats.phase(name)
+
+
+class OutOfFuel(Exception):
+    "The step limit was reached, `term` is the term reduced so far"
+
+    def __init__(self, term, stats: EvalStats):
+        super().__init__(f"out of fuel after {stats.steps} steps")
+        self.term = term
+        self.stats = stats
+
+
+class Diverges(Exception):
+    """
+    The evaluation came back to a state it was in `period` steps before,
+    it would loop forever. `term` is the term in that state.
+    """
+
+    def __init__(self, term, period: int, stats: Optional[EvalStats] = None):
+        super().__init__(f"diverges, the same term comes back every {period} steps")
+        self.term = term
+        self.period = period
+        self.stats = stats
@@ -0,0 +1,351 @@
+"""
+Bytecode for lampy.lampy terms and a virtual machine to run it
+
+Between `eval_term`, which rewrites the tree at every step, and
+`lampy.compiler`, which only runs closed terms natively, terms are
+compiled to a flat sequence of instructions in an `array`, one 64 bit
+word each: the opcode in the low byte and its operand in the rest. The
+machine is a loop over that array in the style of the ZINC machine:
+an argument stack, a linked list environment indexed by de Bruijn
+indices, and return frames. Numbers are plain ints on the stack.
+
+A chain of lambdas `(x, y) => ...` is one function that starts with
+`GRAB 2`, an application `f a b` pushes both arguments and calls `f`
+once, so curried calls don't build the intermediate closures. Calls in
+tail position don't push a frame. Free variables and functions applied
+to too few arguments are values too, they are read back into terms at
+the end like the cek engine does, evaluation order is call by value
+like `eval_term`.
+
+An application of something that isn't a function, or an operator on
+something that isn't a number, is stuck: `eval_term` leaves such a term
+as it is, and by then the machine has evaluated its subterms and lost
+track of where the term started. `run` raises `Stuck` and `normalize`
+evaluates the term with the cek engine instead, so open terms still get
+the results of `eval_term`.
+
+>>> program = compile_term(Appl(Lamb(Var("x"), BinOp("+", Var("x"), Val("1"))), Val("41")))
+>>> print(disassemble(program))
+    0  CLOSURE   0
+    1  PUSHVAL   41
+    2  APPLY     1
+    3  STOP
+fun 0 (λx)
+    4  GRAB      1
+    5  ACCESS    0
+    6  PUSHVAL   1
+    7  PRIM      +
+    8  RETURN
+>>> run(program)
+42
+>>> AST(Appl(Lamb(Var("x"), Lamb(Var("y"), Var("x"))), Var("f"))).eval(engine="vm")
+(λy.f)
+>>> AST(Appl(Var("f"), Appl(Lamb(Var("y"), Var("y")), Val("1")))).eval(engine="vm")
+f ((λy.y) 1)
+"""
+from array import array
+from typing import Any, List, Optional, Tuple
+
+from lampy.lampy import Term, Var, Val, Lamb, Appl, BinOp, AST
+from lampy import cek
+from lampy.cek import Neutral, _close
+from lampy.debruijn import (
+    DTerm,
+    Ix,
+    Free,
+    DVal,
+    DLamb,
+    DAppl,
+    DBinOp,
+    to_debruijn,
+    from_debruijn,
+)
+
+# opcodes, the operand is what follows the name
+ACCESS = 0  # push the environment value at a de Bruijn index
+FREE = 1  # push a free variable, a symbol
+PUSHVAL = 2  # push a constant
+CLOSURE = 3  # push a closure of a function with the current environment
+APPLY = 4  # call the value under n arguments
+APPTERM = 5  # the same in tail position, without a return frame
+GRAB = 6  # move n arguments to the environment, or return a partial application
+PRIM = 7  # apply an operator to the two values on top
+RETURN = 8  # return from a function, or apply the result to the arguments left
+STOP = 9  # end of the program
+
+NAMES = ["ACCESS", "FREE", "PUSHVAL", "CLOSURE", "APPLY", "APPTERM", "GRAB", "PRIM", "RETURN", "STOP"]
+
+OPS = list(BinOp.opmap)
+_OPFUNS = [BinOp.opmap[o] for o in OPS]
+
+
+class Program:
+    def __init__(self):
+        self.code = array("q")
+        # code offset of each function
+        self.entries = array("q")
+        # the lambda of each function, to read closures back
+        self.lambdas: List[DLamb] = []
+        self.consts: List[int] = []
+        self.symbols: List[str] = []
+
+    def __len__(self):
+        return len(self.code)
+
+
+class Stuck(Exception):
+    "The program applies something that isn't a function, or adds something that isn't a number"
+
+
+class Closure:
+    __slots__ = ("fun", "env")
+
+    def __init__(self, fun: int, env):
+        self.fun = fun
+        self.env = env
+
+    def __repr__(self):
+        return f"<closure {self.fun}>"
+
+
+class Partial:
+    "A closure applied to fewer arguments than it grabs"
+
+    __slots__ = ("closure", "args")
+
+    def __init__(self, closure: Closure, args: Tuple[Any, ...]):
+        self.closure = closure
+        self.args = args
+
+    def __repr__(self):
+        return f"<partial {self.closure.fun} {len(self.args)}>"
+
+
+def _chain(lam: DLamb) -> Tuple[int, DTerm]:
+    "Number of directly nested lambdas and the innermost body"
+    arity = 0
+    t: DTerm = lam
+    while isinstance(t, DLamb):
+        arity += 1
+        t = t.body
+    return arity, t
+
+
+def compile_term(term) -> Program:
+    """
+    Compile a term, a lampy.lampy one or its `lampy.debruijn` form. The
+    program starts at 0 with the code of the term, the functions follow.
+    """
+    if isinstance(term, AST):
+        term = term.root
+    if isinstance(term, Term):
+        term = to_debruijn(term)
+    prog = Program()
+    const_ids: dict = {}
+    symbol_ids: dict = {}
+    # (function index or None for the program, lambda or term)
+    pending: List[Tuple[Optional[int], DTerm]] = [(None, term)]
+    for fun, t in pending:
+        code = prog.code
+        if fun is None:
+            body = t
+        else:
+            prog.entries.append(len(code))
+            arity, body = _chain(t)
+            code.append(GRAB | arity << 8)
+        tail_call = False
+        # post order, ints are instructions to emit
+        stack: list = [body]
+        while stack:
+            t = stack.pop()
+            if isinstance(t, int):
+                code.append(t)
+            elif isinstance(t, Ix):
+                code.append(ACCESS | t.index << 8)
+            elif isinstance(t, Free):
+                if t.name not in symbol_ids:
+                    symbol_ids[t.name] = len(prog.symbols)
+                    prog.symbols.append(t.name)
+                code.append(FREE | symbol_ids[t.name] << 8)
+            elif isinstance(t, DVal):
+                if t.val not in const_ids:
+                    const_ids[t.val] = len(prog.consts)
+                    prog.consts.append(t.val)
+                code.append(PUSHVAL | const_ids[t.val] << 8)
+            elif isinstance(t, DLamb):
+                code.append(CLOSURE | len(prog.lambdas) << 8)
+                prog.lambdas.append(t)
+                pending.append((len(prog.lambdas) - 1, t))
+            elif isinstance(t, DAppl):
+                # only the body of a function itself is a tail call
+                tail = fun is not None and t is body
+                args = []
+                while isinstance(t, DAppl):
+                    args.append(t.e2)
+                    t = t.e1
+                stack.append((APPTERM if tail else APPLY) | len(args) << 8)
+                stack.extend(args)
+                stack.append(t)
+                if tail:
+                    tail_call = True
+            elif isinstance(t, DBinOp):
+                stack.append(PRIM | OPS.index(t.op) << 8)
+                stack.append(t.b)
+                stack.append(t.a)
+            else:
+                raise TypeError(f"Can't compile {t!r}")
+        if fun is None:
+            code.append(STOP)
+        elif not tail_call:
+            code.append(RETURN)
+    return prog
+
+
+def disassemble(prog: Program) -> str:
+    "One line per instruction, with the constants and names resolved"
+    starts = {e: i for i, e in enumerate(prog.entries)}
+    lines = []
+    for pc, ins in enumerate(prog.code):
+        if pc in starts:
+            fun = starts[pc]
+            lam: DTerm = prog.lambdas[fun]
+            names = []
+            while isinstance(lam, DLamb):
+                names.append(lam.hint)
+                lam = lam.body
+            lines.append(f"fun {fun} (λ{', '.join(names)})")
+        op, arg = ins & 0xFF, ins >> 8
+        if op == PUSHVAL:
+            shown = str(prog.consts[arg])
+        elif op == FREE:
+            shown = prog.symbols[arg]
+        elif op == PRIM:
+            shown = OPS[arg]
+        elif op in (RETURN, STOP):
+            shown = ""
+        else:
+            shown = str(arg)
+        lines.append(f"{pc:5}  {NAMES[op]:9} {shown}".rstrip())
+    return "\n".join(lines)
+
+
+def run(prog: Program, env=None):
+    """
+    Run a program to a machine value, an int, a Closure, a Partial or a
+    Neutral for a free variable, `readback` makes it a term again. Raises
+    `Stuck` when the program gets stuck.
+
+    >>> run(compile_term(Appl(Lamb(Var("x"), Lamb(Var("y"), Var("x"))), Val("1"))))
+    <partial 0 1>
+    """
+    code, entries, consts, symbols = prog.code, prog.entries, prog.consts, prog.symbols
+    opfuns = _OPFUNS
+    stack: list = []
+    push, pop = stack.append, stack.pop
+    # (pc, env, extra) of the callers
+    frames: List[tuple] = []
+    # arguments on the stack for the function being run
+    extra = 0
+    pc = 0
+    while True:
+        ins = code[pc]
+        pc += 1
+        op = ins & 0xFF
+        if op == ACCESS:
+            e = env
+            for _ in range(ins >> 8):
+                e = e[1]
+            push(e[0])
+            continue
+        elif op == PUSHVAL:
+            push(consts[ins >> 8])
+            continue
+        elif op == PRIM:
+            b = pop()
+            a = pop()
+            if type(a) is int and type(b) is int:
+                push(int(opfuns[ins >> 8](a, b)))
+                continue
+            raise Stuck(f"{OPS[ins >> 8]} at {pc - 1}")
+        elif op == GRAB:
+            n = ins >> 8
+            if extra >= n:
+                for _ in range(n):
+                    env = (pop(), env)
+                extra -= n
+                continue
+            value = Partial(fun, tuple(pop() for _ in range(extra)))
+            pc, env, extra = frames.pop()
+            push(value)
+            continue
+        elif op == CLOSURE:
+            push(Closure(ins >> 8, env))
+            continue
+        elif op == APPLY or op == APPTERM:
+            n = ins >> 8
+            # the first argument ends up on top
+            args = stack[-n:]
+            args.reverse()
+            fun = stack[-n - 1]
+            del stack[-n - 1 :]
+            stack.extend(args)
+            if op == APPLY:
+                frames.append((pc, env, extra))
+                extra = n
+            else:
+                extra += n
+        elif op == RETURN:
+            value = pop()
+            if not extra:
+                pc, env, extra = frames.pop()
+                push(value)
+                continue
+            fun = value
+        elif op == FREE:
+            push(Neutral(Free(symbols[ins >> 8])))
+            continue
+        elif op == STOP:
+            return pop()
+        else:
+            raise ValueError(f"Bad opcode {op} at {pc - 1}")
+
+        # call `fun` with the `extra` arguments on the stack
+        while type(fun) is Partial:
+            stack.extend(reversed(fun.args))
+            extra += len(fun.args)
+            fun = fun.closure
+        if type(fun) is Closure:
+            env = fun.env
+            pc = entries[fun.fun]
+            continue
+        raise Stuck(f"application of {fun!r} before {pc}")
+
+
+def readback(prog: Program, value) -> DTerm:
+    "A machine value as a term, function bodies are not reduced"
+    if type(value) is int:
+        return DVal(value)
+    elif isinstance(value, Neutral):
+        return value.term
+    read = lambda v: readback(prog, v)
+    if isinstance(value, Closure):
+        lam = prog.lambdas[value.fun]
+        return DLamb(_close(lam.body, value.env, 1, read), lam.hint)
+    elif isinstance(value, Partial):
+        lam = prog.lambdas[value.closure.fun]
+        env = value.closure.env
+        for arg in value.args:
+            env = (arg, env)
+            lam = lam.body  # type: ignore
+        return DLamb(_close(lam.body, env, 1, read), lam.hint)
+    raise TypeError(f"Can't read back {value!r}")
+
+
+def normalize(term: Term) -> Term:
+    "Entry point used by `AST.eval(engine=\"vm\")`, stuck terms are run by the cek engine"
+    prog = compile_term(term)
+    try:
+        value = run(prog)
+    except Stuck:
+        return cek.normalize(term)
+    return from_debruijn(readback(prog, value))
@@ -2,8 +2,9 @@
 import sys
 import doctest
 import unittest
+import importlib.util
 
-from lampy import lampy, utils, parser, tlampy, tparser
+from lampy import lampy, utils, parser, tlampy, tparser, debruijn
 
 
 #def load_tests(loader, tests, ignore):
@@ -13,6 +14,22 @@ from lampy import lampy, utils, parser, tlampy, tparser
 #    return tests
 
 
+ENGINES = ["debruijn", "cek", "need", "graph", "arena", "vm"]
+
+
+def church(n):
+    return "(f, x) => " + "f (" * n + "x" + ")" * n
+
+
+CHURCH = "((n) => n ((x) => x + 1) 0) (%s (%s) (%s (%s) (%s)));" % (
+    "((m) => (n) => (f) => m (n f))",
+    church(30),
+    "((m) => (n) => (f, x) => m f (n f x))",
+    church(20),
+    church(20),
+)
+
+
 class Test(unittest.TestCase):
     def test_parse(self):
         print(parser.lamb_parser.parse("f -1;").pretty())
@@ -99,3 +116,654 @@ class Test(unittest.TestCase):
                 )[0].root.typ
             ),
         )
+
+    def test_engines(self):
+        def e(input_, engine):
+            return parser.parse(input_)[0].eval(engine=engine)
+
+        for input_ in [
+            "((a, b) => a + b) 1 2;",
+            "((a, b) => a) 1 2;",
+            "((a) => a + 10) 1 - 2;",
+            "((f, a) => f a) ((i) => i) 0;",
+        ]:
+            for engine in ENGINES:
+                self.assertEqual(repr(e(input_, "subst")), repr(e(input_, engine)))
+
+        # stuck and open applications are left as they are
+        for input_, output in [
+            ("f (((y) => y) 1);", "f ((λy.y) 1)"),
+            ("1 (((y) => y) 2);", "1 ((λy.y) 2)"),
+            ("((x) => f (x + 1)) 2;", "f 2 + 1"),
+        ]:
+            for engine in ["subst"] + ENGINES:
+                self.assertEqual(output, repr(e(input_, engine)))
+        # even when the function was reduced first, except by the lazy engines
+        for engine in ["subst", "debruijn", "cek", "arena", "vm"]:
+            self.assertEqual("(λx.f x) 1 ((λy.y) 2)", repr(e("((x) => f x) 1 (((y) => y) 2);", engine)))
+        # nbe normalizes them
+        self.assertEqual("f 1", repr(e("f (((y) => y) 1);", "nbe")))
+
+        for engine in ENGINES:
+            self.assertEqual("(λb.1)", repr(e("((a, b) => a) 1;", engine)))
+            self.assertEqual(1200, e(CHURCH, engine).val)
+
+        omega = "((x) => x x) ((x) => x x)"
+        self.assertEqual(1, e(f"((a, b) => a) 1 ({omega});", "need").val)
+        self.assertEqual(1, e(f"((a, b) => a) 1 ({omega});", "graph").val)
+
+        # more binders than the u..z renaming letters
+        names = "abcdefgh"
+        body = lampy.Var("h")
+        for n in reversed(names[:-1]):
+            body = lampy.Appl(body, lampy.Var(n))
+        term = body
+        for n in reversed(names):
+            term = lampy.Lamb(lampy.Var(n), term)
+        self.assertTrue(
+            debruijn.alpha_eq(term, debruijn.from_debruijn(debruijn.to_debruijn(term)))
+        )
+
+    def test_deep_terms(self):
+        from lampy import bench
+
+        n = 10000
+        inc = lambda: lampy.Lamb(lampy.Var("x"), lampy.BinOp("+", lampy.Var("x"), lampy.Val(1)))
+        term = lampy.Val(0)
+        for _ in range(n):
+            term = lampy.Appl(inc(), term)
+        self.assertFalse(term.is_norm)
+        self.assertTrue(repr(term).endswith("(λx.x + 1) 0" + ")" * (n - 1)))
+        self.assertEqual(n, lampy.AST(term).eval().val)
+
+        body = lampy.Var("y")
+        for _ in range(n):
+            body = lampy.BinOp("+", body, lampy.Var("y"))
+        self.assertEqual(n + 1, lampy.eval_term(lampy.Appl(lampy.Lamb(lampy.Var("y"), body), lampy.Val(1))).val)
+
+        lam = lampy.Lamb(lampy.Var("z"), body)
+        for engine in ["debruijn", "nbe", "graph"]:
+            self.assertEqual(5000, lampy.AST(bench.deep(5000)).eval(engine=engine).val)
+            self.assertEqual(repr(lam), repr(lampy.AST(lam).eval(engine=engine)))
+            self.assertEqual(
+                n + 1, lampy.AST(lampy.Appl(lampy.Lamb(lampy.Var("y"), body), lampy.Val(1))).eval(engine=engine).val
+            )
+
+        tinc = lambda: tlampy.Lamb(
+            tlampy.Var("x", int), tlampy.BinOp("+", tlampy.Var("x", int), tlampy.Val(1, int))
+        )
+        term = tlampy.Val(0, int)
+        for _ in range(n):
+            term = tlampy.Appl(tinc(), term)
+        self.assertFalse(term.is_norm)
+        self.assertEqual(n, tlampy.AST(term).eval().val)
+
+    def test_normalize(self):
+        mult = "((m) => (n) => (f) => m (n f))"
+        ast = parser.parse(f"{mult} ({church(2)}) ({church(3)});")[0]
+        self.assertTrue(debruijn.alpha_eq(parser.parse(church(6) + ";")[0].root, ast.normalize()))
+        self.assertEqual(1200, parser.parse(CHURCH)[0].eval(engine="nbe").val)
+
+        # a normal form deeper than the recursion limit
+        deep = lampy.Var("x")
+        for _ in range(5000):
+            deep = lampy.Appl(lampy.Var("f"), lampy.Appl(lampy.Lamb(lampy.Var("y"), lampy.Var("y")), deep))
+        normal = lampy.AST(lampy.Lamb(lampy.Var("x"), deep)).normalize()
+        self.assertTrue(repr(normal).startswith("(λx.f (f ("))
+
+    def test_hashcons(self):
+        import gc
+        from lampy import hashcons
+
+        before = hashcons.table_size()
+        ast = parser.parse("((a) => a + a) ((b) => b) ((b) => b);")[0]
+        node = hashcons.from_term(ast.root)
+        self.assertIs(node.e1.e2, node.e2)
+        self.assertEqual(repr(ast.root), repr(node))
+        self.assertEqual(repr(ast.root), repr(hashcons.to_term(node)))
+        del node
+        gc.collect()
+        self.assertEqual(before, hashcons.table_size())
+
+        typed = tparser.parse("(f: int -> int, a: int) => f a;")[0].root
+        self.assertEqual(repr(typed), repr(hashcons.to_term(hashcons.from_term(typed), tlampy)))
+
+        # deeper than the recursion limit, shared nodes stay shared
+        deep = lampy.Var("x")
+        for _ in range(5000):
+            deep = lampy.Appl(lampy.Var("f"), deep)
+        node = hashcons.from_term(lampy.Appl(deep, deep))
+        term = hashcons.to_term(node)
+        self.assertIs(term.e1, term.e2)
+        self.assertEqual(
+            repr(lampy.Appl(deep, deep).replace(lampy.Var("x"), lampy.Val(1))),
+            repr(hashcons.to_term(hashcons.substitute(node, "x", hashcons.HVal(1)))),
+        )
+
+    def test_compile(self):
+        f = parser.parse("(x) => x + x + 1;")[0].compile()
+        self.assertEqual([1, 3, 5], [f(i).val for i in range(3)])
+        self.assertEqual(1200, parser.parse(CHURCH)[0].eval(engine="compile").val)
+        # open terms stay symbolic
+        self.assertEqual("y + 1", repr(parser.parse("(x) => y + x;")[0].compile()(1)))
+        # functions results are read back by the interpreter
+        self.assertEqual("(λb.1)", repr(parser.parse("(a, b) => a;")[0].compile()(1)))
+        # terms that get stuck are interpreted too
+        for input_ in ["1 (((y) => y) 2);", "(1 + ((x) => x));", "((a) => (b) => a) (1 2);"]:
+            t = parser.parse(input_)[0]
+            self.assertEqual(repr(t.eval()), repr(t.eval(engine="compile")))
+            self.assertEqual(repr(t.eval()), repr(t.compile()()))
+
+    def test_nfcache(self):
+        import os
+        import tempfile
+        from lampy.nfcache import NFCache
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "nf")
+            cache = NFCache(maxsize=1, path=path)
+            self.assertEqual(3, parser.parse("((a, b) => a + b) 1 2;")[0].eval(cache=cache).val)
+            self.assertEqual(3, parser.parse("((x, y) => x + y) 1 2;")[0].eval(cache=cache).val)
+            self.assertEqual("(λb.1)", repr(parser.parse("((a, b) => a) 1;")[0].eval(cache=cache)))
+            info = cache.info()
+            self.assertEqual((1, 2, 1, 1), (info.hits, info.misses, info.evictions, info.size))
+            cache.close()
+
+            warm = NFCache(path=path)
+            self.assertEqual(3, lampy.eval_term(parser.parse("((a, b) => a + b) 1 2;")[0].root, cache=warm).val)
+            self.assertEqual(3, parser.parse("((a, b) => a + b) 1 2;")[0].eval(cache=warm).val)
+            self.assertEqual(1, warm.info().disk_hits)
+            warm.close()
+
+    def test_tracer(self):
+        ring = utils.RingTracer(maxlen=3)
+        self.assertEqual(3, parser.parse("((a, b) => a + b) 1 2;")[0].eval(tracer=ring).val)
+        events = ring.events()
+        self.assertEqual(3, len(events))
+        self.assertEqual("eval(2)", events[-1].message)
+
+        seen = []
+        tlampy.eval_term(
+            tparser.parse("((a: int) => 1 + a) 2;")[0].root,
+            tracer=utils.CallbackTracer(lambda e: seen.append((e.kind, e.depth))),
+        )
+        self.assertIn(("appl", 1), seen)
+        self.assertEqual(("eval", 0), seen[0])
+
+    def test_fuel(self):
+        y = "((f) => ((x) => f (x x))((x) => f (x x))) 1;"
+        with self.assertRaises(utils.OutOfFuel) as cm:
+            parser.parse(y)[0].eval(fuel=100)
+        self.assertEqual(100, cm.exception.stats.beta)
+        self.assertIsInstance(cm.exception.term, lampy.Appl)
+
+        t, stats = tparser.parse("((a: int, b: int) => a + b) 1 2;")[0].eval(stats=True)
+        self.assertEqual(3, t.val)
+        self.assertEqual((2, 1), (stats.beta, stats.binops))
+        self.assertIn("eval", stats.time)
+
+        with self.assertRaises(utils.OutOfFuel) as cm:
+            tparser.parse("((a: int, b: int) => a + b) 1 2;")[0].eval(fuel=2)
+        self.assertEqual("1 + 2", repr(cm.exception.term))
+
+    def test_free_vars(self):
+        from lampy.lampy import Var, Val, Lamb, Appl
+
+        t = Lamb(Var("y"), Appl(Var("x"), Var("y")))
+        self.assertEqual({"x"}, t.fv)
+        # subterms without x are shared, not copied
+        skip = Lamb(Var("z"), Var("z"))
+        res = Appl(Var("x"), skip).replace(Var("x"), Val("1"))
+        self.assertIs(skip, res.e2)
+        # bound occurrences are left alone
+        self.assertEqual("(λx.x)", repr(Lamb(Var("x"), Var("x")).replace(Var("x"), Val("1"))))
+        # capture avoiding, even with every renaming letter taken
+        body = Var("x")
+        for c in "uvwxyz":
+            body = Appl(body, Var(c))
+        res = Lamb(Var("y"), body).replace(Var("x"), Var("y"))
+        self.assertNotIn(res.var.name, "uvwxyz")
+        self.assertEqual(frozenset("uvwyz"), res.fv)
+
+        self.assertEqual(1200, parser.parse(CHURCH)[0].eval().val)
+
+    def test_mul_div(self):
+        self.assertEqual(7, parser.parse("((x) => x * 2 + 1) 3;")[0].eval().val)
+        self.assertEqual(3, parser.parse("((x) => x / 2) 7;")[0].eval().val)
+
+    @unittest.skipUnless(importlib.util.find_spec("numpy"), "numpy is not installed")
+    def test_batch(self):
+        import numpy as np
+        from lampy.batch import batch_eval
+
+        def b(input_, *arrays):
+            return batch_eval(parser.parse(input_)[0], *arrays).tolist()
+
+        self.assertEqual([1, 3, 5], b("(x) => x * 2 + 1;", np.arange(3)))
+        self.assertEqual([0, 0, 1, 1], b("(x, y) => x / y;", np.arange(4), np.array([2])))
+        self.assertEqual([1, 2, 3], b("(x) => ((f) => f x) ((y) => y + 1);", np.arange(3)))
+        self.assertEqual([3, 3], b("(x) => 3;", np.arange(2)))
+        self.assertEqual(
+            ["(λy.0 + y)", "(λy.1 + y)"], list(map(repr, b("(x) => (y) => x + y;", np.arange(2))))
+        )
+        # no int64 wrap around
+        self.assertEqual([10**20, 1], b("(x) => x * x * x * x;", [100000, 1]))
+        self.assertEqual([2**64], b("(x) => x * x + 0;", [2**32]))
+        with self.assertRaises(ZeroDivisionError):
+            b("(x, y) => x / y;", np.arange(2), np.array([1, 0]))
+
+    def test_church(self):
+        from lampy.lampy import Appl, AST, Val
+        from lampy.church import numeral, combinator_term as c, ChurchBool, church_numeral
+
+        def ap(*ts):
+            t = ts[0]
+            for x in ts[1:]:
+                t = Appl(t, x)
+            return t
+
+        inc = parser.parse("(x) => x + 1;")[0].root
+        for t in [
+            ap(c("plus"), numeral(3), numeral(4), inc, Val(0)),
+            ap(c("mult"), numeral(3), numeral(4), inc, Val(0)),
+            ap(c("exp"), numeral(2), numeral(5), inc, Val(0)),
+            ap(c("sub"), numeral(2), numeral(5), inc, Val(0)),
+            ap(c("pred"), numeral(0), inc, Val(0)),
+            ap(c("iszero"), numeral(0), Val(1), Val(0)),
+            ap(c("and"), ChurchBool(True), ChurchBool(False), Val(1), Val(0)),
+            ap(c("if"), ap(c("not"), ChurchBool(False)), Val(1), Val(0)),
+            # not a numeral, regular beta steps are made
+            ap(c("plus"), numeral(1), parser.parse("(f) => (x) => f x;")[0].root, inc, Val(0)),
+        ]:
+            self.assertEqual(repr(AST(t).eval()), repr(AST(t).eval(church=True)))
+
+        # unapplied results show the term of the plain reduction
+        y = lampy.Var("y")
+        for t in [
+            ap(c("succ"), numeral(2)),
+            ap(c("plus"), numeral(2), numeral(3)),
+            ap(c("exp"), numeral(2), numeral(3)),
+            ap(c("sub"), numeral(3), numeral(1)),
+            ap(c("succ"), ap(c("pred"), numeral(2))),
+            ap(c("iszero"), numeral(0)),
+            ap(c("or"), ChurchBool(False), ap(c("not"), ChurchBool(False))),
+            ap(c("plus"), numeral(1)),
+            # an open argument under a binder that would capture it
+            ap(
+                parser.parse("(g) => (y) => g y;")[0].root,
+                ap(c("if"), ChurchBool(True), y),
+            ),
+        ]:
+            self.assertEqual(repr(AST(t).eval()), repr(AST(t).eval(church=True)))
+
+        # substituting in a partial application gives a plain lambda
+        from lampy.church import accelerate
+
+        partial = accelerate(accelerate(c("if"), ChurchBool(True)), y).replace(y, Val(5))
+        self.assertEqual(5, AST(ap(partial, Val(7))).eval(church=True).val)
+
+        big = AST(ap(c("mult"), numeral(1000), numeral(1000))).eval(church=True)
+        self.assertEqual(10 ** 6, church_numeral(big))
+        self.assertIsNone(big._body)
+
+        from lampy.serialize import dumps, loads
+
+        for t in [numeral(3), AST(ap(c("plus"), numeral(2), numeral(3))).eval(church=True)]:
+            self.assertEqual(repr(t), repr(loads(dumps(t))))
+        self.assertEqual(1200, parser.parse(CHURCH)[0].eval(church=True).val)
+
+    def test_strategies(self):
+        from lampy.strategy import STRATEGIES
+
+        omega = "(((x) => x x) ((x) => x x))"
+        for strategy in STRATEGIES:
+            t, stats = parser.parse(CHURCH)[0].eval(strategy=strategy, stats=True)
+            self.assertEqual(1200, t.val)
+            self.assertGreater(stats.steps, 0)
+            _, stats = parser.parse(f"((a, b) => a) 1 ({CHURCH[:-1]});")[0].eval(
+                strategy=strategy, stats=True
+            )
+            if strategy != "applicative":
+                self.assertEqual(2, stats.steps)
+                self.assertEqual(1, parser.parse(f"((a, b) => a) 1 {omega};")[0].eval(strategy=strategy).val)
+
+        e = lambda s, strategy: repr(parser.parse(s)[0].eval(strategy=strategy))
+        self.assertEqual("(λx.x)", e("(x) => ((y) => y) x;", "normal"))
+        self.assertEqual("(λx.x)", e("(x) => ((y) => y) x;", "head"))
+        self.assertEqual("(λx.(λy.y) x)", e("(x) => ((y) => y) x;", "whnf"))
+        self.assertEqual("(λx.x (λy.y))", e("(x) => x (((z) => z) ((y) => y));", "normal"))
+        self.assertEqual("(λx.x ((λz.z) (λy.y)))", e("(x) => x (((z) => z) ((y) => y));", "head"))
+
+        y = "((f) => ((x) => f (x x))((x) => f (x x))) ((g) => g);"
+        with self.assertRaises(utils.OutOfFuel) as cm:
+            parser.parse(y)[0].eval(strategy="normal", fuel=50)
+        self.assertEqual(50, cm.exception.stats.beta)
+
+        n = 10000
+        term = lampy.Var("x")
+        for _ in range(n):
+            term = lampy.BinOp("+", term, lampy.Val(1))
+        term = lampy.Appl(lampy.Lamb(lampy.Var("x"), term), lampy.Val(0))
+        self.assertEqual(n, lampy.AST(term).eval(strategy="normal").val)
+
+        t, stats = tparser.parse("((a: int, b: int) => a + b) 1 2;")[0].eval(
+            strategy="normal", stats=True
+        )
+        self.assertEqual((3, 3), (t.val, stats.steps))
+
+    def test_resumable(self):
+        import asyncio
+        import pickle
+        from lampy.resumable import Evaluation, Scheduler, eval_async
+
+        ev = Evaluation(parser.parse(CHURCH)[0])
+        slices = list(ev.slices(50))
+        self.assertGreater(len(slices), 10)
+        self.assertEqual(1200, ev.result.val)
+
+        ev = Evaluation(parser.parse(CHURCH)[0], stats=utils.EvalStats())
+        self.assertFalse(ev.run(500))
+        self.assertLess(ev.steps, 510)
+        snap = pickle.loads(pickle.dumps(ev.snapshot()))
+        self.assertTrue(snap.run(10 ** 9))
+        self.assertTrue(ev.run(10 ** 9))
+        self.assertEqual((1200, 1200), (ev.result.val, snap.result.val))
+        self.assertEqual(ev.steps, snap.stats.steps)
+
+        s = Scheduler(steps=20)
+        y = "((f) => ((x) => f (x x))((x) => f (x x))) 1;"
+        evs = [s.submit(parser.parse(src)[0]) for src in (CHURCH, y, "1 + 2;")]
+        for _ in range(3):
+            s.tick()
+        self.assertEqual(3, evs[2].result.val)
+        self.assertFalse(evs[1].done)
+
+        async def both():
+            return await asyncio.gather(
+                eval_async(parser.parse(CHURCH)[0]), eval_async(parser.parse("1 + 2;")[0])
+            )
+
+        self.assertEqual([1200, 3], [t.val for t in asyncio.run(both())])
+
+    def test_parallel(self):
+        from lampy.parallel import _eval_job, normalize, split
+        from lampy.serialize import dumps, loads
+
+        n = 10000
+        term = lampy.Val(0)
+        for _ in range(n):
+            term = lampy.Appl(lampy.Lamb(lampy.Var("x"), lampy.BinOp("+", lampy.Var("x"), lampy.Val(1))), term)
+        self.assertEqual(repr(term), repr(loads(dumps(term))))
+        self.assertEqual(n, loads(_eval_job(dumps(term))).val)
+
+        church_ = parser.parse(CHURCH)[0].root
+        big = lampy.BinOp("+", lampy.BinOp("*", church_, church_), church_)
+        self.assertEqual(3, len(split(big, 50)))
+        self.assertEqual(1200 * 1200 + 1200, normalize(big, threshold=50, max_workers=2).val)
+        self.assertEqual(1200, normalize(church_, threshold=50, max_workers=2).val)
+        # nothing is reduced under a stuck application
+        stuck = parser.parse("(g (((x) => x + 1) 1)) (((y) => y * 2) 3);")[0].root
+        self.assertEqual(2, len(split(stuck, 3)))
+        self.assertEqual("g ((λx.x + 1) 1) ((λy.y * 2) 3)", repr(lampy.AST(stuck).eval()))
+        self.assertEqual("g ((λx.x + 1) 1) ((λy.y * 2) 3)", repr(normalize(stuck, threshold=3, max_workers=2)))
+
+    def test_graph(self):
+        from lampy import graph, bench
+
+        term = bench.shared_in_body(calls=4, n=4)
+        expected, subst = lampy.AST(term).eval(stats=True)
+        stats = utils.EvalStats()
+        res = graph.readback(graph.whnf(graph.to_graph(term), stats))
+        self.assertEqual(expected.val, res.val)
+        # the heavy subterm of the body is reduced once, not at every call
+        self.assertLess(stats.beta * 2, subst.beta)
+
+        rows = bench.run({"shared_argument": lambda: bench.shared_argument(2, 2)}, repeat=1)
+        self.assertEqual(["subst", "need", "graph", "vm"], [engine for _, engine, _ in rows])
+
+    def test_optimize(self):
+        from lampy import bench, optimize
+
+        for src in [
+            "((a, b) => a + (2 * 3)) 1 2;",
+            "((f) => f 1) ((x) => ((y) => y + 1) x);",
+            f"{bench.heavy(4)} + {bench.heavy(4)} + {bench.heavy(4)};",
+        ]:
+            ast = parser.parse(src)[0]
+            expected, before = ast.eval(stats=True)
+            optimized, reports = ast.optimize()
+            res, after = optimized.eval(stats=True)
+            self.assertEqual(expected.val, res.val)
+            self.assertTrue(reports)
+            self.assertLessEqual(after.steps, before.steps)
+
+        # the sum is computed once instead of three times
+        names = [r.name for r in reports]
+        self.assertIn("cse", names)
+        self.assertLess(after.steps * 2, before.steps)
+
+        # a diverging argument isn't a value, it's not dropped
+        omega = "((x) => x x) ((x) => x x)"
+        t, reports = optimize.optimize(parser.parse(f"((y) => 1) ({omega});")[0].root)
+        self.assertEqual([], reports)
+
+        ast = tparser.parse("((a: int, b: int) => a + (2 * 3)) 1 2;")[0]
+        optimized, reports = ast.optimize()
+        self.assertEqual(["fold", "dead"], [r.name for r in reports])
+        self.assertEqual(7, optimized.eval().val)
+
+    def test_specialize(self):
+        from lampy import specialize, nfcache
+
+        arith = parser.parse("(s, x, y) => s ((a, b) => a + b) ((a, b) => a * b) x y;")[0]
+        false = parser.parse("(t, f) => f;")[0]
+        mul = arith.specialize([false])
+        for x, y in [(2, 3), (4, 5)]:
+            data = [lampy.Val(x), lampy.Val(y)]
+            expected, before = lampy.AST(specialize.apply_static(arith.root, [false, *data])).eval(stats=True)
+            res, after = lampy.AST(specialize.apply_static(mul.root, data)).eval(stats=True)
+            self.assertEqual(x * y, res.val)
+            self.assertEqual(expected.val, res.val)
+            self.assertLess(after.steps, before.steps)
+
+        # a diverging argument is left alone, unfolding stops with the fuel
+        omega = "((x) => x x) ((x) => x x)"
+        t = specialize.specialize(parser.parse("(k, z) => k z;")[0], {"z": parser.parse(f"{omega};")[0]})
+        self.assertIsInstance(t, lampy.Lamb)
+        stats = utils.EvalStats()
+        specialize.peval(parser.parse(f"{omega};")[0].root, fuel=10, stats=stats)
+        self.assertEqual(10, stats.steps)
+
+        with self.assertRaises(ValueError):
+            arith.specialize({"q": 1})
+
+        cache = nfcache.NFCache()
+        arith.specialize([false], cache=cache)
+        parser.parse("(r, x, y) => r ((a, b) => a + b) ((a, b) => a * b) x y;")[0].specialize([false], cache=cache)
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+    def test_cycles(self):
+        from lampy import bench, fingerprint
+
+        omega = "((x) => x x) ((x) => x x)"
+        for src, period in [
+            (f"{omega};", 1),
+            (f"1 + ({omega});", 1),
+            ("((x) => ((y) => x x) 1) ((x) => ((y) => x x) 1);", 2),
+        ]:
+            with self.assertRaises(utils.Diverges) as cm:
+                parser.parse(src)[0].eval(detect_cycles=True)
+            self.assertEqual(period, cm.exception.period)
+
+        # terms that grow don't repeat, the fuel stops them
+        with self.assertRaises(utils.OutOfFuel):
+            parser.parse("((x) => x x x) ((x) => x x x);")[0].eval(detect_cycles=True, fuel=500)
+
+        ast = parser.parse(f"{bench.heavy(6)};")[0]
+        self.assertEqual(ast.eval().val, ast.eval(detect_cycles=True).val)
+        ast = tparser.parse("((a: int, b: int) => a + b) 1 2;")[0]
+        self.assertEqual(3, ast.eval(detect_cycles=True).val)
+
+        a = parser.parse("(x) => (y) => x y z;")[0].root
+        b = parser.parse("(y) => (x) => y x z;")[0].root
+        c = parser.parse("(y) => (x) => x y z;")[0].root
+        self.assertEqual(fingerprint.fingerprint(a), fingerprint.fingerprint(b))
+        self.assertNotEqual(fingerprint.fingerprint(a), fingerprint.fingerprint(c))
+        self.assertTrue(fingerprint.alpha_eq(a, b))
+        self.assertFalse(fingerprint.alpha_eq(a, c))
+
+    def test_arena(self):
+        from lampy import arena
+
+        n = 10000
+        body = lampy.Var("y")
+        for _ in range(n):
+            body = lampy.BinOp("+", body, lampy.Var("y"))
+        term = lampy.Appl(lampy.Lamb(lampy.Var("y"), body), lampy.Val(1))
+        ar = arena.Arena()
+        root = ar.add(term)
+        # the variables are built once
+        self.assertEqual(n + 4, len(ar))
+        self.assertLessEqual(ar.nbytes(), 21 * len(ar))
+        self.assertEqual(n + 1, ar.term(arena.evaluate(ar, root)).val)
+
+        mult = "((m) => (n) => (f) => m (n f))"
+        ast = parser.parse(f"{mult} ({church(2)}) ({church(3)}) ((x) => y x);")[0]
+        self.assertTrue(debruijn.alpha_eq(ast.eval(), ast.eval(engine="arena")))
+        root = ar.add(ast)
+        self.assertTrue(debruijn.alpha_eq(ast.root, ar.term(root)))
+
+        res = arena.evaluate(ar, root)
+        small, [new] = ar.compact([res])
+        self.assertLess(len(small), len(ar))
+        self.assertTrue(debruijn.alpha_eq(ar.term(res), small.term(new)))
+
+    def test_serialize(self):
+        import io
+        import os
+        import tempfile
+        import contextlib
+        from lampy import bench, serialize
+
+        for term in [parser.parse(bench.heavy(4) + ";")[0].root, bench.deep(5000)]:
+            data = serialize.dumps(term)
+            self.assertLess(len(data), 3 * term.size)
+            self.assertEqual(repr(term), repr(serialize.loads(data)))
+            self.assertEqual(repr(term), repr(serialize.loads(memoryview(bytearray(data)))))
+        self.assertEqual(5000, lampy.AST(serialize.loads(data)).eval().val)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "term.lmpy")
+            serialize.dump(term, path)
+            self.assertEqual(repr(term), repr(serialize.load(path)))
+
+        with self.assertRaises(ValueError):
+            serialize.loads(b"LMPY\x09\x00")
+
+        T = tlampy
+        for term in [
+            tparser.parse("((a: int, b: int) => a + b) 1 2;")[0].root,
+            T.Appl(
+                T.Lamb(T.Var("f", T.TypeArrow(int, int)), T.Appl(T.Var("f", T.TypeArrow(int, int)), T.Val(2, int))),
+                T.Lamb(T.Var("x", int), T.BinOp("+", T.Var("x", int), T.Val(1.5, float))),
+            ),
+        ]:
+            res = serialize.loads(serialize.dumps(term))
+            self.assertIsInstance(res, tlampy.Term)
+            self.assertEqual(repr(term), repr(res))
+            self.assertEqual(tlampy.AST(term).eval().val, tlampy.AST(res).eval().val)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            from lampy import hmlamb
+        for src in ["let id = (λx.x) in id a", "(λx:int.x) a"]:
+            term = hmlamb.lamb_parse(src)
+            self.assertEqual(repr(term), repr(serialize.loads(serialize.dumps(term))))
+
+        rows = bench.serialize({"small": lambda: bench.wide(4)}, repeat=1)
+        self.assertEqual(["dumps", "loads", "pickle.dumps", "pickle.loads"], [r[1] for r in rows])
+
+    def test_threads(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from lampy import bench
+        from lampy.parallel import eval_all
+
+        terms = [parser.parse(bench.heavy(n) + ";")[0] for n in range(2, 9)] * 4
+        serial = [repr(ast.eval(stats=True)) for ast in terms]
+        with ThreadPoolExecutor(8) as pool:
+            self.assertEqual(serial, [repr(r) for r in eval_all(terms, executor=pool, stats=True)])
+        self.assertEqual([r.val for r in eval_all(t.root for t in terms)], [ast.eval().val for ast in terms])
+
+        # the combinator table is loaded by the first thread that needs it
+        from lampy import church
+
+        church._table.clear()
+        church._seen.clear()
+        churchy = [parser.parse(CHURCH)[0] for _ in range(16)]
+        self.assertEqual([1200] * 16, [r.val for r in eval_all(churchy, max_workers=16, church=True)])
+        self.assertIsNotNone(church.combinator(church.combinator_term("plus")))
+
+        T = tlampy
+        x, y, z = T.Var("x", int), T.Var("y", int), T.Var("z", int)
+        # the inner x shadows the outer one
+        self.assertEqual("(λx:int.x:int)", repr(T.appl(T.Lamb(x, T.Lamb(x, x)), T.Val(1, int))))
+        # y is renamed so the y passed in stays free
+        capture = T.Lamb(x, T.Lamb(y, T.BinOp("+", x, T.BinOp("+", y, z))))
+        self.assertEqual("(λu:int.y:int + u:int + z:int)", repr(T.appl(capture, y)))
+
+    def test_vm(self):
+        from lampy import bench, vm
+
+        prog = vm.compile_term(parser.parse("((a, b) => a b) ((x) => x + 1) 2;")[0])
+        self.assertEqual(
+            ["CLOSURE", "CLOSURE", "PUSHVAL", "APPLY", "STOP", "GRAB", "ACCESS", "ACCESS", "APPTERM"],
+            [vm.NAMES[ins & 0xFF] for ins in prog.code][:9],
+        )
+        self.assertIn("fun 0 (λa, b)", vm.disassemble(prog))
+        self.assertEqual(3, vm.run(prog))
+
+        for input_, output in [
+            # partial and over application, open terms
+            ("((a, b, c) => a + b + c) 1 2;", "(λc.1 + 2 + c)"),
+            ("((a) => (b) => a + b) 1 2;", "3"),
+            ("((a, b) => b) f (g 1);", "g 1"),
+            ("((a) => a + z) 1;", "1 + z"),
+        ]:
+            self.assertEqual(output, repr(lampy.AST(parser.parse(input_)[0].root).eval(engine="vm")))
+
+        # deeper than the recursion limit, in the term and in the result
+        deep = lampy.Var("x")
+        for _ in range(5000):
+            deep = lampy.Appl(lampy.Var("f"), deep)
+        deep = lampy.Appl(lampy.Lamb(lampy.Var("x"), lampy.Lamb(lampy.Var("y"), deep)), lampy.Val(1))
+        for engine in ["vm", "cek", "need"]:
+            self.assertEqual(5000, lampy.AST(bench.deep(5000)).eval(engine=engine).val)
+            self.assertEqual(repr(lampy.AST(deep).eval()), repr(lampy.AST(deep).eval(engine=engine)))
+
+        rows = bench.bytecode({"small": lambda: parser.parse(bench.heavy(3) + ";")[0].root}, repeat=1)
+        self.assertEqual(["AST.eval", "vm.compile", "vm.run"], [r[1] for r in rows])
+
+    def test_module(self):
+        module = parser.parse("id = (x) => x; k = (a, b) => a; id 1;")
+        self.assertEqual(1, len(module))
+        self.assertEqual(["id", "k"], sorted(module.env))
+        self.assertEqual(1, module[0].eval().val)
+
+        # definitions are shared, not copied, and can use the earlier ones
+        self.assertIs(module.env["id"], module.parse("id;")[0].root)
+        module.parse("one = k 1 (id 2);")
+        self.assertEqual(1, module.env["one"].val)
+        self.assertEqual(3, parser.parse("one + 2;", module)[-1].eval().val)
+        self.assertEqual(3, len(module))
+
+        # parameters shadow definitions, undefined names stay free
+        self.assertEqual("2", repr(module.parse("((id) => id + 1) 1;")[0].eval()))
+        self.assertEqual("(λx.x) f 1", repr(module.parse("id f one;")[0].eval()))
+
+        # a value keeps the free names it had, even when they are defined later
+        module = parser.parse("a = (x) => b; b = 1; a b;")
+        self.assertEqual("(λx.b) 1", repr(module[0].root))
+        self.assertEqual("b", repr(module[0].eval()))
+
+        module = parser.Module(engine="vm")
+        module.parse(f"mult = (m, n, f) => m (n f); two = {church(2)};")
+        self.assertEqual(4, module.parse("mult two two ((x) => x + 1) 0;")[0].eval(engine="vm").val)